@@ -6,6 +6,7 @@ from instamatic.formats import write_tiff
 from instamatic import config
 from instamatic.camera import Camera
 from .microscope import Microscope
+from .state_cache import StateCache
 
 from typing import Tuple
 from contextlib import contextmanager
@@ -75,6 +76,13 @@ def get_instance() -> "TEMController":
 StagePositionTuple = namedtuple("StagePositionTuple", ["x", "y", "z", "a", "b"])
 DeflectorTuple = namedtuple("DeflectorTuple", ["x", "y"])
 
+# microscope parameters returned by `TEMController.to_dict`
+STATE_KEYS = ('FunctionMode', 'GunShift', 'GunTilt', 'BeamShift', 'BeamTilt', 'ImageShift1', 'ImageShift2', 
+              'DiffShift', 'StagePosition', 'Magnification', 'DiffFocus', 'Brightness', 'SpotSize')
+
+# seconds after which a value in the state cache is read again from the microscope
+STATE_TTL = {'StagePosition': 1.0}
+
 
 class Deflector(object):
     """Generic microscope deflector object defined by X/Y values
@@ -84,6 +92,7 @@ class Deflector(object):
         self._tem = tem
         self._getter = None
         self._setter = None
+        self._state = None
         self.key = "def"
 
     def __repr__(self):
@@ -96,9 +105,14 @@ class Deflector(object):
 
     def set(self, x: int, y: int):
         self._setter(x, y)
+        if self._state:
+            self._state.update(self.name, DeflectorTuple(x, y))
 
     def get(self) -> Tuple[int, int]:
-        return DeflectorTuple(*self._getter())
+        ret = DeflectorTuple(*self._getter())
+        if self._state:
+            self._state.update(self.name, ret)
+        return ret
 
     @property
     def x(self) -> int:
@@ -139,6 +153,7 @@ class Lens(object):
         self._tem = tem
         self._getter = None
         self._setter = None
+        self._state = None
         self.key = "lens"
         
     def __repr__(self):
@@ -154,9 +169,14 @@ class Lens(object):
 
     def set(self, value: int):
         self._setter(value)
+        if self._state:
+            self._state.update(self.name, value)
 
     def get(self) -> int:
-        return self._getter()
+        ret = self._getter()
+        if self._state:
+            self._state.update(self.name, ret)
+        return ret
 
     @property
     def value(self) -> int:
@@ -182,6 +202,8 @@ class DiffFocus(Lens):
         Turning it off results in a 2x speed-up in the call, but it will silently fail if the TEM is in the wrong mode.
         """
         self._setter(value, confirm_mode=confirm_mode)
+        if self._state:
+            self._state.update(self.name, value)
 
     def defocus(self, offset):
         """Apply a defocus to the IL1 lens, use `.refocus` to restore the previous setting"""
@@ -192,6 +214,8 @@ class DiffFocus(Lens):
             self._focused_value = current = self.get()
         except ValueError:
             self._tem.setFunctionMode("diff")
+            if self._state:
+                self._state.invalidate()
             self._focused_value = current = self.get()
 
         target = current + offset
@@ -246,6 +270,13 @@ class Magnification(Lens):
     @index.setter
     def index(self, index: int):
         self._indexsetter(index)
+        if self._state:
+            self._state.invalidate(self.name, "FunctionMode")
+
+    def set(self, value: int):
+        super().set(value)
+        if self._state:
+            self._state.invalidate("FunctionMode")
 
     def increase(self) -> None:
         try:
@@ -336,6 +367,8 @@ class Stage(object):
         self._setter = self._tem.setStagePosition
         self._getter = self._tem.getStagePosition
         self._wait = True  # properties only
+        self._state = None
+        self.key = "StagePosition"
         
     def __repr__(self):
         x, y, z, a, b = self.get()
@@ -348,6 +381,18 @@ class Stage(object):
     def set(self, x: int=None, y: int=None, z: int=None, a: int=None, b: int=None, wait: bool=True) -> None:
         """wait: bool, block until stage movement is complete (JEOL only)"""
         self._setter(x, y, z, a, b, wait=wait)
+        if self._state:
+            self._record(x, y, z, a, b, wait=wait)
+
+    def _record(self, x: int=None, y: int=None, z: int=None, a: int=None, b: int=None, wait: bool=True) -> None:
+        """Record the target position in the state cache if the movement has finished,
+        otherwise the cached position is invalidated"""
+        current = self._state.peek(self.key)
+        if wait and current is not None:
+            new = [cur if val is None else val for cur, val in zip(current, (x, y, z, a, b))]
+            self._state.update(self.key, StagePositionTuple(*new))
+        else:
+            self._state.invalidate(self.key)
         
     def set_with_speed(self, x: int=None, y: int=None, z: int=None, a: int=None, b: int=None, wait: bool=True, speed: float=1.0) -> None:
         """
@@ -355,6 +400,8 @@ class Stage(object):
         speed: float, set stage rotation with specified speed (FEI only)
         """
         self._setter(x, y, z, a, b, wait=wait, speed=speed)
+        if self._state:
+            self._record(x, y, z, a, b, wait=wait)
 
     def set_rotation_speed(self, speed=1) -> None:
         """Sets the stage (rotation) movement speed on the TEM"""
@@ -376,7 +423,10 @@ class Stage(object):
 
     def get(self) -> Tuple[int, int, int, int, int]:
         """Get stage positions; x, y, z, and status of the rotation axes; a, b"""
-        return StagePositionTuple(*self._getter())
+        ret = StagePositionTuple(*self._getter())
+        if self._state:
+            self._state.update(self.key, ret)
+        return ret
 
     @property
     def x(self) -> int:
@@ -492,6 +542,8 @@ class Stage(object):
     def stop(self) -> None:
         """This will halt the stage preemptively if `wait=False` is passed to Stage.set"""
         self._tem.stopStage()
+        if self._state:
+            self._state.invalidate(self.key)
 
     def alpha_wobbler(self, delta: float=5.0, event=None) -> None:
         """Tilt the stage by plus/minus the value of delta (degrees)
@@ -663,6 +715,12 @@ class TEMController(object):
         self.brightness = Brightness(tem)
         self.difffocus = DiffFocus(tem)
 
+        # Cache for the microscope state, use `ctrl.state.start()` to keep it up to date in the background
+        self.state = StateCache(read=self._read_state, keys=STATE_KEYS, ttl=STATE_TTL)
+        for obj in (self.gunshift, self.guntilt, self.beamshift, self.beamtilt, self.imageshift1, self.imageshift2, 
+                    self.diffshift, self.stage, self.magnification, self.brightness, self.difffocus):
+            obj._state = self.state
+
         self.autoblank = False
         self._saved_alignments = config.get_alignments()
 
@@ -705,18 +763,19 @@ class TEMController(object):
     @spotsize.setter
     def spotsize(self, value: int):
         self.tem.setSpotSize(value)
+        self.state.update("SpotSize", value)
 
     def mode_lowmag(self):
-        self.tem.setFunctionMode("lowmag")
+        self.mode = "lowmag"
 
     def mode_mag1(self):
-        self.tem.setFunctionMode("mag1")
+        self.mode = "mag1"
 
     def mode_samag(self):
-        self.tem.setFunctionMode("samag")
+        self.mode = "samag"
 
     def mode_diffraction(self):
-        self.tem.setFunctionMode("diff")
+        self.mode = "diff"
 
     @property
     def screen(self):
@@ -755,6 +814,7 @@ class TEMController(object):
     def mode(self, value: str):
         """Should be one of 'mag1', 'mag2', 'lowmag', 'samag', 'diff'"""
         self.tem.setFunctionMode(value)
+        self.state.invalidate()
 
     @property
     def beamblank(self):
@@ -773,7 +833,7 @@ class TEMController(object):
         aai = AcquireAtItems(ctrl, *args, **kwargs)
         aai.start()
 
-    def run_script_at_items(self, nav_items: list, script: str, backlash: bool=True) -> None:
+    def run_script_at_items(self, nav_items: list, script: str, backlash: bool=True, optimize_route: bool=False) -> None:
         """"Run the given script at all coordinates defined by the nav_items.
         
         Parameters
@@ -790,6 +850,8 @@ class TEMController(object):
 
         backlash: bool
             Toggle to move to each position with backlash correction
+        optimize_route: bool
+            Reorder the nav_items to minimize the stage travel
         """
         from instamatic.tools import find_script
         script = find_script(script)
@@ -816,7 +878,8 @@ class TEMController(object):
                               acquire=acquire, 
                               pre_acquire=pre_acquire, 
                               post_acquire=post_acquire, 
-                              backlash=backlash)
+                              backlash=backlash,
+                              optimize_route=optimize_route)
 
     def run_script(self, script: str, verbose: bool=True) -> None:
         """Run a custom python script with access to the `ctrl` object. It will check
@@ -871,7 +934,7 @@ class TEMController(object):
 
         return stagematrix
 
-    def align_to(self, ref_img: "np.array", 
+    def align_to(self, ref_img: "np.array | Registrator", 
                        apply: bool= True,
                        verbose: bool=True) -> list:
         """Align current view by comparing it against the given image using
@@ -880,8 +943,9 @@ class TEMController(object):
         
         Parameters
         ----------
-        ref_img: np.array
-            Reference image that the microscope will be aligned to
+        ref_img: np.array or Registrator
+            Reference image that the microscope will be aligned to. When aligning repeatedly
+            to the same image, pass a `Registrator` so that its spectrum is computed only once.
         apply: bool
             Toggle to translate the stage to center the image
         verbose: bool
@@ -893,7 +957,10 @@ class TEMController(object):
             The stage shift vector determined from cross correlation
             
         """
-        from instamatic.processing.cross_correlate import cross_correlate
+        from instamatic.processing.cross_correlate import Registrator
+
+        if not isinstance(ref_img, Registrator):
+            ref_img = Registrator(ref_img, upsample_factor=10)
 
         current_x, current_y = self.stage.xy
         print(f"Current stage position: {current_x:.0f} {current_y:.0f}")
@@ -902,7 +969,11 @@ class TEMController(object):
 
         img = self.getRawImage()
 
-        pixel_shift = cross_correlate(ref_img, img, upsample_factor=10, verbose=verbose)
+        pixel_shift, error, diffphase = ref_img.register(img)
+        if verbose:
+            print("Detected shift:", pixel_shift)
+            print("Error:", error)
+            print("Global phase difference:", diffphase)
 
         stage_shift = np.dot(pixel_shift, mati)
 
@@ -951,7 +1022,9 @@ class TEMController(object):
         z: float
             Optimized Z value for eucentric tilting
         """
-        from instamatic.processing.cross_correlate import cross_correlate
+        from instamatic.processing.cross_correlate import Registrator
+
+        registrator = None
 
         def one_cycle(tilt: float=5, sign=1) -> list:
             angle1 = -tilt*sign
@@ -965,7 +1038,18 @@ class TEMController(object):
             if sign < 1:
                 img2, img1 = img1, img2
 
-            shift = cross_correlate(img1, img2, upsample_factor=10, verbose=verbose)
+            # the images have the same shape every cycle, so the kernels are reused
+            nonlocal registrator
+            if registrator is None:
+                registrator = Registrator(img1, upsample_factor=10)
+            else:
+                registrator.set_reference(img1)
+
+            shift, error, diffphase = registrator.register(img2)
+            if verbose:
+                print("Detected shift:", shift)
+                print("Error:", error)
+                print("Global phase difference:", diffphase)
 
             return shift
 
@@ -1005,15 +1089,37 @@ class TEMController(object):
 
         return z0
 
-    def to_dict(self, *keys) -> dict:
+    def to_dict(self, *keys, cached: bool=None, fresh: tuple=()) -> dict:
         """
         Store microscope parameters to dict
 
         keys: tuple of str (optional)
             If any keys are specified, dict is returned with only the given properties
+        cached: bool
+            Return the values from the state cache (`self.state`), only stale values are read from the microscope.
+            The dict then also contains the time of the oldest value under `StateTimestamp`.
+            Defaults to True if the state cache is updated in the background (see `self.state.start()`)
+        fresh: tuple of str
+            Keys that are always read from the microscope, even if a cached value is available
         
         self.to_dict('all') or self.to_dict() will return all properties
         """
+
+        if "all" in keys or not keys:
+            keys = STATE_KEYS
+
+        if cached is None:
+            cached = self.state.is_polling
+
+        if cached:
+            dct, timestamp = self.state.snapshot(keys, fresh=fresh)
+            dct["StateTimestamp"] = timestamp
+            return dct
+        else:
+            return self._read_state(keys)
+
+    def _read_state(self, keys: tuple) -> dict:
+        """Read the microscope parameters given by `keys` from the microscope, see `to_dict`"""
         
         ## Each of these costs about 40-60 ms per call on a JEOL 2100, stage is 265 ms per call
         funcs = { 
@@ -1032,10 +1138,10 @@ class TEMController(object):
             'SpotSize': self.tem.getSpotSize
         }
 
-        dct = {}
+        if hasattr(self.tem, "batch"):
+            return self._read_state_batch(keys)
 
-        if "all" in keys or not keys:
-            keys = funcs.keys()
+        dct = {}
 
         for key in keys:
             try:
@@ -1046,6 +1152,39 @@ class TEMController(object):
 
         return dct
 
+    def _read_state_batch(self, keys: list) -> dict:
+        """Read the microscope parameters given by `keys` in a single round trip to the TEM server"""
+        getters = {
+            'FunctionMode': ('getFunctionMode', None),
+            'GunShift': ('getGunShift', DeflectorTuple),
+            'GunTilt': ('getGunTilt', DeflectorTuple),
+            'BeamShift': ('getBeamShift', DeflectorTuple),
+            'BeamTilt': ('getBeamTilt', DeflectorTuple),
+            'ImageShift1': ('getImageShift1', DeflectorTuple),
+            'ImageShift2': ('getImageShift2', DeflectorTuple),
+            'DiffShift': ('getDiffShift', DeflectorTuple),
+            'StagePosition': ('getStagePosition', StagePositionTuple),
+            'Magnification': ('getMagnification', None),
+            'DiffFocus': ('getDiffFocus', None),
+            'Brightness': ('getBrightness', None),
+            'SpotSize': ('getSpotSize', None)
+        }
+
+        results = self.tem.batch([(getters[key][0],) for key in keys], return_exceptions=True)
+
+        dct = {}
+
+        for key, ret in zip(keys, results):
+            if isinstance(ret, ValueError):
+                continue
+            elif isinstance(ret, Exception):
+                raise ret
+
+            wrapper = getters[key][1]
+            dct[key] = wrapper(*ret) if wrapper else ret
+
+        return dct
+
     def from_dict(self, dct: dict):
         """Restore microscope parameters from dict"""
 
@@ -1066,7 +1205,7 @@ class TEMController(object):
         }
 
         mode = dct["FunctionMode"]
-        self.tem.setFunctionMode(mode)
+        self.mode = mode
 
         for k, v in dct.items():
             if k in funcs:
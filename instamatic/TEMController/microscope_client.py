@@ -1,10 +1,10 @@
 import socket
-import pickle
 import time
 import atexit
 from functools import wraps
 import subprocess as sp
 from instamatic import config
+from instamatic.server.serializer import send_message, recv_message
 
 import datetime
 import threading
@@ -45,6 +45,11 @@ class MicroscopeClient(object):
         self.name = name
         self._bufsize = BUFSIZE
 
+        self._request_id = 0
+        self._responses = {}
+        self._send_lock = threading.Lock()
+        self._recv_lock = threading.Lock()
+
         try:
             self.connect()
         except ConnectionRefusedError:
@@ -91,11 +96,13 @@ class MicroscopeClient(object):
         """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'"""
         # t0 = time.perf_counter()
 
-        self.s.send(pickle.dumps(dct))
-        response = self.s.recv(self._bufsize)
-        if response:
-            status, data = pickle.loads(response)
+        request_id = self._send(dct)
+        status, data = self._receive(request_id)
+
+        return self._parse_response(status, data)
 
+    def _parse_response(self, status: int, data):
+        """Return the data, or raise the exception if the call failed"""
         if status == 200:
             return data
 
@@ -105,6 +112,78 @@ class MicroscopeClient(object):
         else:
             raise ConnectionError(f"Unknown status code: {status}")
 
+    def _send(self, dct: dict) -> int:
+        """Send the request `dct` to the server without waiting for the response.
+        Returns the request id that can be used to obtain the response with `_receive`"""
+        with self._send_lock:
+            self._request_id += 1
+            request_id = dct["id"] = self._request_id
+            send_message(self.s, dct)
+
+        return request_id
+
+    def _receive(self, request_id: int) -> (int, object):
+        """Wait for the response to the request with `request_id`. Responses to
+        other requests that arrive in the meantime are stored until they are requested.
+        Returns the status code and the data."""
+        with self._recv_lock:
+            while request_id not in self._responses:
+                response = recv_message(self.s)
+                if response is None:
+                    raise ConnectionError("Connection to TEM server was closed")
+                
+                response_id, status, data = response
+                self._responses[response_id] = (status, data)
+
+            return self._responses.pop(request_id)
+
+    def submit(self, func_name: str, *args, **kwargs) -> int:
+        """Send the call `func_name(*args, **kwargs)` to the server without waiting for the result.
+        Several calls can be outstanding at the same time, and are evaluated in order.
+        Returns the request id, use `.result(request_id)` to obtain the return value.
+
+        Usage:
+            request_ids = [tem.submit("getBeamShift"), tem.submit("getStagePosition")]
+            beamshift, stageposition = [tem.result(request_id) for request_id in request_ids]
+        """
+        dct = {"func_name": func_name,
+               "args": args,
+               "kwargs": kwargs}
+        return self._send(dct)
+
+    def result(self, request_id: int):
+        """Wait for the return value of the call with `request_id` (see `.submit`)"""
+        status, data = self._receive(request_id)
+        return self._parse_response(status, data)
+
+    def batch(self, calls: list, return_exceptions: bool=False) -> list:
+        """Send a list of calls to the server as a single message, and return all results
+        in one round trip. Every call is a tuple of (func_name, [args, [kwargs]]).
+
+        If `return_exceptions` is True, exceptions raised by the calls are returned in
+        place of the result, otherwise the first exception is raised.
+
+        Usage:
+            beamshift, stageposition = tem.batch([("getBeamShift",), ("getStagePosition",)])
+            tem.batch([("setBeamShift", (1000, 2000)), ("setStagePosition", (), {"x": 0, "y": 0})])
+        """
+        batch = []
+        for call in calls:
+            func_name = call[0]
+            args = call[1] if len(call) > 1 else ()
+            kwargs = call[2] if len(call) > 2 else {}
+            batch.append({"func_name": func_name,
+                          "args": args,
+                          "kwargs": kwargs})
+
+        request_id = self._send({"batch": batch})
+        results = self.result(request_id)
+
+        if return_exceptions:
+            return [data for status, data in results]
+        else:
+            return [self._parse_response(status, data) for status, data in results]
+
     def _init_dict(self):
         from instamatic.TEMController.microscope import get_tem
         tem = get_tem(self.name)
@@ -0,0 +1,151 @@
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+# placeholder for values that could not be read (i.e. DiffFocus in mag1 mode)
+UNAVAILABLE = object()
+
+
+class StateCache(object):
+    """Timestamped snapshot of the microscope state.
+
+    Values are stored when they are written or read through the `TEMController`, and
+    re-read from the microscope once they are older than their time-to-live. A background
+    thread can be started to refresh stale values, so that a snapshot (i.e. for the image header)
+    can be returned without waiting for the microscope.
+
+    read: function that takes a list of keys and returns a dict with the values read from the
+          microscope, keys that cannot be read are left out
+    keys: the keys stored in the cache
+    ttl: dict with the time-to-live for each key in seconds (falls back to `default_ttl`)
+    default_ttl: time-to-live in seconds for keys not in `ttl`
+    """
+    def __init__(self, read, keys: tuple, ttl: dict=None, default_ttl: float=2.0):
+        super().__init__()
+        self.read = read
+        self.keys = tuple(keys)
+        self.ttl = {key: default_ttl for key in self.keys}
+        if ttl:
+            self.ttl.update(ttl)
+
+        self._values = {}
+        self._lock = threading.Lock()
+
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(keys={len(self._values)}/{len(self.keys)}, polling={self.is_polling})"
+
+    def update(self, key: str, value) -> None:
+        """Store `value` for `key` with the current time"""
+        with self._lock:
+            self._values[key] = (time.time(), value)
+
+    def invalidate(self, *keys) -> None:
+        """Remove `keys` from the cache, so that they are read on the next access.
+        If no keys are given, the cache is cleared."""
+        with self._lock:
+            if not keys:
+                self._values.clear()
+            for key in keys:
+                self._values.pop(key, None)
+
+    def peek(self, key: str):
+        """Return the cached value for `key` regardless of its age, or None if not available"""
+        with self._lock:
+            t, value = self._values.get(key, (None, None))
+        return None if value is UNAVAILABLE else value
+
+    def stale_keys(self, keys: tuple=None) -> list:
+        """Return the keys that are missing from the cache or older than their time-to-live"""
+        if keys is None:
+            keys = self.keys
+        now = time.time()
+        with self._lock:
+            return [key for key in keys if key not in self._values or now - self._values[key][0] > self.ttl[key]]
+
+    def refresh(self, keys: tuple) -> dict:
+        """Read `keys` from the microscope and store them in the cache,
+        returns a dict with the current (time, value) for each key.
+
+        The values are stored with the time the read started. Values that were stored
+        while the read was in progress (i.e. by a setter through `update`) are newer,
+        and are kept."""
+        if not keys:
+            return {}
+        t_read = time.time()
+        dct = self.read(keys)
+        entries = {}
+        with self._lock:
+            for key in keys:
+                entry = self._values.get(key)
+                if entry is None or entry[0] < t_read:
+                    entry = self._values[key] = (t_read, dct.get(key, UNAVAILABLE))
+                entries[key] = entry
+        return entries
+
+    def snapshot(self, keys: tuple=None, fresh: tuple=()) -> (dict, float):
+        """Return a dict with the values of `keys` (default: all), and the time
+        of the oldest value in the snapshot. Only stale values are read from the microscope.
+
+        fresh: tuple of keys that are always read from the microscope
+        """
+        if keys is None:
+            keys = self.keys
+
+        stale = self.stale_keys(keys)
+        entries = self.refresh([key for key in keys if key in fresh or key in stale])
+
+        with self._lock:
+            for key in keys:
+                if key not in entries:
+                    entries[key] = self._values.get(key)
+
+        # keys invalidated by another thread in the meantime are read directly
+        missing = [key for key in keys if entries[key] is None]
+        entries.update(self.refresh(missing))
+
+        dct = {}
+        timestamp = time.time()
+        for key in keys:
+            t, value = entries[key]
+            timestamp = min(t, timestamp)
+            if value is not UNAVAILABLE:
+                dct[key] = value
+
+        return dct, timestamp
+
+    @property
+    def is_polling(self) -> bool:
+        """Return True if the background thread is refreshing the cache"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float=0.1) -> None:
+        """Start a background thread that checks every `interval` seconds for stale
+        values and reads them from the microscope.
+
+        Note that the microscope is then accessed from a different thread than the main thread,
+        which should only be used with the TEM server (`use_tem_server: True`)."""
+        if self.is_polling:
+            return
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll, args=(interval,), name="StateCache", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def _poll(self, interval: float) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.refresh(self.stale_keys())
+            except Exception as e:
+                logger.exception(e)
+            self._stop_event.wait(interval)
@@ -1,3 +1,118 @@
+import time
+import numpy as np
+
+# Settings for the route planner, used to predict the travel time
+BACKLASH_STEP = 10000   # nm, see `Stage.set_xy_with_backlash_correction`
+SETTLE_DELAY = 0.200    # s, delay after each backlash corrected movement
+STAGE_SPEED = 50_000    # nm/s, rough estimate of the stage speed
+
+
+def travel_cost_matrix(xy: np.ndarray, step: float=BACKLASH_STEP) -> (np.ndarray, np.ndarray):
+    """Travel distance (nm) between all pairs of positions, `cost[i, j]` is the distance from i to j.
+
+    With backlash correction, the target is always approached from `-step` in x and y. A direct move
+    has the same final approach if the target lies at least `step` above/right of the start,
+    otherwise the stage makes a detour via the pre-position. Set `step=None` to ignore backlash.
+
+    Returns: cost matrix, boolean matrix of moves that need the backlash detour"""
+    xy = np.asarray(xy, dtype=float)
+    d = xy[None, :, :] - xy[:, None, :]
+    direct = np.hypot(d[..., 0], d[..., 1])
+
+    if not step:
+        return direct, np.zeros(direct.shape, dtype=bool)
+
+    detour = np.any(d < step, axis=-1)
+    pre = d - step
+    cost = np.where(detour, np.hypot(pre[..., 0], pre[..., 1]) + step * np.sqrt(2), direct)
+
+    return cost, detour
+
+
+def _nearest_neighbour(cost: np.ndarray, start: int=0) -> list:
+    n = len(cost)
+    route = [start]
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, cost[route[-1]])
+        nxt = int(np.argmin(row))
+        route.append(nxt)
+        visited[nxt] = True
+    return route
+
+
+def _two_opt(cost: np.ndarray, route: list, max_passes: int=50) -> list:
+    """Improve an open route with fixed ends by reversing segments (2-opt).
+    The cost matrix may be asymmetric, the cost of the reversed segment is taken from
+    prefix sums of the forward and backward costs along the route."""
+    route = np.array(route)
+    n = len(route)
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 2):
+            fwd = np.concatenate(([0], np.cumsum(cost[route[:-1], route[1:]])))
+            bwd = np.concatenate(([0], np.cumsum(cost[route[1:], route[:-1]])))
+
+            j = np.arange(i + 1, n - 1)
+            a, ri, rj, b = route[i - 1], route[i], route[j], route[j + 1]
+            delta = (cost[a, rj] + cost[ri, b] - cost[a, ri] - cost[rj, b]
+                     + (bwd[j] - bwd[i]) - (fwd[j] - fwd[i]))
+
+            k = np.argmin(delta)
+            if delta[k] < -1e-6:
+                route[i:j[k] + 1] = route[i:j[k] + 1][::-1]
+                improved = True
+        if not improved:
+            break
+
+    return route.tolist()
+
+
+def plan_route(xy: np.ndarray, start: tuple=None, step: float=BACKLASH_STEP) -> list:
+    """Find a short order to visit the stage positions `xy` (N x 2, nm), starting from `start`.
+
+    This approximates the (asymmetric) traveling salesman problem with a nearest neighbour
+    tour refined by 2-opt. The costs include the backlash detours (see `travel_cost_matrix`),
+    so the route prefers moves that approach the next position from the backlash direction.
+
+    Returns: list of indices into `xy`"""
+    xy = np.asarray(xy, dtype=float)
+    n = len(xy)
+    if n < 2:
+        return list(range(n))
+
+    if start is None:
+        start = xy[0]
+
+    # node 0 is the start position, node n+1 a virtual end point that can be reached from anywhere at no cost
+    cost = np.zeros((n + 2, n + 2))
+    cost[:n + 1, :n + 1] = travel_cost_matrix(np.vstack((start, xy)), step=step)[0]
+
+    route = _nearest_neighbour(cost[:n + 1, :n + 1], start=0) + [n + 1]
+    route = _two_opt(cost, route)
+
+    return [node - 1 for node in route[1:-1]]
+
+
+def predict_travel(xy: np.ndarray, start: tuple=None, step: float=BACKLASH_STEP,
+                   speed: float=STAGE_SPEED, settle_delay: float=SETTLE_DELAY) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Predict the travel distance (nm) and time (s) to visit the positions `xy` in order.
+
+    Returns: distance, time, and whether the backlash detour is needed for every move"""
+    xy = np.asarray(xy, dtype=float)
+    if start is None:
+        start = xy[0]
+    path = np.vstack((start, xy))
+    cost, detour = travel_cost_matrix(path, step=step)
+    idx = np.arange(len(xy))
+    distance = cost[idx, idx + 1]
+    backlash = detour[idx, idx + 1]
+    t = distance / speed + np.where(backlash, 2, 1) * settle_delay
+    return distance, t, backlash
+
+
 
 
 class AcquireAtItems(object):
@@ -17,6 +132,12 @@ class AcquireAtItems(object):
         This function is run after the last acquisition item has run.
     backlash: bool
         Move the stage with backlash correction.
+    optimize_route: bool
+        Reorder the nav_items to minimize the stage travel (see `plan_route`). Moves that
+        approach the next item from the backlash direction are made without the backlash detour.
+    log_travel: bool
+        Compare the stage travel with the prediction also if the route is not optimized.
+        This reads the stage position before and after every move, which is slow on some microscopes.
 
     Returns
     -------
@@ -28,7 +149,9 @@ class AcquireAtItems(object):
                        acquire=None, 
                        pre_acquire=None, 
                        post_acquire=None, 
-                       backlash: bool=True):
+                       backlash: bool=True,
+                       optimize_route: bool=False,
+                       log_travel: bool=False):
         super(AcquireAtItems, self).__init__()
         
         self.nav_items = nav_items
@@ -47,6 +170,29 @@ class AcquireAtItems(object):
             self.post_acquire = post_acquire
 
         self.backlash = backlash
+        self.log_travel = log_travel
+
+        self.route = None
+        self.travel_log = []
+        if optimize_route:
+            self.optimize_route()
+
+    def optimize_route(self):
+        """Reorder the nav_items to minimize the stage travel, starting from the current stage position"""
+        xy = np.array([(item.stage_x, item.stage_y) for item in self.nav_items]) * 1000  # um -> nm
+        start = self.ctrl.stage.xy
+        step = BACKLASH_STEP if self.backlash else None
+
+        distance_before = predict_travel(xy, start=start, step=step)[0].sum()
+
+        order = plan_route(xy, start=start, step=step)
+        self.nav_items = [self.nav_items[i] for i in order]
+
+        distance, t, backlash = predict_travel(xy[order], start=start, step=step)
+        self.route = {"distance": distance, "time": t, "backlash": backlash}
+
+        print(f"Route: {distance_before/1000:.0f} um -> {distance.sum()/1000:.0f} um, "
+              f"{backlash.sum()}/{len(backlash)} backlash moves, predicted travel time {t.sum():.0f} s")
 
     def pre_acquire(self, ctrl):
         """Function called after the last NavItem"""
@@ -60,24 +206,53 @@ class AcquireAtItems(object):
         """Function to call at each stage position"""
         print("Acquirement function has not been set.")
 
-    def move_to_item(self, item):
-        """Move the stage to the stage coordinates given by the NavItem"""
+    def move_to_item(self, item, current: tuple=None) -> bool:
+        """Move the stage to the stage coordinates given by the NavItem
+
+        If the route is optimized and the `current` stage position (nm) lies below/left
+        of the item by at least the backlash step, the item is approached from the backlash
+        direction anyway and the stage is moved directly.
+
+        Returns: True if the stage made the backlash correction detour"""
         x = item.stage_x * 1000  # um -> nm
         y = item.stage_y * 1000  # um -> nm
         z = item.stage_z * 1000  # um -> nm
 
         self.ctrl.stage.set(z=z)
 
-        if self.backlash:
-            set_xy = self.ctrl.stage.set_xy_with_backlash_correction
-        else:
-            set_xy = self.ctrl.stage.set
+        if not self.backlash:
+            self.ctrl.stage.set(x=x, y=y)
+            return False
 
-        set_xy(x=x, y=y)
+        if self.route is not None and current is not None:
+            if x - current[0] >= BACKLASH_STEP and y - current[1] >= BACKLASH_STEP:
+                self.ctrl.stage.set(x=x, y=y)
+                time.sleep(SETTLE_DELAY)
+                return False
+
+        self.ctrl.stage.set_xy_with_backlash_correction(x=x, y=y, step=BACKLASH_STEP, settle_delay=SETTLE_DELAY)
+        return True
+
+    def report_travel(self):
+        """Print the predicted and the estimated stage travel, and the predicted and measured move time.
+        The travel is estimated from the positions before and after every move, the backlash
+        detour is not measured but assumed to go via the pre-position."""
+        if not self.travel_log:
+            return
+
+        n = len(self.travel_log)
+        predicted_distance = sum(log["predicted_distance"] for log in self.travel_log)
+        estimated_distance = sum(log["estimated_distance"] for log in self.travel_log)
+        predicted_time = sum(log["predicted_time"] for log in self.travel_log)
+        measured_time = sum(log["measured_time"] for log in self.travel_log)
+        n_backlash = sum(log["backlash"] for log in self.travel_log)
+
+        print(f"Stage travel (predicted/estimated): {predicted_distance/1000:.0f}/{estimated_distance/1000:.0f} um "
+              f"| move time (predicted/measured): {predicted_time/n:.2f}/{measured_time/n:.2f} s/item "
+              f"| {n_backlash}/{n} backlash moves")
 
     def start(self):
         """Start serial acquisition protocol"""
-        import time
         import msvcrt
 
         ctrl = self.ctrl
@@ -90,6 +265,20 @@ class AcquireAtItems(object):
 
         self.pre_acquire
 
+        # reading the stage position is slow on some microscopes (~0.25 s on a JEOL),
+        # so it is only tracked for the optimized route or when the travel is logged
+        track = self.route is not None or self.log_travel
+        current = np.array(ctrl.stage.xy) if track else None
+
+        if self.route is None and track:
+            xy = np.array([(item.stage_x, item.stage_y) for item in nav_items]) * 1000  # um -> nm
+            distance, t, backlash = predict_travel(xy, start=current, step=BACKLASH_STEP if self.backlash else None)
+            predicted = {"distance": distance, "time": t}
+        else:
+            predicted = self.route
+
+        self.travel_log = []
+
         t0 = t_last = time.perf_counter()
         eta = 0
         last_interval = interval = 1
@@ -100,7 +289,29 @@ class AcquireAtItems(object):
         
             print(f"{i}/{ntot} - `{item}` -> (ETA: {eta:.0f} min)")
             
-            self.move_to_item(item)
+            t_move = time.perf_counter()
+            backlash = self.move_to_item(item, current=current)
+            t_move = time.perf_counter() - t_move
+
+            if track:
+                new = np.array(ctrl.stage.xy)
+
+                if backlash:
+                    # estimate, assumes the stage went via the pre-position at -BACKLASH_STEP
+                    estimated_distance = np.linalg.norm(new - BACKLASH_STEP - current) + BACKLASH_STEP * np.sqrt(2)
+                else:
+                    estimated_distance = np.linalg.norm(new - current)
+
+                self.travel_log.append({
+                    "item": item,
+                    "predicted_distance": predicted["distance"][i],
+                    "estimated_distance": estimated_distance,
+                    "predicted_time": predicted["time"][i],
+                    "measured_time": t_move,
+                    "backlash": backlash
+                })
+
+                current = new
 
             try:
                 self.acquire(ctrl)
@@ -129,4 +340,5 @@ class AcquireAtItems(object):
         dt = t1-t0
         n_items = i+1
         print(f"Total time taken: {dt:.0f} s for {n_items} items ({dt/n_items:.2f} s/item)")
+        self.report_travel()
         print("\nAll done!")
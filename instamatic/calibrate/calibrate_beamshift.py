@@ -5,7 +5,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from instamatic.tools import *
-from instamatic.processing.cross_correlate import cross_correlate
+from instamatic.processing.cross_correlate import Registrator
 from instamatic.TEMController import initialize
 from .fit import fit_affine_transformation
 from .filenames import *
@@ -167,6 +167,8 @@ def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=Fal
     x_grid, y_grid = np.meshgrid(np.arange(-n, n+1) * stepsize, np.arange(-n, n+1) * stepsize)
     tot = gridsize*gridsize
 
+    registrator = Registrator(img_cent, upsample_factor=10)
+
     i = 0
     for dx,dy in np.stack([x_grid, y_grid]).reshape(2,-1).T:
         ctrl.beamshift.set(x=x_cent+dx, y=y_cent+dy)
@@ -179,7 +181,7 @@ def calibrate_beamshift_live(ctrl, gridsize=None, stepsize=None, save_images=Fal
         img, h = ctrl.getImage(exposure=exposure, binsize=binsize, out=outfile, comment=comment, header_keys="BeamShift")
         img = imgscale(img, scale)
 
-        shift = cross_correlate(img_cent, img, upsample_factor=10, verbose=False)
+        shift = registrator(img)
         
         beamshift = np.array(h["BeamShift"])
         beampos.append(beamshift)
@@ -235,6 +237,8 @@ def calibrate_beamshift_from_image_fn(center_fn, other_fn):
     
     shifts = []
     beampos = []
+
+    registrator = Registrator(img_cent, upsample_factor=10)
     
     for fn in other_fn:
         img, h = load_img(fn)
@@ -245,7 +249,7 @@ def calibrate_beamshift_from_image_fn(center_fn, other_fn):
         print("Image:", fn)
         print("Beamshift: x={} | y={}".format(*beamshift))
         
-        shift = cross_correlate(img_cent, img, upsample_factor=10, verbose=False)
+        shift = registrator(img)
         
         beampos.append(beamshift)
         shifts.append(shift)
@@ -1,65 +1,280 @@
 import numpy as np
-import lmfit
+from numpy.polynomial import polynomial as P
 from instamatic.tools import *
 
+# The transformation is `b = np.dot(a, r) + t`, with
+#
+#   r = [[ sx*cos, -sy*k1*sin],
+#        [ sx*k2*sin,  sy*cos]]
+#   t = [tx, ty]
+#
+# `fit_affine_transformation` solves the least squares problem directly for every combination
+# of free parameters that occurs in the calibrations. For fixed translation this is a linear
+# problem in `r`, which is solved after subtracting the centroids (free translation) or `t`.
+# Without shear, the scales follow from the angle, and the optimal angle is a root of a
+# polynomial. lmfit is only needed for the (rare) combination of shear with a fixed rotation
+# or scaling, or when `refine=True`.
 
-def fit_affine_transformation(a, b, rotation=True, scaling=True, translation=False, shear=False, as_params=False, verbose=False, **x0):
-    params = lmfit.Parameters()
-    params.add("angle", value=x0.get("angle", 0), vary=rotation, min=-np.pi, max=np.pi)
-    params.add("sx"   , value=x0.get("sx"   , 1), vary=scaling)
-    params.add("sy"   , value=x0.get("sy"   , 1), vary=scaling)
-    params.add("tx"   , value=x0.get("tx"   , 0), vary=translation)
-    params.add("ty"   , value=x0.get("ty"   , 0), vary=translation)
-    params.add("k1"   , value=x0.get("k1"   , 1), vary=shear)
-    params.add("k2"   , value=x0.get("k2"   , 1), vary=shear)
-    
-    def objective_func(params, arr1, arr2):
-        angle = params["angle"].value
-        sx    = params["sx"].value
-        sy    = params["sy"].value 
-        tx    = params["tx"].value
-        ty    = params["ty"].value
-        k1    = params["k1"].value
-        k2    = params["k2"].value
-        
-        sin = np.sin(angle)
-        cos = np.cos(angle)
-
-        r = np.array([
-            [ sx*cos, -sy*k1*sin],
-            [ sx*k2*sin,  sy*cos]])
-        t = np.array([tx, ty])
+PARAMETERS = ("angle", "sx", "sy", "tx", "ty", "k1", "k2")
 
-        fit = np.dot(arr1, r) + t
-        return fit-arr2
-    
-    method = "leastsq"
-    args = (a, b)
-    res = lmfit.minimize(objective_func, params, args=args, method=method)
-    
-    if res.success and not verbose:
-        print(f"Minimization converged after {res.nfev} cycles with chisqr of {res.chisqr}")
-    else:
-        lmfit.report_fit(res)
-
-    angle = res.params["angle"].value
-    sx    = res.params["sx"].value
-    sy    = res.params["sy"].value 
-    tx    = res.params["tx"].value
-    ty    = res.params["ty"].value
-    k1    = res.params["k1"].value
-    k2    = res.params["k2"].value
-    
+
+def affine_matrix(angle: float=0, sx: float=1, sy: float=1, k1: float=1, k2: float=1) -> np.ndarray:
+    """Return the 2x2 transformation matrix `r` for the given parameters"""
     sin = np.sin(angle)
     cos = np.cos(angle)
-    
-    r = np.array([
+
+    return np.array([
         [ sx*cos, -sy*k1*sin],
         [ sx*k2*sin,  sy*cos]])
-    t = np.array([tx, ty])
-    
-    if as_params:
-        return res.params
+
+
+def _wrap_angle(angle: float) -> float:
+    return (angle + np.pi) % (2*np.pi) - np.pi
+
+
+def _scales(A: np.ndarray, C: np.ndarray, angle: float) -> (float, float):
+    """Optimal scales for a fixed angle, `A = a.T.a`, `C = a.T.b`"""
+    u1 = np.array([np.cos(angle), np.sin(angle)])
+    u2 = np.array([-np.sin(angle), np.cos(angle)])
+    sx = u1.dot(C[:, 0]) / u1.dot(A).dot(u1)
+    sy = u2.dot(C[:, 1]) / u2.dot(A).dot(u2)
+    return sx, sy
+
+
+def _fit_rotation_scaling(A: np.ndarray, C: np.ndarray) -> float:
+    """Angle for the fit with free rotation and scaling (no shear)
+
+    With the optimal scales, the sum of squares is minimized by maximizing
+    S(t) = n1/d1 + n2/d2 with t = tan(angle), where the n's and d's are quadratic
+    polynomials in t. The stationary points are the roots of a polynomial of degree 6."""
+    n1 = P.polypow([C[0, 0], C[1, 0]], 2)
+    d1 = [A[0, 0], 2*A[0, 1], A[1, 1]]
+    n2 = P.polypow([C[1, 1], -C[0, 1]], 2)
+    d2 = [A[1, 1], -2*A[0, 1], A[0, 0]]
+
+    def diff(n, d):
+        return P.polysub(P.polymul(P.polyder(n), d), P.polymul(n, P.polyder(d)))
+
+    poly = P.polyadd(P.polymul(diff(n1, d1), P.polypow(d2, 2)),
+                     P.polymul(diff(n2, d2), P.polypow(d1, 2)))
+
+    candidates = [np.pi / 2]
+    if np.any(poly):
+        candidates.extend(np.arctan(P.polyroots(poly).real))
+
+    def score(angle):
+        u1 = np.array([np.cos(angle), np.sin(angle)])
+        u2 = np.array([-np.sin(angle), np.cos(angle)])
+        return u1.dot(C[:, 0])**2 / u1.dot(A).dot(u1) + u2.dot(C[:, 1])**2 / u2.dot(A).dot(u2)
+
+    return max(candidates, key=score)
+
+
+def _fit_rotation(A: np.ndarray, C: np.ndarray, sx: float, sy: float, angle: float=0) -> float:
+    """Angle for the fit with free rotation and fixed scales (no shear)
+
+    The sum of squares is a trigonometric polynomial of degree 2 in the angle,
+    its stationary points are the arguments of the roots of a polynomial of degree 4 in exp(i*angle)."""
+    p = (sx**2 - sy**2) * (A[0, 0] - A[1, 1]) / 2
+    q = (sx**2 - sy**2) * A[0, 1]
+    alpha = sx*C[0, 0] + sy*C[1, 1]
+    beta = sx*C[1, 0] - sy*C[0, 1]
+
+    coeffs = [1j*p + q, -1j*alpha - beta, 0, 1j*alpha - beta, -1j*p + q]
+
+    candidates = [angle]
+    if np.any(coeffs):
+        candidates.extend(np.angle(np.roots(coeffs)))
+
+    def sumsq(angle):
+        r = affine_matrix(angle, sx, sy)
+        return np.trace(r.T.dot(A).dot(r)) - 2*np.trace(r.T.dot(C))
+
+    return min(candidates, key=sumsq)
+
+
+def _params_from_matrix(r: np.ndarray) -> dict:
+    """Parameters for a general matrix `r`. The parameterization is redundant,
+    so `k2` is fixed to 1 (unless `r` has no off-diagonal elements)."""
+    angle = np.arctan2(r[1, 0], r[0, 0])
+    sin = np.sin(angle)
+    cos = np.cos(angle)
+    sx = np.hypot(r[1, 0], r[0, 0])
+    sy = r[1, 1] / cos if abs(cos) > 1e-12 else -r[0, 1] / sin
+    k1 = -r[0, 1] / (sy*sin) if abs(sy*sin) > 1e-12 else 1.0
+    return {"angle": angle, "sx": sx, "sy": sy, "k1": k1, "k2": 1.0}
+
+
+def _refine_lmfit(a: np.ndarray, b: np.ndarray, params: dict, vary: dict) -> (dict, dict):
+    """Refine the parameters with lmfit (optional dependency)"""
+    try:
+        import lmfit
+    except ImportError:
+        raise ImportError("lmfit is required to refine the affine transformation (`pip install lmfit`)")
+
+    lparams = lmfit.Parameters()
+    lparams.add("angle", value=params["angle"], vary=vary["angle"], min=-np.pi, max=np.pi)
+    for key in PARAMETERS[1:]:
+        lparams.add(key, value=params[key], vary=vary[key])
+
+    def objective_func(lparams, arr1, arr2):
+        v = lparams.valuesdict()
+        r = affine_matrix(v["angle"], v["sx"], v["sy"], v["k1"], v["k2"])
+        t = np.array([v["tx"], v["ty"]])
+        fit = np.dot(arr1, r) + t
+        return (fit - arr2).ravel()
+
+    res = lmfit.minimize(objective_func, lparams, args=(a, b), method="leastsq")
+
+    params = {key: res.params[key].value for key in PARAMETERS}
+    stderr = {key: res.params[key].stderr for key in PARAMETERS if vary[key]}
+
+    return params, stderr
+
+
+def _stderr(a: np.ndarray, b: np.ndarray, params: dict, vary: dict, chisqr: float) -> dict:
+    """Standard errors of the varied parameters from the (numerical) jacobian at the minimum"""
+    keys = [key for key in PARAMETERS if vary[key]]
+    dof = b.size - len(keys)
+    if not keys or dof <= 0:
+        return {key: np.nan for key in keys}
+
+    def model(p):
+        return (np.dot(a, affine_matrix(p["angle"], p["sx"], p["sy"], p["k1"], p["k2"])) + np.array([p["tx"], p["ty"]])).ravel()
+
+    jac = []
+    for key in keys:
+        h = 1e-6 * max(abs(params[key]), 1.0)
+        hi = dict(params, **{key: params[key] + h})
+        lo = dict(params, **{key: params[key] - h})
+        jac.append((model(hi) - model(lo)) / (2*h))
+    jac = np.array(jac).T
+
+    cov = np.linalg.pinv(jac.T.dot(jac)) * chisqr / dof
+
+    return dict(zip(keys, np.sqrt(np.abs(np.diag(cov)))))
+
+
+def fit_affine_transformation(a, b, rotation=True, scaling=True, translation=False, shear=False,
+                              as_params=False, full_output=False, refine=False, verbose=False, **x0):
+    """Fit the affine transformation `b = np.dot(a, r) + t` (see `affine_matrix`) by linear least squares
+
+    a, b: (N, 2) arrays with the corresponding coordinates
+    rotation, scaling, translation, shear: toggle to vary the angle, scales (sx, sy), translation (tx, ty),
+        and shear (k1, k2). Fixed parameters take their value from `x0`, i.e. `angle=0.1`
+    as_params: return the dict of parameters instead of `r, t`
+    full_output: return a dict with the matrix `r`, translation `t`, `params`, their standard errors (`stderr`),
+        the `residuals` (fit - b), `chisqr`, and `rmsd`
+    refine: refine the solution with lmfit (optional dependency)
+    verbose: print the parameters
+
+    Returns: r, t (default)
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+
+    vary = {"angle": rotation, "sx": scaling, "sy": scaling, "tx": translation, "ty": translation, "k1": shear, "k2": shear}
+    params = {"angle": 0.0, "sx": 1.0, "sy": 1.0, "tx": 0.0, "ty": 0.0, "k1": 1.0, "k2": 1.0}
+    params.update({key: float(value) for key, value in x0.items() if key in params})
+
+    if translation:
+        a0 = a.mean(axis=0)
+        b0 = b.mean(axis=0)
+    else:
+        a0 = np.zeros(2)
+        b0 = np.array([params["tx"], params["ty"]])
+
+    A = (a - a0).T.dot(a - a0)
+    C = (a - a0).T.dot(b - b0)
+
+    if shear and rotation and scaling:
+        # general linear least squares
+        r = np.linalg.solve(A, C)
+        params.update(_params_from_matrix(r))
+        vary["k2"] = False  # redundant
+    else:
+        if rotation and scaling:
+            params["angle"] = _fit_rotation_scaling(A, C)
+        elif rotation:
+            params["angle"] = _fit_rotation(A, C, params["sx"], params["sy"], angle=params["angle"])
+
+        if scaling:
+            params["sx"], params["sy"] = _scales(A, C, params["angle"])
+
+        if rotation and scaling and params["sx"] < 0:
+            # same matrix, but keep the scales positive
+            params["angle"] += np.pi
+            params["sx"], params["sy"] = -params["sx"], -params["sy"]
+
+        params["angle"] = _wrap_angle(params["angle"])
+
+        if shear:
+            # shear with fixed rotation/scaling is not linear, start from the fit without shear
+            refine = True
+
+    if translation:
+        r = affine_matrix(params["angle"], params["sx"], params["sy"], params["k1"], params["k2"])
+        params["tx"], params["ty"] = b0 - a0.dot(r)
+
+    if refine:
+        params, stderr = _refine_lmfit(a, b, params, vary)
+
+    r = affine_matrix(params["angle"], params["sx"], params["sy"], params["k1"], params["k2"])
+    t = np.array([params["tx"], params["ty"]])
+
+    residuals = np.dot(a, r) + t - b
+    chisqr = np.sum(residuals**2)
+    rmsd = np.sqrt(np.mean(np.sum(residuals**2, axis=1)))
+
+    if not refine and (full_output or verbose):
+        stderr = _stderr(a, b, params, vary, chisqr)
+
+    if verbose:
+        print(f"Affine transformation fit: chisqr={chisqr:.4g}, rmsd={rmsd:.4g}")
+        for key in PARAMETERS:
+            if key not in stderr:
+                err = " (fixed)"
+            elif stderr[key] is None:
+                err = ""
+            else:
+                err = f" +- {stderr[key]:.4g}"
+            print(f"    {key:5s} = {params[key]:.6g}{err}")
+
+    if full_output:
+        return {
+            "r": r,
+            "t": t,
+            "params": params,
+            "stderr": stderr,
+            "residuals": residuals,
+            "chisqr": chisqr,
+            "rmsd": rmsd
+        }
+    elif as_params:
+        return params
     else:
         return r, t
 
+
+def benchmark(n: int=25, noise: float=0.5) -> None:
+    """Compare the direct solution with a full lmfit minimization on simulated calibration data"""
+    import time
+
+    rng = np.random.RandomState(0)
+    a = np.stack(np.meshgrid(np.arange(-2, 3), np.arange(-2, 3))).reshape(2, -1).T * 100.0
+    a = a[:n]
+    r_true = affine_matrix(0.7, 1.3, 1.1, 1.05, 0.95)
+    t_true = np.array([12.0, -7.0])
+    b = a.dot(r_true) + t_true + rng.normal(scale=noise, size=a.shape)
+
+    for kwargs in ({}, {"translation": True}, {"translation": True, "shear": True}, {"scaling": False}):
+        t0 = time.perf_counter()
+        for _ in range(100):
+            res = fit_affine_transformation(a, b, full_output=True, **kwargs)
+        t1 = time.perf_counter()
+        ref = fit_affine_transformation(a, b, full_output=True, refine=True, **kwargs)
+        t2 = time.perf_counter()
+
+        print(f"{kwargs}")
+        print(f"    direct: {(t1 - t0) * 1000 / 100:.3f} ms, chisqr={res['chisqr']:.6g}")
+        print(f"    lmfit:  {(t2 - t1) * 1000:.3f} ms, chisqr={ref['chisqr']:.6g}, max diff r: {np.abs(res['r'] - ref['r']).max():.3g}")
@@ -1,10 +1,10 @@
 import socket
-import pickle
 import time
 import atexit
 from functools import wraps
 import subprocess as sp
 from instamatic import config
+from instamatic.server.serializer import send_message, recv_message
 
 # HOST = 'localhost'
 # PORT = 8088
@@ -42,6 +42,10 @@ class CamClient(object):
         self.bufsize = BUFSIZE
         self.streamable = False  # overrides cam settings
 
+        # set to a dict to receive images into reusable buffers (1 per dtype/shape)
+        # the returned image is then overwritten on the next call to `getImage`
+        self.image_buffers = None
+
         try:
             self.connect()
         except ConnectionRefusedError:
@@ -63,10 +67,6 @@ class CamClient(object):
         self._init_attr_dict()
 
         atexit.register(self.s.close)
-
-        xres, yres = self.getDimensions()
-        bitdepth = 4
-        self.imagebufsize = bitdepth*xres*yres + self.bufsize
     
     def connect(self):
         self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -93,19 +93,18 @@ class CamClient(object):
         return wrapper
 
     def _eval_dct(self, dct):
-        """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'"""
+        """Takes approximately 0.2-0.3 ms per call if HOST=='localhost'
+        Images are received as raw buffers, see `instamatic.server.serializer`"""
         # t0 = time.perf_counter()
 
-        self.s.send(pickle.dumps(dct))
+        send_message(self.s, dct)
 
-        if dct["attr_name"] == "getImage":
-            # approximately 2-3 ms for the interface
-            response = self.s.recv(self.imagebufsize)
-        else:
-            response = self.s.recv(self.bufsize)
+        response = recv_message(self.s, buffers=self.image_buffers)
+
+        if response is None:
+            raise ConnectionError("Connection to CAM server was closed")
 
-        if response:
-            status, data = pickle.loads(response)
+        status, data = response
 
         if status == 200:
             return data
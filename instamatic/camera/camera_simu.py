@@ -9,6 +9,8 @@ import atexit
 
 from instamatic import config
 
+NOISE_FRAMES = 8
+
 
 class CameraSimu(object):
     """docstring for CameraSimu"""
@@ -19,6 +21,9 @@ class CameraSimu(object):
 
         self.name = name
 
+        self._noise = None
+        self._noise_index = 0
+
         self.establishConnection()
 
         self.load_defaults()
@@ -36,11 +41,12 @@ class CameraSimu(object):
 
         self.streamable = True
 
-    def getImage(self, exposure=None, binsize=None, **kwargs) -> np.ndarray:
+    def getImage(self, exposure=None, binsize=None, out=None, **kwargs) -> np.ndarray:
         """Image acquisition routine
 
         exposure: exposure time in seconds
         binsize: which binning to use
+        out: array to write the image to (i.e. a slot of a ring buffer)
         """
 
         if not exposure:
@@ -50,9 +56,17 @@ class CameraSimu(object):
 
         time.sleep(exposure)
 
-        arr = np.random.randint(256, size=self.dimensions)
+        # cycle through a bank of pregenerated noise frames rather than generating a new one every frame
+        if self._noise is None:
+            self._noise = np.random.randint(256, size=(NOISE_FRAMES, *self.dimensions)).astype(np.uint16)
+        self._noise_index = (self._noise_index + 1) % NOISE_FRAMES
+        arr = self._noise[self._noise_index]
+
+        if out is not None:
+            np.copyto(out, arr, casting="unsafe")
+            return out
 
-        return arr
+        return arr.copy()
 
     def isCameraInfoAvailable(self) -> bool:
         """Check if the camera is available"""
@@ -0,0 +1,156 @@
+import threading
+import numpy as np
+
+
+class BufferOverrunError(Exception):
+    pass
+
+
+class FrameRingBuffer(object):
+    """Preallocated ring buffer of `nslots` frames with their acquisition timestamps.
+
+    There is a single producer (i.e. the `ImageGrabber` thread), which either fills the
+    next slot in place (`next_slot` + `commit`) or copies a frame into it (`put`).
+    Frames are numbered from 0 as they are committed. Consumers read the frames through
+    a `RingCursor` (see `cursor`), each with its own position, so that several consumers
+    can read the same stream. When a consumer falls more than `nslots` frames behind,
+    the frames it missed are overwritten, this is detected and reported by the cursor.
+    """
+    def __init__(self, nslots: int, shape: tuple, dtype="uint16"):
+        super().__init__()
+        self.nslots = nslots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+        self.frames = np.zeros((nslots, *self.shape), dtype=self.dtype)
+        self.t_start = np.zeros(nslots)
+        self.t_end = np.zeros(nslots)
+        # frame number stored in each slot, -1 while the slot is being written
+        self.numbers = np.full(nslots, -1, dtype=np.int64)
+
+        self.count = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(nslots={self.nslots}, shape={self.shape}, dtype={self.dtype}, count={self.count})"
+
+    def next_slot(self) -> np.ndarray:
+        """Return the slot for the next frame to be filled in place, call `commit` when done"""
+        slot = self.count % self.nslots
+        self.numbers[slot] = -1
+        return self.frames[slot]
+
+    def commit(self, t_start: float=0.0, t_end: float=0.0) -> int:
+        """Publish the frame written to the slot returned by `next_slot`, returns the frame number"""
+        number = self.count
+        slot = number % self.nslots
+        self.t_start[slot] = t_start
+        self.t_end[slot] = t_end
+        self.numbers[slot] = number
+        with self._cond:
+            self.count += 1
+            self._cond.notify_all()
+        return number
+
+    def put(self, frame: np.ndarray, t_start: float=0.0, t_end: float=0.0) -> int:
+        """Copy `frame` into the next slot and publish it, returns the frame number"""
+        np.copyto(self.next_slot(), frame, casting="unsafe")
+        return self.commit(t_start, t_end)
+
+    def close(self) -> None:
+        """Signal the consumers that no more frames will be added"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def latest(self) -> tuple:
+        """Return the number and a view of the last committed frame, or None if there is none"""
+        number = self.count - 1
+        if number < 0:
+            return None
+        return number, self.frames[number % self.nslots]
+
+    def cursor(self, start: int=None, on_overrun: str="skip") -> "RingCursor":
+        """Return a cursor to read frames from the buffer, starting at frame number `start`
+        (default: the next frame to be committed). See `RingCursor`."""
+        if start is None:
+            start = self.count
+        return RingCursor(self, start, on_overrun=on_overrun)
+
+
+class RingCursor(object):
+    """Reads the frames of a `FrameRingBuffer` in order.
+
+    on_overrun: 'skip' or 'raise'
+        What to do if frames were overwritten before they were read. With 'skip', the cursor
+        continues at the oldest frame that is still available, and the number of lost frames
+        is added to `self.dropped`. With 'raise', a `BufferOverrunError` is raised.
+    """
+    def __init__(self, ring: "FrameRingBuffer", position: int=0, on_overrun: str="skip"):
+        super().__init__()
+        if on_overrun not in ("skip", "raise"):
+            raise ValueError(f"on_overrun must be 'skip' or 'raise', got {on_overrun!r}")
+
+        self.ring = ring
+        self.position = position
+        self.on_overrun = on_overrun
+        self.dropped = 0
+
+    def __iter__(self):
+        while True:
+            ret = self.read()
+            if ret is None:
+                return
+            yield ret
+
+    def available(self) -> int:
+        """Number of frames that can be read without waiting"""
+        return self.ring.count - self.position
+
+    def _overrun(self, oldest: int) -> None:
+        lost = oldest - self.position
+        if self.on_overrun == "raise":
+            raise BufferOverrunError(f"{lost} frame(s) were overwritten before they were read (frame {self.position})")
+        self.dropped += lost
+        self.position = oldest
+
+    def read(self, timeout: float=None, out: np.ndarray=None) -> tuple:
+        """Wait for the next frame and return `(number, frame, t_start, t_end)`.
+
+        Without `out`, `frame` is a view of the slot in the buffer, which is valid until the producer
+        wraps around. With `out`, the frame is copied into `out` and the copy is checked for overruns.
+        Returns None on timeout, or when the buffer is closed and all frames have been read."""
+        ring = self.ring
+
+        while True:
+            with ring._cond:
+                if not ring._cond.wait_for(lambda: ring.count > self.position or ring.closed, timeout):
+                    return None
+                count = ring.count
+
+            if count <= self.position:
+                return None  # closed
+
+            # the slot after the newest frame may be being written
+            oldest = count - ring.nslots + 1
+            if self.position < oldest:
+                self._overrun(oldest)
+
+            number = self.position
+            slot = number % ring.nslots
+            frame = ring.frames[slot]
+            t_start = ring.t_start[slot]
+            t_end = ring.t_end[slot]
+
+            if out is not None:
+                np.copyto(out, frame, casting="unsafe")
+                frame = out
+
+            if ring.numbers[slot] != number:
+                # overwritten while reading
+                self._overrun(ring.count - ring.nslots + 1)
+                continue
+
+            self.position += 1
+            return number, frame, t_start, t_end
@@ -1,5 +1,9 @@
 import threading
+import inspect
+import time
+import numpy as np
 from .camera import Camera
+from .ringbuffer import FrameRingBuffer
 import atexit
 
 
@@ -28,6 +32,11 @@ class ImageGrabber(object):
 
         self.lock = threading.Lock()
 
+        # continuous recording into a ring buffer, see `VideoStream.start_recording`
+        self.ring = None
+        self.ring_exposure = None
+        self._fill_in_place = "out" in inspect.signature(self.cam.getImage).parameters
+
         self.stopEvent = threading.Event()
         self.acquireInitiateEvent = threading.Event()
         self.acquireCompleteEvent = threading.Event()
@@ -42,10 +51,25 @@ class ImageGrabber(object):
                 frame = self.cam.getImage(exposure=self.exposure)
                 self.callback(frame, acquire=True)
 
+            elif self.ring is not None:
+                self.record(self.ring)
+
             elif not self.continuousCollectionEvent.is_set():
                 frame = self.cam.getImage(exposure=self.frametime)
                 self.callback(frame)
 
+    def record(self, ring: "FrameRingBuffer") -> None:
+        """Acquire a frame directly into the next slot of the ring buffer"""
+        slot = ring.next_slot()
+        t_start = time.perf_counter()
+        if self._fill_in_place:
+            self.cam.getImage(exposure=self.ring_exposure, out=slot)
+        else:
+            np.copyto(slot, self.cam.getImage(exposure=self.ring_exposure), casting="unsafe")
+        t_end = time.perf_counter()
+        ring.commit(t_start, t_end)
+        self.callback(slot)
+
     def start_loop(self):
         self.thread = threading.Thread(target=self.run, args=(), daemon=True)
         self.thread.start()
@@ -74,6 +98,9 @@ class VideoStream(threading.Thread):
 
         self.frametime = self.default_exposure
 
+        self.frame = None
+        self.frame_count = 0  # number of frames received, used to calculate the acquisition rate
+
         self.grabber = self.setup_grabber()
 
         self.streamable = self.cam.streamable
@@ -95,6 +122,7 @@ class VideoStream(threading.Thread):
         self.grabber.start_loop()
 
     def send_frame(self, frame, acquire=False):
+        self.frame_count += 1
         if acquire:
             self.grabber.lock.acquire(True)
             self.acquired_frame = self.frame = frame
@@ -145,10 +173,48 @@ class VideoStream(threading.Thread):
     def unblock(self):
         self.grabber.continuousCollectionEvent.clear()
 
-    def continuous_collection(self, exposure=0.1, n=100, callback=None):
+    def start_recording(self, exposure: float=None, nslots: int=64) -> "FrameRingBuffer":
+        """Start recording frames continuously into a preallocated ring buffer
+
+        The grabber thread acquires the frames back-to-back directly into the buffer (in place,
+        if the camera supports `getImage(out=...)`), and the stream shows the recorded frames.
+        Read the frames with `ring.cursor()`, see `FrameRingBuffer`.
+
+        exposure: float
+            exposure time for every frame (default: current frametime)
+        nslots: int
+            number of frames held in the buffer
+
+        Returns: the ring buffer
+        """
+        if self.grabber.ring is not None:
+            raise RuntimeError("Recording is already running, call `stop_recording` first")
+
+        if not exposure:
+            exposure = self.frametime
+
+        # the first frame determines the shape and data type of the buffer
+        frame = self.getImage(exposure=exposure)
+        ring = FrameRingBuffer(nslots, frame.shape, frame.dtype)
+
+        self.grabber.ring_exposure = exposure
+        self.grabber.ring = ring
+
+        return ring
+
+    def stop_recording(self) -> "FrameRingBuffer":
+        """Stop recording, returns the ring buffer (which still holds the last frames)"""
+        ring = self.grabber.ring
+        self.grabber.ring = None
+        if ring is not None:
+            ring.close()
+        return ring
+
+    def continuous_collection(self, exposure=0.1, n=100, callback=None, nslots: int=64):
         """
         Function to continuously collect data
-        Blocks the videostream while collecting data, and only shows collected images
+        The frames are recorded back-to-back into a ring buffer (see `start_recording`),
+        and the stream only shows the collected images
 
         exposure: float
             exposure time
@@ -158,28 +224,31 @@ class VideoStream(threading.Thread):
         callback: function
             This function is called on every iteration with the image as first argument
             Should return True or False if data collection is to continue
+            The image is a view of the ring buffer, it must be copied if it is kept.
+            If the callback is slower than the acquisition, frames are dropped.
+        nslots: int
+            size of the ring buffer
         """
-        buffer = []
-
-        go_on = True
-        i = 0
-
-        self.block()
-        while go_on:
-            i += 1
-
-            img = self.getImage(exposure=exposure)
+        ring = self.start_recording(exposure=exposure, nslots=nslots)
+        cursor = ring.cursor()
 
+        try:
             if callback:
-                go_on = callback(img)
+                for number, img, t_start, t_end in cursor:
+                    if not callback(img):
+                        break
             else:
-                buffer.append(img)
-                go_on = i < n
+                buffer = np.empty((n, *ring.shape), dtype=ring.dtype)
+                for i in range(n):
+                    cursor.read(out=buffer[i])
+        finally:
+            self.stop_recording()
 
-        self.unblock()
+        if cursor.dropped:
+            print(f"Warning: {cursor.dropped} frames were dropped during continuous collection")
 
         if not callback:
-            return buffer
+            return list(buffer)
 
     def show_stream(self):
         from instamatic.gui import videostream_frame
@@ -13,7 +13,7 @@ from instamatic.calibrate.calibrate_imageshift12 import Calibrate_Imageshift, Ca
 from instamatic.calibrate.center_z import center_z_height, center_z_height_HYMethod
 from instamatic.tools import find_defocused_image_center, find_beam_center
 from instamatic.processing.flatfield import apply_flatfield_correction
-from instamatic.neural_network import predict, preprocess
+from instamatic.neural_network import QualityScorer
 import pickle
 import json
 from pathlib import Path
@@ -141,7 +141,9 @@ class Experiment(object):
                        log=None, 
                        flatfield=None, 
                        image_interval=99999, 
-                       diff_defocus=0):
+                       diff_defocus=0,
+                       quality_policy=None,
+                       score_workers=1):
         super(Experiment,self).__init__()
         self.ctrl = ctrl
         self.path = path
@@ -154,6 +156,9 @@ class Experiment(object):
         self.flatfield = flatfield
         self.stagepos_idx = 0
 
+        """Defocused images are scored by the CNN in the background, `quality_policy` (i.e. `AbortPolicy`) can stop the collection"""
+        self.scorer = QualityScorer(workers=score_workers, policy=quality_policy, callback=self.on_quality_score, on_abort=self.on_quality_abort)
+
         self.diff_defocus = diff_defocus
         self.image_interval = image_interval
         self.nom_ii = self.image_interval
@@ -469,6 +474,15 @@ class Experiment(object):
         self.ctrl.difffocus.value = diff_focus_proper
         return img0, h
     
+    def on_quality_score(self, key, score):
+        """Called from the scoring thread for every scored defocused image"""
+        self.logger.debug("Score for the DP (frame {}): {}".format(key, score))
+
+    def on_quality_abort(self, key, score):
+        """Called from the scoring thread when the quality policy decides to stop"""
+        self.print_and_del("Collection stopping because of low crystal quality (score = {:.3f} at frame {})".format(score, key))
+        self.stopEvent.set()
+
     def print_and_log(self, logger, msg):
         print(msg)
         logger.debug(msg)
@@ -528,6 +542,11 @@ class Experiment(object):
 
         buffer = []
         image_buffer = []
+
+        # reset the scorer before clearing the stop event, so that a late abort for the previous
+        # crystal cannot stop this one, and an abort on the first image (img0) is not cleared
+        self.scorer.reset()
+        self.stopEvent.clear()
             
         if self.mode > 0:
 
@@ -576,10 +595,7 @@ class Experiment(object):
             
                 img0, h = self.defocus_and_image(difffocus = self.diff_defocus, exp_t = self.exposure_time_image)"""
 
-            img0_p = preprocess(img0.astype(np.float))
-            scorefromCNN = predict(img0_p)
-            #self.print_and_log(logger = self.logger, msg = "Score for the DP: {}".format(scorefromCNN))
-            self.logger.debug("Score for the DP: {}".format(scorefromCNN))
+            self.scorer.submit(0, img0)
 
             crystal_pos, img0_cropped, window_size = self.image_cropper(img = img0, window_size = 0)
             img0var = self.img_var(img0_cropped, crystal_pos)
@@ -627,8 +643,6 @@ class Experiment(object):
 
         t0 = time.perf_counter()
         self.startangle = a
-        
-        self.stopEvent.clear()
 
         while not self.stopEvent.is_set():
             try:
@@ -665,6 +679,7 @@ class Experiment(object):
                     self.ctrl.difffocus.value = diff_focus_proper
     
                     image_buffer.append((i, img, h))
+                    self.scorer.submit(i, img)
 
                     crystal_pos, img_cropped, _ = self.image_cropper(img = img, window_size = window_size)
 
@@ -793,6 +808,9 @@ class Experiment(object):
         if self.mode > 1:
             self.ctrl.stage.stop()
 
+        if self.mode > 0:
+            self.logger.info(self.scorer.summary())
+
         if self.camtype == "simulate":
             self.endangle = self.startangle + np.random.random()*50
             camera_length = 300
@@ -1305,6 +1323,13 @@ class Experiment(object):
             return 0
         
     def start_collection(self):
+        try:
+            self.run_collection()
+        finally:
+            # stop the scoring processes, also if the collection failed
+            self.scorer.close()
+
+    def run_collection(self):
         ready = input("Please make sure that you have adjusted Goniotool if you are using full autocRED!")
         if self.stopEvent_rasterScan.is_set():
             #print("Raster scan stopper clearing..")
@@ -4,6 +4,10 @@ from tkinter import *
 import numpy as np
 import time
 from instamatic.processing.ImgConversionTPX import ImgConversionTPX as ImgConversion
+from instamatic.processing.ImgConversionTPX import TPX_UNTRUSTED_AREAS
+from instamatic.processing.ImgConversionStream import ImgConversionStream
+from instamatic.camera.videostream import VideoStream
+from instamatic.processing.XDS_templateTPX import XDS_template
 from instamatic import config
 from instamatic.formats import write_tiff
 from pathlib import Path
@@ -45,8 +49,19 @@ class Experiment(object):
         Image interval only - Exposure time for defocused images
     write_tiff, write_xds, write_dials, write_red:
         Specify which data types/input files should be written
+    write_cbf:
+        Write the diffraction data as compressed CBF files (int32), which are used in XDS.INP instead of the SMV files
+    write_hdf5:
+        Write all diffraction data and headers to a single compressed HDF5 file (`data.h5`)
     stop_event:
         Instance of `threading.Event()` that signals the experiment to be terminated.
+    stream_conversion:
+        Process and write the diffraction data during data collection rather than afterwards
+    queue_depth:
+        Stream conversion only - Maximum number of frames held in memory waiting to be written
+    ring_buffer:
+        Number of frames in the ring buffer the frames are recorded into back-to-back (video stream
+        cameras only, not with image interval). Set to 0 to acquire the frames one by one.
     """
     def __init__(self, ctrl, 
         path: str=None, 
@@ -64,7 +79,12 @@ class Experiment(object):
         write_xds: bool=True,
         write_dials: bool=True,
         write_red: bool=True,
+        write_cbf: bool=False,
+        write_hdf5: bool=False,
         stop_event=None,
+        stream_conversion: bool=True,
+        queue_depth: int=64,
+        ring_buffer: int=64,
         ):
         super(Experiment,self).__init__()
         self.ctrl = ctrl
@@ -87,8 +107,14 @@ class Experiment(object):
         self.write_xds = write_xds
         self.write_dials = write_dials
         self.write_red = write_red
+        self.write_cbf = write_cbf
+        self.write_hdf5 = write_hdf5
         self.write_pets = write_tiff  # TODO
 
+        self.stream_conversion = stream_conversion
+        self.queue_depth = queue_depth
+        self.ring_buffer = ring_buffer
+
         self.image_interval_enabled = enable_image_interval
         if enable_image_interval:
             self.image_interval = image_interval
@@ -160,8 +186,10 @@ class Experiment(object):
         """Set up the paths for saving the data to"""
         print(f"\nOutput directory: {self.path}")
         self.tiff_path = self.path / "tiff" if self.write_tiff else None
-        self.smv_path  = self.path / "SMV"  if (self.write_xds or self.write_dials) else None
+        self.smv_path  = self.path / "SMV"  if (self.write_dials or (self.write_xds and not self.write_cbf)) else None
         self.mrc_path  = self.path / "RED"  if self.write_red else None
+        self.cbf_path  = self.path / "CBF"  if self.write_cbf else None
+        self.hdf5_path = self.path / "data.h5" if self.write_hdf5 else None
 
     def start_rotation(self) -> float:
         """Controls the starting of the rotation of the experiment
@@ -217,6 +245,20 @@ class Experiment(object):
 
         print("Done.")
 
+    def frame_header(self, img: np.ndarray, t_start: float, t_end: float) -> dict:
+        """Header for a frame from the ring buffer, equivalent to `ctrl.getImage(header_keys=None)`"""
+        return {
+            "ImageGetTimeStart": t_start,
+            "ImageGetTimeEnd": t_end,
+            "ImageGetTime": time.time() - (time.perf_counter() - t_end),
+            "ImageExposureTime": self.exposure,
+            "ImageBinSize": 1,
+            "ImageResolution": img.shape,
+            "ImageComment": "",
+            "ImageCameraName": self.ctrl.cam.name,
+            "ImageCameraDimensions": self.ctrl.cam.dimensions,
+        }
+
     def start_collection(self) -> bool:
         """Main experimental function,
         returns True if experiment runs normally, False if it is interrupted for whatever reason.
@@ -237,54 +279,101 @@ class Experiment(object):
         if self.relax_beam_before_experiment:
             self.relax_beam()
 
-        self.start_angle = self.start_rotation()
-        self.ctrl.cam.block()
+        # set up the conversion stream and the recording before the rotation starts,
+        # so that the first frame is taken as soon as the stage starts turning
+        img_conv = self.start_stream() if self.stream_conversion else None
 
+        ring = None
         i = 1
 
-        t0 = time.perf_counter()
-
-        while not self.stopEvent.is_set():
-            if i % self.image_interval == 0:
-                t_start = time.perf_counter()
-                acquisition_time = (t_start - t0) / (i-1)
-
-                self.ctrl.difffocus.set(self.diff_focus_defocused, confirm_mode=False)
-                img, h = self.ctrl.getImage(exposure_image, header_keys=None)
-                self.ctrl.difffocus.set(self.diff_focus_proper, confirm_mode=False)
-
-                image_buffer.append((i, img, h))
-
-                next_interval = t_start + acquisition_time
-                # print(f"{i} BLOOP! {next_interval-t_start:.3f} {acquisition_time:.3f} {t_start-t0:.3f}")
-
-                while time.perf_counter() > next_interval:
-                    next_interval += acquisition_time
-                    i += 1
-                    # print(f"{i} "SKIP!  {next_interval-t_start:.3f} {acquisition_time:.3f}")
-
-                diff = next_interval - time.perf_counter() # seconds
-
-                if self.track_stage_position and diff > 0.1:
-                    self.stage_positions.append((i, self.ctrl.stage.get()))
-
-                time.sleep(diff)
-
+        try:
+            if self.ring_buffer and not self.image_interval_enabled and isinstance(self.ctrl.cam, VideoStream):
+                ring = self.ctrl.cam.start_recording(exposure=self.exposure, nslots=self.ring_buffer)
             else:
-                img, h = self.ctrl.getImage(self.exposure, header_keys=None)
-                # print(f"{i} Image!")
-                buffer.append((i, img, h))
-
-            i += 1
-
-        t1 = time.perf_counter()
-
-        if self.mode == "footfree":
-            self.ctrl.stage.stop()
+                self.ctrl.cam.block()
+
+            self.start_angle = self.start_rotation()
+
+            if img_conv is not None:
+                img_conv.start_angle = self.start_angle
+
+            if ring is not None:
+                # skip the frames recorded while waiting for the rotation,
+                # frame 1 is the first frame recorded after the rotation started
+                cursor = ring.cursor()
+                cursor_start = cursor.position
+
+            t0 = time.perf_counter()
+
+            while not self.stopEvent.is_set():
+                if ring is None and i % self.image_interval == 0:
+                    t_start = time.perf_counter()
+                    acquisition_time = (t_start - t0) / (i-1)
+
+                    self.ctrl.difffocus.set(self.diff_focus_defocused, confirm_mode=False)
+                    img, h = self.ctrl.getImage(exposure_image, header_keys=None)
+                    self.ctrl.difffocus.set(self.diff_focus_proper, confirm_mode=False)
+
+                    image_buffer.append((i, img, h))
+
+                    next_interval = t_start + acquisition_time
+                    # print(f"{i} BLOOP! {next_interval-t_start:.3f} {acquisition_time:.3f} {t_start-t0:.3f}")
+
+                    while time.perf_counter() > next_interval:
+                        next_interval += acquisition_time
+                        i += 1
+                        # print(f"{i} "SKIP!  {next_interval-t_start:.3f} {acquisition_time:.3f}")
+
+                    diff = next_interval - time.perf_counter() # seconds
+
+                    if self.track_stage_position and diff > 0.1:
+                        self.stage_positions.append((i, self.ctrl.stage.get()))
+
+                    time.sleep(diff)
+
+                else:
+                    if ring is not None:
+                        # copy into a new array, the copy is checked for overwrites by the cursor
+                        ret = cursor.read(timeout=0.1, out=np.empty(ring.shape, dtype=ring.dtype))
+                        if ret is None:
+                            continue
+                        number, img, t_start, t_end = ret
+                        i = number - cursor_start + 1  # frames lost to buffer overruns are skipped
+                        h = self.frame_header(img, t_start, t_end)
+                    else:
+                        img, h = self.ctrl.getImage(self.exposure, header_keys=None)
+                    # print(f"{i} Image!")
+                    if self.stream_conversion:
+                        img_conv.put(i, img, h)
+                        buffer.append(i)
+                    else:
+                        buffer.append((i, img, h))
+
+                i += 1
+
+            t1 = time.perf_counter()
+
+        except BaseException:
+            if img_conv is not None:
+                try:
+                    img_conv.close()
+                except Exception as e:
+                    self.logger.exception(e)
+            raise
+
+        finally:
+            if self.mode == "footfree":
+                self.ctrl.stage.stop()
+
+            if ring is not None:
+                self.ctrl.cam.stop_recording()
+            else:
+                self.ctrl.cam.unblock()
 
         self.stopEvent.clear()
 
-        self.ctrl.cam.unblock()
+        if ring is not None and cursor.dropped:
+            print_and_log(f"Ring buffer overrun: {cursor.dropped} frames were dropped", logger=self.logger)
 
         if self.mode == "simulate":
             # simulate somewhat realistic end numbers
@@ -308,6 +397,8 @@ class Experiment(object):
         # in case something went wrong starting data collection, return gracefully
         if i == 1:
             print_and_log(f"Data collection interrupted", logger=self.logger)
+            if self.stream_conversion:
+                img_conv.close()
             return False
 
         self.spotsize = self.ctrl.spotsize
@@ -333,14 +424,53 @@ class Experiment(object):
 
         if self.nframes <= 3:
             print_and_log(f"Not enough frames collected. Data will not be written (nframes={self.nframes})", logger=self.logger)
+            if self.stream_conversion:
+                img_conv.close()
             return False
 
-        self.write_data(buffer)
+        if self.stream_conversion:
+            self.finalize_stream(img_conv)
+        else:
+            self.write_data(buffer)
         self.write_image_data(image_buffer)
 
         print("Data Collection and Conversion Done.")
         return True
 
+    def start_stream(self) -> ImgConversionStream:
+        """Set up the image conversion stream, so that the diffraction data
+        are processed and written while they are being collected.
+        The start angle is provisional (current angle), set `start_angle` once the rotation has started."""
+        return ImgConversionStream(start_angle=self.ctrl.stage.a,
+                 tiff_path=self.tiff_path,
+                 smv_path=self.smv_path,
+                 mrc_path=self.mrc_path,
+                 cbf_path=self.cbf_path,
+                 hdf5_path=self.hdf5_path,
+                 flatfield=self.flatfield,
+                 physical_pixelsize=config.camera.physical_pixelsize,
+                 wavelength=config.microscope.wavelength,
+                 stretch_amplitude=config.camera.stretch_amplitude,
+                 stretch_azimuth=config.camera.stretch_azimuth,
+                 untrusted_areas=TPX_UNTRUSTED_AREAS,
+                 name="TimePix_SU",
+                 XDS_template=XDS_template,
+                 queue_depth=self.queue_depth,
+                 )
+
+    def finalize_stream(self, img_conv: ImgConversionStream):
+        """Wait for the remaining frames in the image conversion stream to be written, 
+        and write the input files for the processing programs."""
+        print("Writing remaining data files...")
+        img_conv.finalize(end_angle=self.end_angle,
+                 osc_angle=self.osc_angle,
+                 rotation_axis=self.rotation_axis,
+                 acquisition_time=self.acquisition_time,
+                 pixelsize=self.pixelsize,
+                 )
+
+        self.write_input_files(img_conv)
+
     def write_data(self, buffer: list):
         """Write diffraction data in the buffer.
 
@@ -367,15 +497,21 @@ class Experiment(object):
         img_conv.threadpoolwriter(tiff_path=self.tiff_path,
                                   mrc_path=self.mrc_path,
                                   smv_path=self.smv_path,
+                                  cbf_path=self.cbf_path,
+                                  hdf5_path=self.hdf5_path,
                                   workers=8)
-        
+
+        self.write_input_files(img_conv)
+
+    def write_input_files(self, img_conv: ImgConversion):
+        """Write the input files for DIALS/REDp/XDS/PETS"""
         print("Writing input files...")
         if self.write_dials:
             img_conv.to_dials(self.smv_path)
         if self.write_red:
             img_conv.write_ed3d(self.mrc_path)
         if self.write_xds or self.write_dials:
-            img_conv.write_xds_inp(self.smv_path)
+            img_conv.write_xds_inp(self.cbf_path if self.write_cbf else self.smv_path)
         if self.write_pets:
             img_conv.write_pets_inp(self.path)
 
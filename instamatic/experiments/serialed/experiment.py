@@ -6,17 +6,55 @@ import matplotlib.pyplot as plt
 
 from instamatic.formats import *
 from instamatic.processing.find_crystals import find_crystals, find_crystals_timepix
-from instamatic.processing.flatfield import remove_deadpixels, apply_flatfield_correction
+from instamatic.processing.flatfield import FlatfieldCorrector
 from instamatic.calibrate import CalibBeamShift, CalibDirectBeam
 from instamatic import config
 from instamatic import neural_network
 
 import time
 import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from tqdm import tqdm
 from pathlib import Path
 
 
+class StageTimer(object):
+    """Collects the time spent in each stage of the experiment, can be used from several threads"""
+    def __init__(self):
+        super(StageTimer, self).__init__()
+        self.times = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, dt: float) -> None:
+        with self._lock:
+            self.times[stage].append(dt)
+
+    def mean(self, stage: str, default: float=0.0) -> float:
+        with self._lock:
+            times = self.times.get(stage)
+            return np.mean(times) if times else default
+
+    @contextmanager
+    def __call__(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - t0)
+
+    def summary(self, npositions: int, total: float) -> str:
+        """Table of the time spent per stage, and the throughput per grid square"""
+        lines = [f"{'stage':>12s} {'n':>6s} {'total (s)':>10s} {'mean (s)':>9s} {'per square (s)':>15s}"]
+        with self._lock:
+            for stage, times in self.times.items():
+                lines.append(f"{stage:>12s} {len(times):6d} {sum(times):10.2f} {np.mean(times):9.3f} {sum(times) / max(npositions, 1):15.3f}")
+        lines.append(f"{npositions} grid squares in {total:.1f} s ({total / max(npositions, 1):.2f} s per square)")
+        return "\n".join(lines)
+
+
 def make_grid_on_stage(startpoint, endpoint, padding=2.0):
     """Divide the stage up in a grid, starting at 'startpoint' ending at 'endpoint'"""
     stepsize = np.array((0.016*512, 0.016*512))
@@ -244,8 +282,7 @@ class Experiment(object):
             self.flatfield = None
 
         if self.flatfield is not None:
-            self.flatfield, h_flatfield = read_tiff(self.flatfield)
-            self.deadpixels = h_flatfield["deadpixels"]
+            self.flatfield = FlatfieldCorrector.from_files(self.flatfield, deadpixels="header")
 
         # self.sample_rotation_angles = ( -10, -5, 5, 10 )
         # self.sample_rotation_angles = (-5, 5)
@@ -431,82 +468,91 @@ class Experiment(object):
 
     def apply_corrections(self, img, h):
         if self.flatfield is not None:
-            img = remove_deadpixels(img, deadpixels=self.deadpixels)
+            img = self.flatfield.apply(img)
             h["DeadPixelCorrection"] = True
-            img = apply_flatfield_correction(img, flatfield=self.flatfield)
             h["FlatfieldCorrection"] = True
         return img, h
 
-    def run(self, ctrl=None, **kwargs):
-        """Run serial electron diffraction experiment"""
+    def analyse_image(self, i: int, img: np.ndarray, h: dict, d_pos: dict, d_image: dict) -> list:
+        """Correct image `i`, find the crystals and write it to disk. Does not access the microscope,
+        so that it can run in the worker pool while the stage moves on.
 
-        self.initialize_microscope()
+        Returns the crystal positions (pixel coordinates), or None if the image is too dark"""
+        t0 = time.perf_counter()
 
-        header_keys = kwargs.get("header_keys", None)
+        im_mean = img.mean()
+        if im_mean < self.image_threshold:
+            # self.log.debug("Dark image detected (mean=%f)", im_mean)
+            return None
 
-        d_image = {
-                "exp_neutral_diffshift": self.neutral_beamshift,
-                "exp_neutral_beamshift": self.neutral_diffshift,
-                "exp_image_spotsize": self.image_spotsize,
-                "exp_magnification": self.magnification,
-                "ImageDimensions": self.image_dimensions
-        }
-        d_diff = {
-                "exp_neutral_diffshift": self.neutral_beamshift,
-                "exp_neutral_beamshift": self.neutral_diffshift,
-                "exp_diff_brightness": self.diff_brightness,
-                "exp_diff_spotsize": self.diff_spotsize,
-                "exp_diff_cameralength": self.diff_cameralength,
-                "exp_diff_difffocus": self.diff_difffocus,
-                "ImagePixelsize": self.diff_pixelsize
-        }
+        img, h = self.apply_corrections(img, h)
 
-        self.log.info("d_image", d_image)
-        self.log.info("d_tiff", d_diff)
+        crystal_positions = self.find_crystals(img, self.magnification, spread=self.crystal_spread)
+        crystal_positions = [crystal._replace(x=crystal.x * self.image_binsize, y=crystal.y * self.image_binsize) for crystal in crystal_positions]
+        crystal_coords = [(crystal.x, crystal.y) for crystal in crystal_positions]
 
-        input("\nPress <ENTER> to start experiment ('Ctrl-C' to interrupt)\n")
+        t1 = time.perf_counter()
 
-        for i, d_pos in enumerate(self.loop_positions()):
-   
-            outfile = self.imagedir / f"image_{i:04d}"
-            
-            if self.change_spotsize:
-                self.ctrl.tem.setSpotSize(self.image_spotsize)
-    
-            img, h = self.ctrl.getImage(exposure=self.image_exposure, binsize=self.image_binsize, header_keys=header_keys)
-    
-            if self.change_spotsize:
-                self.ctrl.tem.setSpotSize(self.image_spotsize)
-    
-            self.ctrl.tem.setSpotSize(self.diff_spotsize)
+        for d in (d_image, d_pos):
+            h.update(d)
+        h["exp_crystal_coords"] = crystal_coords
 
-            im_mean = img.mean()
-            if im_mean < self.image_threshold:
-                # self.log.debug("Dark image detected (mean=%f)", im_mean)
-                continue
+        outfile = self.imagedir / f"image_{i:04d}"
+        write_hdf5(outfile, img, header=h)
 
-            img, h = self.apply_corrections(img, h)
+        t2 = time.perf_counter()
+        self.timer.add("analysis", t1 - t0)
+        self.timer.add("write", t2 - t1)
+        self.log.debug("Image %d: %d crystals (analysis: %.3f s, write: %.3f s)", i, len(crystal_coords), t1 - t0, t2 - t1)
 
-            crystal_positions = self.find_crystals(img, self.magnification, spread=self.crystal_spread) * self.image_binsize
-            crystal_coords = [(crystal.x, crystal.y) for crystal in crystal_positions]
+        return crystal_positions
 
-            for d in (d_image, d_pos):
-                h.update(d)
-            h["exp_crystal_coords"] = crystal_coords
+    def wait_here(self, future, t_submitted: float) -> bool:
+        """Whether to wait for the analysis of the image at the current position rather than
+        moving on, i.e. if the analysis is expected to finish before a move back to this
+        position would take (weighed by the fraction of images with crystals)"""
+        if future.done():
+            return True
+        remaining = self.timer.mean("analysis") - (time.perf_counter() - t_submitted)
+        hit_rate = self.nhits / self.nanalysed if self.nanalysed else 1.0
+        come_back = self.timer.mean("return", default=self.timer.mean("move"))
+        return remaining < hit_rate * come_back
 
+    def write_diffraction(self, outfile, img: np.ndarray, h: dict) -> None:
+        """Correct and write a diffraction pattern (runs in the worker pool)"""
+        with self.timer("write"):
+            img, h = self.apply_corrections(img, h)
             write_hdf5(outfile, img, header=h)
 
-            ncrystals = len(crystal_coords)
-            if ncrystals == 0:
-                continue
+    def collect_diffraction(self, i: int, d_pos: dict, future, pool, d_diff: dict, header_keys=None) -> None:
+        """Wait for the analysis of image `i`, and collect the diffraction patterns of the crystals found.
+        If the stage has moved on, it is moved back to the position where the image was taken."""
+        with self.timer("wait"):
+            crystal_positions = future.result()
 
-            self.log.info("%d crystals found in %s", ncrystals, outfile)
-    
+        if crystal_positions is not None:
+            self.nanalysed += 1
+        if not crystal_positions:
+            return
+        self.nhits += 1
+
+        ncrystals = len(crystal_positions)
+        self.log.info("%d crystals found in %s", ncrystals, self.imagedir / f"image_{i:04d}")
+
+        x, y = d_pos["exp_stage_position"]
+        if self.stage_position != (x, y):
+            with self.timer("return"):
+                self.ctrl.stage.set(x=x, y=y)
+                time.sleep(0.05)
+                self.stage_position = (x, y)
+
+        crystal_coords = [(crystal.x, crystal.y) for crystal in crystal_positions]
+
+        with self.timer("diffraction"):
             for k, d_cryst in enumerate(self.loop_crystals(crystal_coords)):
                 outfile = self.datadir / f"image_{i:04d}_{k:04d}"
                 comment = f"Image {i} Crystal {k}"
                 img, h = self.ctrl.getImage(binsize=self.diff_binsize, exposure=self.diff_exposure, comment=comment, header_keys=header_keys)
-                img, h = self.apply_corrections(img, h)
 
                 for d in (d_diff, d_pos, d_cryst):
                     h.update(d)
@@ -520,7 +566,7 @@ class Experiment(object):
                 # quality = neural_network.predict(img_processed)
                 # h["crystal_quality"] = quality
 
-                write_hdf5(outfile, img, header=h)
+                pool.submit(self.write_diffraction, outfile, img, h)
              
                 if self.sample_rotation_angles:
                     for rotation_angle in self.sample_rotation_angles:
@@ -529,17 +575,106 @@ class Experiment(object):
         
                         outfile = self.datadir / f"image_{i:04d}_{k:04d}_{rotation_angle}"
                         img, h = self.ctrl.getImage(exposure=self.diff_exposure, binsize=self.diff_binsize, comment=comment, header_keys=header_keys)
-                        img, h = self.apply_corrections(img, h)
                                                     
                         for d in (d_diff, d_pos, d_cryst):
                             h.update(d)
     
-                        write_hdf5(outfile, img, header=h)
+                        pool.submit(self.write_diffraction, outfile, img, h)
                     
                     self.ctrl.stage.a = 0
     
             self.image_mode()
 
+    def run(self, ctrl=None, **kwargs):
+        """Run serial electron diffraction experiment
+
+        The microscope is only accessed from this thread. With `pipeline=True` (default), the
+        analysis and writing of image i run in a pool of `analysis_workers` threads while the stage
+        moves to the next position and takes the next image. The diffraction patterns of the crystals
+        found are collected as soon as the analysis is done, by moving the stage back to position i.
+        The stage only moves on if the analysis is expected to take longer than such a return trip,
+        based on the timings so far. With `pipeline=False`, the diffraction patterns are always
+        collected before moving on.
+        The time spent per stage is logged at the end."""
+
+        self.initialize_microscope()
+
+        header_keys = kwargs.get("header_keys", None)
+        pipeline = kwargs.get("pipeline", True)
+        workers = kwargs.get("analysis_workers", 2)
+
+        d_image = {
+                "exp_neutral_diffshift": self.neutral_beamshift,
+                "exp_neutral_beamshift": self.neutral_diffshift,
+                "exp_image_spotsize": self.image_spotsize,
+                "exp_magnification": self.magnification,
+                "ImageDimensions": self.image_dimensions
+        }
+        d_diff = {
+                "exp_neutral_diffshift": self.neutral_beamshift,
+                "exp_neutral_beamshift": self.neutral_diffshift,
+                "exp_diff_brightness": self.diff_brightness,
+                "exp_diff_spotsize": self.diff_spotsize,
+                "exp_diff_cameralength": self.diff_cameralength,
+                "exp_diff_difffocus": self.diff_difffocus,
+                "ImagePixelsize": self.diff_pixelsize
+        }
+
+        self.log.info("d_image", d_image)
+        self.log.info("d_tiff", d_diff)
+
+        input("\nPress <ENTER> to start experiment ('Ctrl-C' to interrupt)\n")
+
+        self.timer = StageTimer()
+        self.stage_position = None
+        self.nanalysed = self.nhits = 0
+        # images taken, of which the diffraction patterns have not been collected yet
+        pending = deque()
+        npositions = 0
+
+        t_start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            t0 = time.perf_counter()
+            for i, d_pos in enumerate(self.loop_positions()):
+                self.timer.add("move", time.perf_counter() - t0)
+                self.stage_position = d_pos["exp_stage_position"]
+                npositions += 1
+
+                with self.timer("acquire"):
+                    if self.change_spotsize:
+                        self.ctrl.tem.setSpotSize(self.image_spotsize)
+            
+                    img, h = self.ctrl.getImage(exposure=self.image_exposure, binsize=self.image_binsize, header_keys=header_keys)
+            
+                    if self.change_spotsize:
+                        self.ctrl.tem.setSpotSize(self.image_spotsize)
+            
+                    self.ctrl.tem.setSpotSize(self.diff_spotsize)
+
+                t_submitted = time.perf_counter()
+                future = pool.submit(self.analyse_image, i, img, h, d_pos, d_image)
+                pending.append((i, d_pos, future))
+
+                if not pipeline or self.wait_here(future, t_submitted):
+                    with self.timer("wait"):
+                        wait([future])
+
+                # collect the diffraction data for the images that have been analysed,
+                # wait if the analysis falls too far behind
+                while pending and (pending[0][2].done() or len(pending) > 2 * workers):
+                    self.collect_diffraction(*pending.popleft(), pool=pool, d_diff=d_diff, header_keys=header_keys)
+
+                t0 = time.perf_counter()
+
+            while pending:
+                self.collect_diffraction(*pending.popleft(), pool=pool, d_diff=d_diff, header_keys=header_keys)
+
+        summary = self.timer.summary(npositions, time.perf_counter() - t_start)
+        self.log.info("Timing per stage:\n%s", summary)
+        print()
+        print(summary)
+
         print("\n\nData collection finished.")
 
 
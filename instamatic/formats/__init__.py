@@ -7,7 +7,7 @@ from pathlib import Path
 import tifffile
 
 from .csvIO import read_csv, write_csv, read_ycsv, write_ycsv, yaml_ordered_load, yaml_ordered_dump
-from .adscimage import write_adsc, read_adsc
+from .adscimage import write_adsc, read_adsc, update_adsc_header
 
 import warnings
 with warnings.catch_warnings():
@@ -18,21 +18,31 @@ with warnings.catch_warnings():
 
 from .mrc import read_image as read_mrc
 from .mrc import write_image as write_mrc
+from .mrc import append_image as append_mrc
+from .mrc import StackWriter as MRCStackWriter
+
+from .nexus import NexusWriter, read_nexus, is_nexus
 
 from .xdscbf import write as write_cbf
+from .xdscbf import read as read_cbf
+from .xdscbf import update_header as update_cbf_header
+
 
+def read_image(fname: str, mmap: bool=False) -> (np.array, dict):
+    """Guess filetype by extension
 
-def read_image(fname: str) -> (np.array, dict):
-    """Guess filetype by extension"""
+    mmap: for MRC files, return a `numpy.memmap` of the whole stack instead of reading the data"""
     ext = Path(fname).suffix.lower()
     if ext in (".tif", ".tiff"):
         img, h = read_tiff(fname)
-    elif ext in (".h5", ".hdf5"):
+    elif ext in (".h5", ".hdf5", ".nxs"):
         img, h = read_hdf5(fname)
     elif ext in (".img", ".smv"):
         img, h = read_adsc(fname)
     elif ext in (".mrc"):
-        img, h = read_mrc(fname)
+        img, h = read_mrc(fname, mmap=mmap)
+    elif ext in (".cbf",):
+        img, h = read_cbf(fname)
     else:
         raise IOError(f"Cannot open file {fname}, unknown extension: {ext}")
     return img, h 
@@ -114,14 +124,14 @@ def read_hdf5(fname: str) -> (np.array, dict):
     Returns:
         image: np.ndarray, header: dict
             a tuple of the image as numpy array and dictionary with all the tem parameters and image attributes
+
+    Rotation series written by `NexusWriter` are opened lazily, see `read_nexus`.
     """
     if not os.path.exists(fname):
         raise FileNotFoundError(f"No such file: '{fname}'")
         
-    f = h5py.File(fname)
+    f = h5py.File(fname, "r")
+    if is_nexus(f):
+        f.close()
+        return read_nexus(fname)
     return np.array(f["data"]), dict(f["data"].attrs)
-
-
-def read_cbf(fname: str):
-    """CBF reader not implemented"""
-    raise NotImplementedError("CBF reader not implemented.")
@@ -19,10 +19,8 @@ def swap_needed(header: dict) -> bool:
         return True
 
 
-def write_adsc(fname: str, data: np.array, header: dict={}):
-    """
-    Write adsc format
-    """
+def encode_header(header: dict) -> bytes:
+    """Encode the header dict as a block of bytes that is a multiple of 512"""
     out = b'{\n'
     for key in header:
         out += "{:}={:};\n".format(key, header[key]).encode()
@@ -35,6 +33,14 @@ def write_adsc(fname: str, data: np.array, header: dict={}):
         pad = hsize - len(out) - 2
     out +=  b"}" + (pad+1) * b'\x00' 
     assert len(out) % 512 == 0 , "Header is not multiple of 512"
+    return out
+
+
+def write_adsc(fname: str, data: np.array, header: dict={}):
+    """
+    Write adsc format
+    """
+    out = encode_header(header)
 
     # NOTE: XDS can handle only "SMV" images of TYPE=unsigned_short.
     dtype = np.uint16
@@ -47,6 +53,21 @@ def write_adsc(fname: str, data: np.array, header: dict={}):
         outf.write(data.tostring())
 
 
+def update_adsc_header(fname: str, header: dict):
+    """
+    Overwrite the header of an existing adsc file in place, leaving the image data untouched.
+    The new header must be the same size as the old one (i.e. the same `HEADER_BYTES`)
+    """
+    out = encode_header(header)
+
+    with open(fname, "r+b") as outf:
+        old = readheader(outf)
+        if int(old["HEADER_BYTES"]) != len(out):
+            raise ValueError(f"Header size mismatch: {len(out)} != {old['HEADER_BYTES']} ({fname})")
+        outf.seek(0)
+        outf.write(out)
+
+
 def readheader(infile):
     """ read an adsc header """
     header = {}
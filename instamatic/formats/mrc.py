@@ -487,7 +487,7 @@ def valid_image(filename, no_strict_mrc=False):
     finally:
         util.close(filename, f)
 
-def read_image(filename, index=None, cache=None, no_strict_mrc=False, force_volume=False):
+def read_image(filename, index=None, cache=None, no_strict_mrc=False, force_volume=False, mmap=False):
     ''' Read an image from the specified file in the MRC format
     
     :Parameters:
@@ -502,6 +502,9 @@ def read_image(filename, index=None, cache=None, no_strict_mrc=False, force_volu
                         to be off.
         force_volume : bool
                        For image to be read as a volume
+        mmap : bool
+               Return a read-only `numpy.memmap` instead of reading the data, if
+               index is None, the whole stack is mapped with shape (nz, ny, nx)
     
     :Returns:
             
@@ -509,6 +512,9 @@ def read_image(filename, index=None, cache=None, no_strict_mrc=False, force_volu
               Array with image information from the file
     '''
     
+    if mmap:
+        return read_memmap(filename, index=index, no_strict_mrc=no_strict_mrc)
+
     idx = 0 if index is None else index
     f = util.uopen(filename, 'rb')
     try:
@@ -535,6 +541,145 @@ def read_image(filename, index=None, cache=None, no_strict_mrc=False, force_volu
     #if header_image_dtype.newbyteorder()==h.dtype:out = out.byteswap()
     return out, header
 
+def read_memmap(filename, index=None, no_strict_mrc=False):
+    ''' Map the data in an MRC file to memory without reading it
+    
+    :Parameters:
+    
+        filename : str or file object
+                   Filename or open stream for a file
+        index : int, optional
+                Index of image to map, if None, the whole stack (Default: None)
+        no_strict_mrc : bool
+                        Perform strict MRC header checking
+    
+    :Returns:
+            
+        out : memmap
+              Read-only view of the data with shape (nz, ny, nx), or (ny, nx) if
+              an index is given or the file contains a single image
+        header : dict
+                 Dictionary with header information
+    '''
+    
+    h = read_mrc_header(filename, no_strict_mrc=no_strict_mrc)
+    header = read_header(h)
+    nx, ny, nz = int(h['nx'][0]), int(h['ny'][0]), int(h['nz'][0])
+    dtype = numpy.dtype(mrc2numpy[h['mode'][0]])
+    if header_image_dtype.newbyteorder()[0]==h.dtype[0]: dtype = dtype.newbyteorder()
+    offset = 1024+int(h['nsymbt'])
+    
+    if index is not None:
+        if index >= nz: raise IOError("Index exceeds number of images in stack: %d < %d"%(index, nz))
+        offset += index*nx*ny*dtype.itemsize
+        shape = (ny, nx)
+    elif nz > 1:
+        shape = (nz, ny, nx)
+    else:
+        shape = (ny, nx)
+    
+    out = numpy.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+    return out, header
+
+class StackWriter(object):
+    ''' Append images to an MRC stack, the NZ field in the header is updated
+    in place after every image, so that the file is valid at all times.
+    If the file exists, images are appended to the existing stack.
+    
+    :Parameters:
+    
+        filename : str
+                   Name of the output file
+        header : dict, optional
+                 Dictionary of header values, used when the file is created
+    '''
+    
+    def __init__(self, filename, header=None):
+        self.filename = filename
+        self.header = header
+        self.f = None
+        self.h = None
+        
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self.h = read_mrc_header(filename)
+            if header_image_dtype.newbyteorder()[0]==self.h.dtype[0]: 
+                raise IOError("Cannot append to MRC file with swapped byte order: %s"%filename)
+            self.f = open(filename, 'rb+')
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, kind, value, traceback):
+        self.close()
+    
+    @property
+    def count(self):
+        ''' Number of images in the stack '''
+        return 0 if self.h is None else int(self.h['nz'][0])
+    
+    def _update_field(self, name, value):
+        ''' Write a single header field in place '''
+        self.h[name] = value
+        self.f.seek(header_image_dtype.fields[name][1])
+        self.f.write(self.h[name].tobytes())
+    
+    def append(self, img):
+        ''' Add a 2D image to the end of the stack
+        
+        :Parameters:
+        
+            img : array
+                  Image array, must match the shape/dtype of the images in the stack
+        '''
+        
+        if self.f is None:
+            write_image(self.filename, img, header=self.header)
+            self.h = read_mrc_header(self.filename)
+            self.f = open(self.filename, 'rb+')
+            return
+        
+        try: img = img.astype(mrc2numpy[numpy2mrc[img.dtype.type]])
+        except:
+            raise TypeError("Unsupported type for MRC writing: %s"%str(img.dtype))
+        
+        nx, ny, nz = int(self.h['nx'][0]), int(self.h['ny'][0]), int(self.h['nz'][0])
+        if img.shape != (ny, nx) or numpy2mrc[img.dtype.type] != int(self.h['mode'][0]):
+            raise ValueError("Image (%s, %s) does not match stack (%s, mode %d)"%(img.shape, img.dtype, (ny, nx), int(self.h['mode'][0])))
+        
+        self.f.seek(int(1024+int(self.h['nsymbt'])+nz*nx*ny*img.dtype.itemsize))
+        img.tofile(self.f)
+        
+        nz += 1
+        self._update_field('amin', min(float(self.h['amin'][0]), numpy.min(img)))
+        self._update_field('amax', max(float(self.h['amax'][0]), numpy.max(img)))
+        self._update_field('amean', (float(self.h['amean'][0])*(nz-1) + numpy.mean(img)) / nz)
+        self._update_field('mz', nz)
+        self._update_field('zlen', nz)
+        self._update_field('nz', nz)
+        self.f.flush()
+    
+    def close(self):
+        ''' Close the file '''
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+def append_image(filename, img, header=None):
+    ''' Append an image to the MRC stack `filename`, the file is created if it does not exist
+    
+    :Parameters:
+    
+    filename : str
+               Name of the output file
+    img : array
+          Image array
+    header : dict, optional
+             Dictionary of header values, used when the file is created
+    '''
+    
+    with StackWriter(filename, header=header) as writer:
+        writer.append(img)
+
 def reshape_data(out, h, index, count, force_volume=False):
     ''' Reshape the data to the proper dimensions
     
@@ -0,0 +1,230 @@
+import threading
+import zlib
+import numpy as np
+import h5py
+
+# Single file HDF5 container for a rotation series, loosely following the NeXus layout
+#
+#   /entry                          NXentry
+#   /entry/data/data                NXdata, frames x H x W, chunked per frame (gzip + shuffle)
+#   /entry/frame_headers            structured array with the header of every frame
+#   /entry/sample/goniometer/omega  rotation angle of every frame
+#   /entry/instrument/...           detector/beam geometry
+#
+# The frames are compressed in the calling thread and written to the file as raw chunks,
+# so that several threads can compress frames at the same time. The file is only accessed
+# while holding a lock, because h5py is not thread-safe.
+
+DATA = "entry/data/data"
+FRAME_HEADERS = "entry/frame_headers"
+OMEGA = "entry/sample/goniometer/omega"
+
+
+def _flatten(dct: dict, prefix: str="") -> dict:
+    """Flatten nested dicts, keys are joined by '.'"""
+    ret = {}
+    for key, value in dct.items():
+        key = f"{prefix}{key}"
+        if isinstance(value, dict):
+            ret.update(_flatten(value, prefix=f"{key}."))
+        else:
+            ret[key] = value
+    return ret
+
+
+def _unflatten(dct: dict) -> dict:
+    """Inverse of `_flatten`"""
+    ret = {}
+    for key, value in dct.items():
+        *parents, name = key.split(".")
+        d = ret
+        for parent in parents:
+            d = d.setdefault(parent, {})
+        d[name] = value
+    return ret
+
+
+def _field_dtype(values: list):
+    """Guess the dtype for a structured array field from the values of all frames"""
+    if all(isinstance(v, (bool, np.bool_)) for v in values):
+        return np.bool_
+    if all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in values):
+        return np.int64
+    if all(isinstance(v, (int, float, np.number)) for v in values):
+        return np.float64
+    if all(isinstance(v, (tuple, list, np.ndarray)) for v in values):
+        arrs = [np.asarray(v) for v in values]
+        if all(arr.dtype.kind in "biuf" for arr in arrs) and len(set(arr.shape for arr in arrs)) == 1:
+            return (np.float64, arrs[0].shape)
+    nbytes = max(len(str(v).encode()) for v in values)
+    return f"S{max(nbytes, 1)}"
+
+
+def headers_to_records(headers: dict, nframes: int=None) -> np.ndarray:
+    """Convert a dict of {frame number: header} to a structured array with one row per frame
+    (frame numbers start at 1). Nested dicts are flattened, values that are not numbers or
+    arrays of numbers are stored as strings. Frames without a header are filled with NaN/0."""
+    if nframes is None:
+        nframes = max(headers, default=0)
+
+    flat = {i: _flatten(h) for i, h in headers.items()}
+
+    keys = []
+    for h in flat.values():
+        for key in h:
+            if key not in keys:
+                keys.append(key)
+
+    fields = [("frame", np.int64)]
+    for key in keys:
+        values = [h[key] for h in flat.values() if key in h]
+        fields.append((key, _field_dtype(values)))
+
+    records = np.zeros(nframes, dtype=fields)
+    records["frame"] = np.arange(1, nframes + 1)
+    for key, dtype in fields[1:]:
+        if records.dtype[key].kind == "f" or records.dtype[key].subdtype:
+            records[key] = np.nan
+
+    for i, h in flat.items():
+        row = records[i - 1]
+        for key, value in h.items():
+            if records.dtype[key].kind == "S":
+                value = str(value).encode()
+            row[key] = value
+
+    return records
+
+
+def record_to_header(record) -> dict:
+    """Convert a row of the frame headers back to a (nested) header dict"""
+    header = {}
+    for key in record.dtype.names:
+        value = record[key]
+        if isinstance(value, bytes):
+            value = value.decode()
+        elif isinstance(value, np.ndarray):
+            value = tuple(value.tolist())
+        else:
+            value = value.item()
+        header[key] = value
+    return _unflatten(header)
+
+
+class NexusWriter(object):
+    """Write a rotation series to a single chunked, compressed HDF5 file.
+
+    fname: path to the file, it is overwritten if it exists
+    dtype: data type of the stored frames
+    compression_level: gzip level (1-9)
+
+    Frames are written with `write`, which may be called from several threads at the same time.
+    The dataset is created on the first frame, and grows as frames are added. `close` stores
+    the frame headers and geometry, and closes the file.
+    """
+    def __init__(self, fname: str, dtype: str="int32", compression_level: int=1):
+        super().__init__()
+        self.fname = fname
+        self.dtype = np.dtype(dtype)
+        self.compression_level = compression_level
+
+        self.headers = {}
+        self._lock = threading.Lock()
+
+        self.f = h5py.File(fname, "w")
+        self.f.create_group("entry").attrs["NX_class"] = "NXentry"
+        self.dset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def _create_dataset(self, shape: tuple) -> None:
+        grp = self.f.create_group("entry/data")
+        grp.attrs["NX_class"] = "NXdata"
+        grp.attrs["signal"] = "data"
+        self.dset = grp.create_dataset("data", shape=(0, *shape), maxshape=(None, *shape),
+                                       chunks=(1, *shape), dtype=self.dtype,
+                                       compression="gzip", compression_opts=self.compression_level,
+                                       shuffle=True)
+
+    def compress(self, img: np.ndarray) -> bytes:
+        """Compress `img` in the same way as the hdf5 filter pipeline (shuffle + deflate)"""
+        arr = np.ascontiguousarray(img, dtype=self.dtype)
+        shuffled = arr.view(np.uint8).reshape(-1, self.dtype.itemsize).T.tobytes()
+        return zlib.compress(shuffled, self.compression_level)
+
+    def write(self, i: int, img: np.ndarray, header: dict=None) -> None:
+        """Write frame `i` (starting at 1) and store its header"""
+        chunk = self.compress(img)
+
+        with self._lock:
+            if self.dset is None:
+                self._create_dataset(img.shape)
+            if self.dset.shape[0] < i:
+                self.dset.resize(i, axis=0)
+            self.dset.id.write_direct_chunk((i - 1, 0, 0), chunk)
+            self.headers[i] = dict(header) if header else {}
+
+    def close(self, attrs: dict=None, omega: np.ndarray=None, geometry: dict=None) -> None:
+        """Store the frame headers and close the file
+
+        attrs: dict of attributes stored on the data set
+        omega: rotation angle for every frame (degrees)
+        geometry: dict with `distance` (mm), `pixel_size` (mm), `beam_center` (px, x/y), `wavelength` (Angstrom)
+        """
+        with self._lock:
+            if not self.f:
+                return
+
+            nframes = self.dset.shape[0] if self.dset is not None else 0
+
+            if self.headers:
+                self.f.create_dataset(FRAME_HEADERS, data=headers_to_records(self.headers, nframes=nframes))
+            if attrs and self.dset is not None:
+                self.dset.attrs.update(attrs)
+            if omega is not None:
+                ds = self.f.create_dataset(OMEGA, data=np.asarray(omega, dtype=float))
+                ds.attrs["units"] = "deg"
+
+            if geometry:
+                det = self.f.create_group("entry/instrument/detector")
+                det.attrs["NX_class"] = "NXdetector"
+                for key, name, units in (("distance", "distance", "mm"), ("pixel_size", "x_pixel_size", "mm"),
+                                         ("pixel_size", "y_pixel_size", "mm")):
+                    if key in geometry:
+                        det.create_dataset(name, data=geometry[key]).attrs["units"] = units
+                if "beam_center" in geometry:
+                    cx, cy = geometry["beam_center"]
+                    det.create_dataset("beam_center_x", data=cx).attrs["units"] = "pixel"
+                    det.create_dataset("beam_center_y", data=cy).attrs["units"] = "pixel"
+                if "wavelength" in geometry:
+                    beam = self.f.create_group("entry/instrument/beam")
+                    beam.attrs["NX_class"] = "NXbeam"
+                    beam.create_dataset("incident_wavelength", data=geometry["wavelength"]).attrs["units"] = "angstrom"
+
+            self.f.close()
+
+
+def is_nexus(f) -> bool:
+    """Check if the open hdf5 file `f` was written by `NexusWriter`"""
+    return DATA in f
+
+
+def read_nexus(fname: str) -> (h5py.Dataset, dict):
+    """Open a file written by `NexusWriter`
+
+    Returns:
+        data: h5py.Dataset, frames x H x W, read lazily on indexing (i.e. `data[0]` returns the first frame)
+        header: dict with the attributes of the data, the `frame_headers` (structured array) and `omega`
+    """
+    f = h5py.File(fname, "r")
+    data = f[DATA]
+    header = dict(data.attrs)
+    if FRAME_HEADERS in f:
+        header["frame_headers"] = f[FRAME_HEADERS][()]
+    if OMEGA in f:
+        header["omega"] = f[OMEGA][()]
+    return data, header
@@ -16,16 +16,63 @@ DATA_TYPES = {"signed 8-bit integer": "int8",
 
 STARTER = b"\x0c\x1a\x04\xd5"
 
+# reserved header key for the date line of a miniCBF header, which has no key of its own
+TIMESTAMP = "Timestamp"
+
 
 def compByteOffset(data):
     """
     Compress a dataset into a string using the byte_offet algorithm
 
+    All values are written to a single preallocated buffer, the positions of the
+    1/3/7/15 byte elements are determined from the cumulative sum of their sizes.
+
     :param data: ndarray
     :return: string/bytes with compressed data
 
     test = np.array([0,1,2,127,0,1,2,128,0,1,2,32767,0,1,2,32768,0,1,2,2147483647,0,1,2,2147483648,0,1,2,128,129,130,32767,32768,128,129,130,32768,2147483647,2147483648])
 
+    """
+    flat = np.ascontiguousarray(data.ravel(), np.int64)
+    delta = np.empty_like(flat)
+    delta[:1] = flat[:1]
+    np.subtract(flat[1:], flat[:-1], out=delta[1:])
+
+    absdelta = np.abs(delta)
+    size = np.ones(delta.shape, dtype=np.int64)
+    size[absdelta > 127] = 3
+    size[absdelta > 32767] = 7  # 2**15-1
+    size[absdelta > 2147483647] = 15  # 2**31-1
+
+    offset = np.cumsum(size)
+    total = int(offset[-1]) if offset.size else 0
+    offset -= size
+
+    out = np.empty(total, dtype=np.uint8)
+
+    sel = size == 1
+    out[offset[sel]] = delta[sel].astype(np.int8).view(np.uint8)
+
+    for nbytes, prefix, dtype in ((3, b"\x80", "<i2"),
+                                  (7, b"\x80\x00\x80", "<i4"),
+                                  (15, b"\x80\x00\x80\x00\x00\x00\x80", "<i8")):
+        sel = size == nbytes
+        if not np.any(sel):
+            continue
+        pos = offset[sel]
+        for i, byte in enumerate(prefix):
+            out[pos + i] = byte
+        values = delta[sel].astype(dtype).view(np.uint8).reshape(-1, np.dtype(dtype).itemsize)
+        pos = pos[:, np.newaxis] + np.arange(len(prefix), nbytes)
+        out[pos] = values
+
+    return out.tobytes()
+
+
+def _compByteOffset_loop(data):
+    """
+    Reference implementation of the byte_offset algorithm that loops over
+    all exceptions, kept for testing/benchmarking `compByteOffset`
     """
     flat = np.ascontiguousarray(data.ravel(), np.int64)
     delta = np.zeros_like(flat)
@@ -68,10 +115,109 @@ def compByteOffset(data):
     return binary_blob
 
 
-def write(fname, data, header={}):
+def decByteOffset(stream, size: int=None, dtype="int64"):
+    """
+    Decompress a string/bytes compressed using the byte_offset algorithm
+
+    Every 0x80 byte is a candidate for the start of a multi-byte element. Their lengths are
+    determined vectorized, and only candidates that may be overlapped by the payload of a
+    preceding element (i.e. a payload containing 0x80) are resolved in order.
+
+    :param stream: string/bytes with compressed data
+    :param size: number of elements expected, checked if given
+    :param dtype: dtype of the returned array
+    :return: 1D ndarray
+    """
+    n = len(stream)
+    buf = np.zeros(n + 16, dtype=np.uint8)  # pad so that the payloads can be read near the end
+    buf[:n] = np.frombuffer(stream, dtype=np.uint8)
+
+    candidates = np.nonzero(buf[:n] == 0x80)[0]
+
+    def read(pos, offset, exc_dtype):
+        """Read values of `exc_dtype` at `pos + offset`"""
+        itemsize = np.dtype(exc_dtype).itemsize
+        idx = pos[:, np.newaxis] + offset + np.arange(itemsize)
+        return buf[idx].copy().view(exc_dtype).ravel()
+
+    length = np.full(candidates.shape, 3, dtype=np.int64)
+    is_32 = read(candidates, 1, "<i2") == -32768
+    length[is_32] = 7
+    is_64 = is_32.copy()
+    is_64[is_32] = read(candidates[is_32], 3, "<i4") == -2147483648
+    length[is_64] = 15
+    end = candidates + length
+
+    # candidates that are not overlapped by any preceding candidate are real elements
+    real = np.ones(candidates.shape, dtype=bool)
+    if candidates.size > 1:
+        prev_end = np.maximum.accumulate(end)
+        ambiguous = np.nonzero(candidates[1:] < prev_end[:-1])[0] + 1
+
+        for i in ambiguous:
+            j = i - 1
+            while not real[j]:
+                j -= 1
+            real[i] = candidates[i] >= end[j]
+
+    starts = candidates[real]
+    length = length[real]
+
+    # mark the payload bytes of the multi-byte elements
+    mark = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(mark, starts + 1, 1)
+    np.add.at(mark, starts + length, -1)
+    is_element = np.cumsum(mark[:n]) == 0
+
+    positions = np.nonzero(is_element)[0]
+    delta = buf[positions].view(np.int8).astype(np.int64)
+
+    index = np.searchsorted(positions, starts)
+    for nbytes, offset, exc_dtype in ((3, 1, "<i2"), (7, 3, "<i4"), (15, 7, "<i8")):
+        sel = length == nbytes
+        if np.any(sel):
+            delta[index[sel]] = read(starts[sel], offset, exc_dtype)
+
+    if size is not None and delta.size != size:
+        raise ValueError(f"Expected {size} elements, but decompressed {delta.size}")
+
+    return np.cumsum(delta).astype(dtype)
+
+
+def header_block(header: dict=None) -> list:
+    """
+    Return the lines of the CBF file before the binary section.
+    If `header` is given, the key/value pairs are written as a miniCBF header (PILATUS_1.2 convention),
+    i.e. `# Wavelength 0.0251 A`. The value of `TIMESTAMP` is written as the bare date line.
+    """
+    lines = [b'###CBF: Version July 2008 generated by XDS',
+             b'',
+             b'data_a.cbf',
+             b'']
+
+    if header:
+        lines.append(b'_array_data.header_convention "PILATUS_1.2"')
+        lines.append(b'_array_data.header_contents')
+        lines.append(b';')
+        for key, value in header.items():
+            line = f"# {value}" if key == TIMESTAMP else f"# {key} {value}"
+            lines.append(line.encode())
+        lines.append(b';')
+    else:
+        lines.extend([b'_array_data.header_convention "XDS special"',
+                      b'_array_data.header_contents',
+                      b';',
+                      b';'])
+
+    lines.append(b'')
+    return lines
+
+
+def write(fname, data, header: dict=None):
     """
     write the file in CBF format
     :param str fname: name of the file
+    :param dict header: miniCBF header items (optional)
     """
     if data is not None:
         dim2, dim1 = data.shape
@@ -82,15 +228,7 @@ def write(fname, data, header={}):
     for key, value in DATA_TYPES.items():
         if value == data.dtype:
             dtype = key
-    binary_block = [b'###CBF: Version July 2008 generated by XDS',
-                    b'',
-                    b'data_a.cbf',
-                    b'',
-                    b'_array_data.header_convention "XDS special"',
-                    b'_array_data.header_contents',
-                    b';',
-                    b';',
-                    b'',
+    binary_block = header_block(header) + [
                     b'_array_data.data',
                     b';',
                     b"--CIF-BINARY-FORMAT-SECTION--",
@@ -115,8 +253,105 @@ def write(fname, data, header={}):
         out_file.write(cbf)
 
 
+def update_header(fname, header: dict) -> None:
+    """
+    Replace the header of the CBF file `fname` by `header`, the binary
+    section is copied as is, so that the data do not have to be compressed again
+    """
+    with open(fname, "rb") as f:
+        raw = f.read()
+
+    idx = raw.find(b"_array_data.data")
+    if idx < 0:
+        raise RuntimeError(f"No data section found in {fname}")
+
+    prefix = b"\r\n".join(header_block(header) + [b""])
+
+    with open(fname, "wb") as f:
+        f.write(prefix + raw[idx:])
+
+
+def read(fname):
+    """
+    read the file in CBF format (byte_offset compression only)
+    :param str fname: name of the file
+    :return: image data (ndarray) and header (dict)
+    """
+    with open(fname, "rb") as f:
+        raw = f.read()
+
+    idx = raw.find(STARTER)
+    if idx < 0:
+        raise RuntimeError(f"No binary section found in {fname}")
+
+    header = {}
+    for line in raw[:idx].decode(errors="replace").splitlines():
+        if line.startswith("# "):
+            # miniCBF header item
+            key, _, value = line[2:].partition(" ")
+            if not value:
+                # the date line
+                key, value = TIMESTAMP, key
+            header[key.rstrip(":")] = value.strip()
+        elif ":" in line and not line.startswith("#"):
+            key, value = line.split(":", 1)
+            header[key.strip()] = value.strip().strip(";").strip('"')
+
+    if "x-CBF_BYTE_OFFSET" not in raw[:idx].decode(errors="replace"):
+        raise NotImplementedError(f"{fname}: only byte_offset compression is supported")
+
+    size = int(header["X-Binary-Size"])
+    dim1 = int(header["X-Binary-Size-Fastest-Dimension"])
+    dim2 = int(header["X-Binary-Size-Second-Dimension"])
+    dtype = DATA_TYPES.get(header.get("X-Binary-Element-Type"), "int32")
+
+    start = idx + len(STARTER)
+    stream = raw[start:start + size]
+
+    data = decByteOffset(stream, size=dim1 * dim2, dtype=dtype).reshape(dim2, dim1)
+
+    return data, header
+
+
+def benchmark(shapes: tuple=((512, 512), (2048, 2048)), dtype: str="int32", repeat: int=3) -> None:
+    """Compare the vectorized byte_offset compression with the reference implementation
+    on noisy diffraction-like frames of `shapes` with `dtype`"""
+    import time
+
+    def timeit(func, *args, **kwargs):
+        best = float("inf")
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            ret = func(*args, **kwargs)
+            best = min(best, time.perf_counter() - t0)
+        return best, ret
+
+    for shape in shapes:
+        # mostly small counts with some strong reflections, includes all element sizes
+        img = np.random.poisson(20, size=shape).astype(np.int64)
+        n = img.size
+        img.flat[np.random.choice(n, n // 20, replace=False)] += np.random.randint(0, 30000, size=n // 20)
+        img.flat[np.random.choice(n, n // 1000, replace=False)] += np.random.randint(0, 2**20, size=n // 1000)
+        img = img.astype(dtype)
+
+        t0 = time.perf_counter()
+        ref = _compByteOffset_loop(img)  # slow for large frames, only run once
+        t_loop = time.perf_counter() - t0
+        t_vec, blob = timeit(compByteOffset, img)
+        t_dec, arr = timeit(decByteOffset, blob, size=n, dtype=dtype)
+
+        assert blob == ref, "Compressed data do not match the reference implementation"
+        assert np.array_equal(arr.reshape(shape), img), "Round trip failed"
+
+        print(f"{shape} {dtype} ({len(blob)/img.nbytes:.0%} compressed)")
+        print(f"  compress (loop)      : {t_loop*1000:8.1f} ms")
+        print(f"  compress (vectorized): {t_vec*1000:8.1f} ms ({t_loop/t_vec:.1f}x)")
+        print(f"  decompress           : {t_dec*1000:8.1f} ms")
+
+
 if __name__ == '__main__':
     arr = np.arange(128*128).reshape(128, 128)
     write("a.cbf", arr)
     print("run `xdsviewer a.cbf`")
 
+    benchmark()
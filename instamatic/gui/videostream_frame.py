@@ -2,7 +2,7 @@ from tkinter import *
 from tkinter.ttk import *
 from instamatic.utils.spinbox import Spinbox
 import time
-from PIL import Image, ImageEnhance
+from PIL import Image
 from PIL import ImageTk
 import numpy as np
 import threading
@@ -11,6 +11,117 @@ from instamatic.formats import write_tiff, read_tiff
 from instamatic.processing.flatfield import apply_flatfield_correction
 
 
+class FrameRenderer(threading.Thread):
+    """Render the latest frame of the stream for display on a worker thread
+
+    Contrast scaling, downsampling and conversion to uint8 (through a lookup table for integer
+    frames) are done here, into a reusable buffer. The result is published in `self.slot` as
+    `(number, image, frame)`, where the image owns a copy of the buffer. The slot is replaced as
+    a whole (a single attribute assignment), so the GUI can read it without a lock and only has
+    to blit the image. Frames that arrive while a frame is rendered are dropped, only the latest
+    one is rendered.
+
+    The display settings (`auto_contrast`, `display_range`, `brightness`, `resize_image`)
+    are read on every frame, and can be changed from the GUI thread.
+    """
+    def __init__(self, stream, display_range: float, max_display_size: int=1024, poll_interval: float=0.002):
+        super().__init__(daemon=True)
+
+        self.stream = stream
+        self.display_range = self.display_range_default = display_range
+        self.auto_contrast = True
+        self.brightness = 1.0
+        self.resize_image = False
+        self.resize_shape = (950, 950)
+        self.max_display_size = max_display_size
+        self.poll_interval = poll_interval
+
+        self.slot = None
+        self.nframes_in = 0    # number of distinct frames seen
+        self.nframes_out = 0   # number of frames rendered
+
+        self._buffer = None
+        self._scratch = None
+        self._lut = None
+        self._lut_scale = None
+        self._last_frame = None
+
+        self.stopEvent = threading.Event()
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            frame = self.stream.frame
+            if frame is None or frame is self._last_frame:
+                time.sleep(self.poll_interval)
+                continue
+
+            self._last_frame = frame
+            self.nframes_in += 1
+
+            image = self.render(frame)
+
+            self.nframes_out += 1
+            self.slot = (self.nframes_out, image, frame)
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def get_scale(self, frame: np.ndarray) -> float:
+        """Scale factor to map the frame to the display range of 0 to 256"""
+        # the display range in ImageTk is from 0 to 256
+        if self.auto_contrast:
+            vmax = 1 + np.percentile(frame[::4,::4], 99.5)  # use 128x128 array for faster calculation
+        elif self.display_range != self.display_range_default:
+            vmax = self.display_range
+        else:
+            vmax = 256.0
+        return self.brightness * 256.0 / vmax
+
+    def _get_buffer(self, shape: tuple) -> np.ndarray:
+        if self._buffer is None or self._buffer.shape != shape:
+            self._buffer = np.empty(shape, dtype=np.uint8)
+        return self._buffer
+
+    def _get_lut(self, scale: float, size: int) -> np.ndarray:
+        if self._lut is None or self._lut_scale != scale or len(self._lut) != size:
+            lut = np.arange(size, dtype=np.float32)
+            lut *= scale
+            np.clip(lut, 0, 255, out=lut)
+            self._lut = lut.astype(np.uint8)
+            self._lut_scale = scale
+        return self._lut
+
+    def render(self, frame: np.ndarray) -> "Image":
+        """Convert the frame to an 8-bit image for display"""
+        step = 1
+        if self.max_display_size:
+            step = max(1, -(-max(frame.shape) // self.max_display_size))
+        if step > 1:
+            frame = frame[::step, ::step]
+
+        scale = self.get_scale(frame)
+        out = self._get_buffer(frame.shape)
+
+        if frame.dtype.kind == "u" and frame.dtype.itemsize <= 2:
+            lut = self._get_lut(scale, 1 << (8 * frame.dtype.itemsize))
+            out[...] = lut[frame]  # faster than np.take(..., out=out)
+        else:
+            if self._scratch is None or self._scratch.shape != frame.shape:
+                self._scratch = np.empty(frame.shape, dtype=np.float32)
+            np.multiply(frame, scale, out=self._scratch, casting="unsafe")
+            np.clip(self._scratch, 0, 255, out=self._scratch)
+            out[...] = self._scratch
+
+        # `Image.fromarray` shares memory with `out`, which is overwritten by the next frame
+        # while the GUI thread may still be reading the image
+        image = Image.fromarray(out.copy())
+
+        if self.resize_image:
+            image = image.resize(self.resize_shape)
+
+        return image
+
+
 class VideoStreamFrame(Frame):
     """docstring for VideoStreamFrame"""
     def __init__(self, parent, stream, app=None):
@@ -32,10 +143,15 @@ class VideoStreamFrame(Frame):
 
         self.resize_image = False
 
+        self.renderer = FrameRenderer(self.stream, display_range=self.display_range_default)
+        self.frame = None
+        self.last_shown = None
+
         self.last = time.perf_counter()
-        self.nframes = 1
+        self.nframes = 0
+        self.last_acquired = None
         self.update_frequency = 0.25
-        self.last_interval = self.frametime
+        self.last_fps = self.last_acq_fps = 1.0/self.frametime
 
         self._atexit_funcs = []
 
@@ -57,7 +173,7 @@ class VideoStreamFrame(Frame):
 
     def init_vars(self):
         self.var_fps = DoubleVar()
-        self.var_interval = DoubleVar()
+        self.var_acq_fps = DoubleVar()
         # self.var_overhead = DoubleVar()
 
         self.var_frametime = DoubleVar()
@@ -93,14 +209,14 @@ class VideoStreamFrame(Frame):
         self.cb_contrast = Checkbutton(frame, text="Auto contrast", variable=self.var_auto_contrast)
         self.cb_contrast.grid(row=1, column=5)
 
+        self.e_acq_fps  = Entry(frame, width=lwidth, textvariable=self.var_acq_fps, state=DISABLED)
         self.e_fps      = Entry(frame, width=lwidth, textvariable=self.var_fps, state=DISABLED)
-        self.e_interval = Entry(frame, width=lwidth, textvariable=self.var_interval, state=DISABLED)
         # self.e_overhead    = Entry(frame, bd=0, width=ewidth, textvariable=self.var_overhead, state=DISABLED)
         
-        Label(frame, width=lwidth, text="fps:").grid(row=1, column=0)
-        self.e_fps.grid(row=1, column=1, sticky='we')
-        Label(frame, width=lwidth, text="interval (ms):").grid(row=1, column=2)
-        self.e_interval.grid(row=1, column=3, sticky='we')
+        Label(frame, width=lwidth, text="acquire fps:").grid(row=1, column=0)
+        self.e_acq_fps.grid(row=1, column=1, sticky='we')
+        Label(frame, width=lwidth, text="display fps:").grid(row=1, column=2)
+        self.e_fps.grid(row=1, column=3, sticky='we')
         # Label(frame, width=lwidth, text="overhead (ms):").grid(row=1, column=4)
         # self.e_overhead.grid(row=1, column=5)
         
@@ -139,14 +255,14 @@ class VideoStreamFrame(Frame):
     def update_resize_image(self, name, index, mode):
         # print name, index, mode
         try:
-            self.resize_image = self.var_resize_image.get()
+            self.resize_image = self.renderer.resize_image = self.var_resize_image.get()
         except:
             pass
 
     def update_auto_contrast(self, name, index, mode):
         # print name, index, mode
         try:
-            self.auto_contrast = self.var_auto_contrast.get()
+            self.auto_contrast = self.renderer.auto_contrast = self.var_auto_contrast.get()
         except:
             pass
 
@@ -162,14 +278,14 @@ class VideoStreamFrame(Frame):
     def update_brightness(self, name, index, mode):
         # print name, index, mode
         try:
-            self.brightness = self.var_brightness.get()
+            self.brightness = self.renderer.brightness = self.var_brightness.get()
         except:
             pass
         
     def update_display_range(self, name, index, mode):
         try:
             val = self.var_display_range.get()
-            self.display_range = max(1, val)
+            self.display_range = self.renderer.display_range = max(1, val)
         except:
             pass
 
@@ -199,6 +315,7 @@ class VideoStreamFrame(Frame):
         print(" >> Wrote file:", outfile)
 
     def close(self):
+        self.renderer.stop()
         self.stream.close()
         self.parent.quit()
         # for func in self._atexit_funcs:
@@ -206,37 +323,23 @@ class VideoStreamFrame(Frame):
 
     def start_stream(self):
         self.stream.update_frametime(self.frametime)
+        self.renderer.start()
         self.parent.after(500, self.on_frame)
 
     def on_frame(self, event=None):
-        self.stream.lock.acquire(True)
-        self.frame = frame = self.stream.frame
-        self.stream.lock.release()
+        # the frame is rendered by `self.renderer`, only show the latest image here
+        slot = self.renderer.slot
 
-        # the display range in ImageTk is from 0 to 256
-        if self.auto_contrast:
-            frame = frame * (256.0 / (1 + np.percentile(frame[::4,::4], 99.5)))  # use 128x128 array for faster calculation
-                                                                                 
-            image = Image.fromarray(frame)
-        elif self.display_range != self.display_range_default:
-            image = np.clip(frame, 0, self.display_range)
-            image = (256.0 / self.display_range)*image
-            image = Image.fromarray(image)
-        else:
-            image = Image.fromarray(frame)
-            
-        if self.brightness != 1:
-            image = ImageEnhance.Brightness(image.convert("L")).enhance(self.brightness)
-            # Can also use ImageEnhance.Sharpness or ImageEnhance.Contrast if needed
-        
-        if self.resize_image:
-            image = image.resize((950, 950))
+        if slot is not None and slot[0] != self.last_shown:
+            self.last_shown, image, self.frame = slot
 
-        image = ImageTk.PhotoImage(image=image)
+            image = ImageTk.PhotoImage(image=image)
+
+            self.panel.configure(image=image)
+            # keep a reference to avoid premature garbage collection
+            self.panel.image = image
 
-        self.panel.configure(image=image)
-        # keep a reference to avoid premature garbage collection
-        self.panel.image = image
+            self.nframes += 1
 
         self.update_frametimes()
         # self.parent.update_idletasks()
@@ -244,26 +347,27 @@ class VideoStreamFrame(Frame):
         self.parent.after(self.frame_delay, self.on_frame)
 
     def update_frametimes(self):
+        """Update the acquisition and display frame rates"""
         self.current = time.perf_counter()
         delta = self.current - self.last
 
         if delta > self.update_frequency:
-            interval = delta/self.nframes
-
-            interval = (interval * 0.5) + (self.last_interval * 0.5)
+            acquired = getattr(self.stream, "frame_count", self.renderer.nframes_in)
+            if self.last_acquired is None:
+                self.last_acquired = acquired
 
-            fps = 1.0/interval
-            # overhead = interval - self.stream.frametime
+            fps = (self.nframes / delta * 0.5) + (self.last_fps * 0.5)
+            acq_fps = ((acquired - self.last_acquired) / delta * 0.5) + (self.last_acq_fps * 0.5)
 
             self.var_fps.set(round(fps, 2))
-            self.var_interval.set(round(interval*1000, 2))
-            # self.var_overhead.set(round(overhead*1000, 2))
+            self.var_acq_fps.set(round(acq_fps, 2))
+
             self.last = self.current
-            self.nframes = 1
+            self.nframes = 0
+            self.last_acquired = acquired
 
-            self.last_interval = interval
-        else:
-            self.nframes += 1
+            self.last_fps = fps
+            self.last_acq_fps = acq_fps
 
 
 def start_gui(stream):
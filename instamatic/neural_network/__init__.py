@@ -1,2 +1,3 @@
-from .neural_network import predict
+from .neural_network import predict, predict_batch
 from .preprocess import preprocess
+from .scoring import QualityScorer, AbortPolicy
@@ -1,10 +1,84 @@
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import pickle
 from pathlib import Path
 
 with open(Path(__file__).parent / "weights-py3.p", "rb") as p_file:
     weights = pickle.load(p_file)
 
+# number of patterns per pass in `predict_batch`, bounds the size of the im2col matrices
+BATCH_SIZE = 4
+
+
+def prepare_weights(weights):
+    """Return the weights as contiguous float32 arrays"""
+    return [np.ascontiguousarray(w, dtype=np.float32) for w in weights]
+
+
+weights32 = prepare_weights(weights)
+
+
+def im2col(in_layer, k=3):
+    """Sliding window view of the (N, H, W, C) batch `in_layer`, with shape (N, H-k+1, W-k+1, k, k, C).
+    No data is copied."""
+    n, h, w, c = in_layer.shape
+    sn, sh, sw, sc = in_layer.strides
+    return as_strided(in_layer, shape=(n, h-k+1, w-k+1, k, k, c), strides=(sn, sh, sw, sh, sw, sc), writeable=False)
+
+
+def conv_layer_batch(in_layer, weight, offset):
+    """3x3 valid convolution of the (N, H, W, C) batch `in_layer`, weight has shape (3, 3, C, F)"""
+    windows = im2col(in_layer, k=weight.shape[0])
+    n, h, w = windows.shape[:3]
+    cols = windows.reshape(n*h*w, -1)
+    convoluted = np.dot(cols, weight.reshape(cols.shape[1], -1))
+    convoluted += offset
+    return convoluted.reshape(n, h, w, -1)
+
+
+def max_pooling_batch(convoluted):
+    """2x2 max pooling of the (N, H, W, C) batch `convoluted`, odd rows/columns are dropped"""
+    n, h, w, c = convoluted.shape
+    h, w = h//2, w//2
+    return convoluted[:, :h*2, :w*2].reshape(n, h, 2, w, 2, c).max(axis=(2, 4))
+
+
+def relu(convoluted):
+    return np.maximum(convoluted, 0, out=convoluted)
+
+
+def logistic(x):
+    return 1/(1+np.exp(-x))
+
+
+def predict_batch(images, weights=None, batch_size: int=BATCH_SIZE):
+    """Predict the quality of a stack of preprocessed patterns (N, 150, 150, 1), returns an array of N scores"""
+    weights = weights32 if weights is None else prepare_weights(weights)
+    images = np.asarray(images, dtype=np.float32)
+    if images.ndim == 3:
+        images = images[..., np.newaxis]
+
+    scores = np.empty(len(images))
+    for i in range(0, len(images), batch_size):
+        x = images[i:i+batch_size]
+        for j in range(0, 8, 2):
+            x = max_pooling_batch(relu(conv_layer_batch(x, weights[j], weights[j+1])))
+        x = relu(conv_layer_batch(x, weights[8], weights[9]))
+        flattened = x.reshape(len(x), -1)
+        dense1 = relu(np.dot(flattened, weights[10]) + weights[11])
+        dense2 = relu(np.dot(dense1, weights[12]) + weights[13])
+        dense3 = np.dot(dense2, weights[14]) + weights[15]
+        scores[i:i+batch_size] = logistic(dense3[:, 0].astype(float))
+
+    return scores
+
+
+def predict(image, weights=None):
+    """Predict the quality of a preprocessed pattern (150, 150, 1)"""
+    return predict_batch(image[np.newaxis], weights=weights)[0]
+
+
+# reference implementation with a python loop per output pixel, used in `benchmark`
 
 def conv_layer(in_layer, weight, offset):
     first_layer = np.ones([(in_layer.shape[0]-2)*(in_layer.shape[1]-2), in_layer.shape[2], 3, 3])
@@ -18,10 +92,6 @@ def conv_layer(in_layer, weight, offset):
     convoluted_reshaped += offset
 
     return convoluted_reshaped
-    
-def relu(convoluted):
-    convoluted[convoluted<0] = 0
-    return convoluted
 
 def max_pooling(convoluted):
     pooled = np.ones((convoluted.shape[0]//2, convoluted.shape[1]//2, convoluted.shape[2]))
@@ -30,10 +100,7 @@ def max_pooling(convoluted):
             pooled[n, p] = np.amax(convoluted[n*2:n*2+2, p*2:p*2+2], axis=(0, 1))
     return pooled
 
-def logistic(x):
-    return 1/(1+np.exp(-x))
-
-def predict(image, weights=weights):
+def predict_loop(image, weights=weights):
     convoluted1 = relu(conv_layer(image, weights[0], weights[1]))
     pooled1 = max_pooling(convoluted1)
     convoluted2 = relu(conv_layer(pooled1, weights[2], weights[3]))
@@ -48,3 +115,26 @@ def predict(image, weights=weights):
     dense2 = relu(np.tensordot(dense1, weights[12], axes=(1, 0)) + weights[13])
     dense3 = np.tensordot(dense2, weights[14], axes=(1, 0)) + weights[15]
     return logistic(dense3)[0][0]
+
+
+def benchmark(n: int=32, batch_size: int=BATCH_SIZE) -> None:
+    """Compare the latency of `predict_loop`, `predict` and `predict_batch` on random patterns"""
+    import time
+    from scipy import ndimage
+
+    rng = np.random.RandomState(0)
+    images = ndimage.gaussian_filter(rng.random_sample((n, 150, 150, 1)), (0, 2, 2, 0))
+
+    nloop = min(n, 4)
+    t0 = time.perf_counter()
+    reference = np.array([predict_loop(image) for image in images[:nloop]])
+    t1 = time.perf_counter()
+    single = np.array([predict(image) for image in images])
+    t2 = time.perf_counter()
+    batch = predict_batch(images, batch_size=batch_size)
+    t3 = time.perf_counter()
+
+    print(f"{n} patterns (150x150), batch_size={batch_size}")
+    print(f"predict_loop:  {(t1 - t0) * 1000 / nloop:8.1f} ms/image")
+    print(f"predict:       {(t2 - t1) * 1000 / n:8.1f} ms/image (max diff: {np.abs(single[:nloop] - reference).max():.2g})")
+    print(f"predict_batch: {(t3 - t2) * 1000 / n:8.1f} ms/image, {(t3 - t2) * 1000 * batch_size / n:.1f} ms/batch (max diff: {np.abs(batch[:nloop] - reference).max():.2g})")
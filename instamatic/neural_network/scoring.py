@@ -0,0 +1,127 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from .neural_network import predict
+from .preprocess import preprocess
+
+
+def score_pattern(img):
+    """Preprocess a diffraction pattern and predict its quality, runs in the worker processes"""
+    return predict(preprocess(np.asarray(img, dtype=float)))
+
+
+class AbortPolicy(object):
+    """Decides when to stop the data collection from the quality scores so far.
+
+    Aborts when the last `n` scores (in order of the keys) are all below `threshold`.
+    Any callable taking the dict of scores {key: score} and returning a bool can be used instead."""
+    def __init__(self, threshold: float=0.5, n: int=3):
+        super(AbortPolicy, self).__init__()
+        self.threshold = threshold
+        self.n = n
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(threshold={self.threshold}, n={self.n})"
+
+    def __call__(self, scores: dict) -> bool:
+        last = [scores[key] for key in sorted(scores)[-self.n:]]
+        return len(last) == self.n and all(score < self.threshold for score in last)
+
+
+class QualityScorer(object):
+    """Scores diffraction patterns with the neural network in a pool of worker processes,
+    so that the acquisition loop does not wait for the preprocessing and inference.
+
+    Images are fed with `submit`, which never blocks: at most `maxsize` images are queued or
+    being scored, further images are dropped (and counted in `self.dropped`). The scores are
+    collected in `self.scores` as they come in, and passed to `callback(key, score)`.
+    After every score, `policy(scores)` is called, the first time it returns True,
+    `on_abort(key, score)` is called.
+
+    Call `reset` before every new data collection, results of images submitted before
+    are discarded. `close` shuts down the workers."""
+    def __init__(self, workers: int=1, maxsize: int=2, policy=None, callback=None, on_abort=None, processes: bool=True):
+        super(QualityScorer, self).__init__()
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.pool = executor(max_workers=workers)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.callback = callback
+        self.on_abort = on_abort
+
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self.generation = 0
+        self.reset()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(maxsize={self.maxsize}, policy={self.policy}, scored={len(self.scores)}, dropped={self.dropped})"
+
+    def reset(self) -> None:
+        """Start a new set of scores"""
+        with self._lock:
+            self.generation += 1
+            self.scores = {}
+            self.dropped = 0
+            self.errors = 0
+            self.aborted = False
+
+    def submit(self, key, img: np.ndarray) -> bool:
+        """Queue `img` for scoring under `key` (i.e. the frame number) without blocking.
+        Returns False if the queue is full and the image was dropped."""
+        if not self._slots.acquire(blocking=False):
+            self.dropped += 1
+            return False
+
+        generation = self.generation
+        try:
+            future = self.pool.submit(score_pattern, img)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(lambda future: self._done(key, generation, future))
+        return True
+
+    def _done(self, key, generation: int, future) -> None:
+        self._slots.release()
+        with self._lock:
+            self._pending.discard(future)
+            if future.cancelled() or generation != self.generation:
+                return
+            if future.exception() is not None:
+                self.errors += 1
+                return
+            score = future.result()
+            self.scores[key] = score
+            scores = dict(self.scores)
+            abort = not self.aborted and self.policy is not None and self.policy(scores)
+            if abort:
+                self.aborted = True
+
+        if self.callback:
+            self.callback(key, score)
+        if abort and self.on_abort:
+            self.on_abort(key, score)
+
+    def wait(self, timeout: float=None) -> None:
+        """Wait for the images in the queue to be scored"""
+        from concurrent.futures import wait
+
+        with self._lock:
+            pending = list(self._pending)
+        wait(pending, timeout=timeout)
+
+    def summary(self) -> str:
+        scores = np.array([self.scores[key] for key in sorted(self.scores)])
+        if len(scores) == 0:
+            return f"No quality scores ({self.dropped} images dropped)"
+        return f"Quality scores: n={len(scores)}, mean={scores.mean():.3f}, min={scores.min():.3f}, last={scores[-1]:.3f} ({self.dropped} images dropped)"
+
+    def close(self, wait: bool=True) -> None:
+        self.pool.shutdown(wait=wait)
@@ -1,13 +1,15 @@
 import numpy as np
 from datetime import datetime
 import time
-from instamatic.formats import read_tiff, write_tiff, write_mrc, write_adsc
-from instamatic.processing.flatfield import apply_flatfield_correction
+from instamatic.formats import read_tiff, write_tiff, write_mrc, write_adsc, write_cbf, NexusWriter
+from instamatic.formats.xdscbf import TIMESTAMP as CBF_TIMESTAMP
+from instamatic.processing.flatfield import FlatfieldCorrector
 from instamatic.processing.stretch_correction import affine_transform_ellipse_to_circle
 from instamatic import config
-from instamatic.tools import find_beam_center, find_subranges
+from instamatic.tools import find_beam_center, find_beam_centers, find_subranges
 from instamatic.tools import find_beam_center_with_beamstop, to_xds_untrusted_area
 from pathlib import Path
+import os
 from math import cos, pi
 import collections
 import logging
@@ -103,6 +105,8 @@ class ImgConversion(object):
     The buffer index must start at 1.
     """
 
+    cbf_drc = None  # directory with the CBF frames, set when they are written
+
     def __init__(self, 
                  buffer: list,                   # image buffer, list of (index [int], image data [2D numpy array], header [dict])
                  camera_length: float,           # virtual camera length read from the microscope
@@ -114,7 +118,7 @@ class ImgConversion(object):
                  flatfield: str='flatfield.tiff'  
                  ):
         if flatfield is not None:
-            flatfield, h = read_tiff(flatfield)
+            flatfield = FlatfieldCorrector.from_files(flatfield)
         self.flatfield = flatfield
 
         self.headers = {}
@@ -128,7 +132,7 @@ class ImgConversion(object):
             self.headers[i] = h
 
             if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
+                self.data[i] = self.flatfield.apply(img)
             else:
                 self.data[i] = img
 
@@ -227,17 +231,17 @@ class ImgConversion(object):
         """
         shape_x, shape_y = self.data_shape
         centers = []
-        for i, h in self.headers.items():
-            if self.use_beamstop:
-                cx, cy = find_beam_center_with_beamstop(self.data[i], z=99)
-            else:
-                cx, cy = find_beam_center(self.data[i], sigma=10)
 
+        frames = list(self.headers.keys())
+        found = find_beam_centers([self.data[i] for i in frames], sigma=10, use_beamstop=self.use_beamstop, z=99)
+
+        for i, (cx, cy) in zip(frames, found):
             if invert_x:
                 cx = shape_x - cx
             if invert_y:
                 cy = shape_y - cy
 
+            h = self.headers[i]
             h["beam_center"] = (cx, cy)
             centers.append((cx, cy))
 
@@ -323,14 +327,32 @@ class ImgConversion(object):
 
         logger.debug(f"MRC files created in folder: {path}")
 
-    def threadpoolwriter(self, tiff_path: str=None, smv_path: str=None, mrc_path: str=None, workers: int=8) -> None:
+    def threadpoolwriter(self, tiff_path: str=None, smv_path: str=None, mrc_path: str=None, cbf_path: str=None, hdf5_path: str=None, workers: int=8) -> None:
         """Efficiently write all data to the specified formats using a threadpool. 
         If a path is given, write data in the corresponding format, i.e. if `tiff_path` is specified TIFF 
         files are written to that path.
+
+        CBF files (int32, byte_offset compressed) are written to `cbf_path` / `smv_subdrc`, and
+        are used as the data frames in XDS.INP instead of the SMV files.
+
+        `hdf5_path` is the name of a single HDF5 file that will contain all frames and headers (see `NexusWriter`).
         """
         write_tiff = tiff_path is not None
         write_smv  = smv_path  is not None
         write_mrc  = mrc_path  is not None
+        write_cbf  = cbf_path  is not None
+        write_hdf5 = hdf5_path is not None
+
+        if write_hdf5:
+            hdf5_path.parent.mkdir(exist_ok=True, parents=True)
+            hdf5_writer = NexusWriter(hdf5_path)
+            logger.debug(f"HDF5 file saved as: {hdf5_path}")
+
+        if write_cbf:
+            cbf_path = cbf_path / self.smv_subdrc
+            cbf_path.mkdir(exist_ok=True, parents=True)
+            self.cbf_drc = cbf_path
+            logger.debug(f"CBF files saved in folder: {cbf_path}")
 
         if write_smv:
             smv_path = smv_path / self.smv_subdrc
@@ -356,10 +378,17 @@ class ImgConversion(object):
                     futures.append(executor.submit(self.write_mrc, mrc_path, i))
                 if write_smv:
                     futures.append(executor.submit(self.write_smv, smv_path, i))
+                if write_cbf:
+                    futures.append(executor.submit(self.write_cbf, cbf_path, i))
+                if write_hdf5:
+                    futures.append(executor.submit(self.write_hdf5, hdf5_writer, i))
 
             for future in futures:
                 ret = future.result()
 
+        if write_hdf5:
+            self.close_hdf5(hdf5_writer)
+
     def to_dials(self, smv_path: str) -> None:
         """Convert the buffer to output compatible with DIALS.
         Files are written to the path given by `smv_path`.
@@ -375,7 +404,7 @@ class ImgConversion(object):
         path = smv_path / self.smv_subdrc
 
         i = min(observed_range)
-        empty = np.zeros_like(self.data[i])
+        empty = np.zeros(self.data_shape, dtype=np.uint16)
         # copy header from first frame
         h = self.headers[i].copy()
         h["ImageGetTime"] = time.time()
@@ -410,10 +439,18 @@ class ImgConversion(object):
         """Write the image+header with sequence number `i` to the directory `path` in SMV format.
         Returns the path to the written image."""
         img = self.data[i]
-        h = self.headers[i]
 
         img = np.ushort(img)
-        shape_x, shape_y = img.shape
+        header = self.get_smv_header(i, img.shape)
+
+        fn = path / f"{i:05d}.img"
+        write_adsc(fn, img, header=header)
+        return fn
+
+    def get_smv_header(self, i: int, shape: tuple) -> dict:
+        """Return the SMV header for the frame with sequence number `i` and image shape `shape`"""
+        h = self.headers[i]
+        shape_x, shape_y = shape
         
         phi = self.start_angle + self.osc_angle * (i-1)
 
@@ -453,10 +490,79 @@ class ImgConversion(object):
         header['BEAM_CENTER_Y'] = f"{mean_beam_center[0]:.4f}"
         header['DENZO_X_BEAM'] = f"{mean_beam_center[0]*self.physical_pixelsize:.4f}"
         header['DENZO_Y_BEAM'] = f"{mean_beam_center[1]*self.physical_pixelsize:.4f}"
-        fn = path / f"{i:05d}.img"
-        write_adsc(fn, img, header=header)
+        return header
+
+    def write_cbf(self, path: str, i: int) -> str:
+        """Write the image+header with sequence number `i` to the directory `path` in CBF format.
+        The data are stored as int32, so that high counts are not clipped.
+        Returns the path to the written image."""
+        img = self.data[i]
+
+        img = np.round(img, 0).astype(np.int32)
+        header = self.get_cbf_header(i)
+
+        fn = path / f"{i:05d}.cbf"
+        write_cbf(fn, img, header=header)
         return fn
 
+    def get_cbf_header(self, i: int) -> dict:
+        """Return the miniCBF header for the frame with sequence number `i`"""
+        h = self.headers[i]
+
+        phi = self.start_angle + self.osc_angle * (i-1)
+
+        mean_beam_center = self.mean_beam_center
+        pixelsize = self.physical_pixelsize / 1000  # m
+
+        try:
+            date = datetime.fromtimestamp(h["ImageGetTime"]).isoformat(timespec="milliseconds")
+        except:
+            date = "0"
+
+        header = collections.OrderedDict()
+        header['Detector:'] = self.name
+        header[CBF_TIMESTAMP] = date
+        header['Pixel_size'] = f"{pixelsize:.4e} m x {pixelsize:.4e} m"
+        header['Exposure_time'] = f"{h['ImageExposureTime']} s"
+        header['Wavelength'] = f"{self.wavelength:.4f} A"
+        header['Detector_distance'] = f"{self.distance / 1000:.5f} m"
+        # reverse XY coordinates for XDS
+        header['Beam_xy'] = f"({mean_beam_center[1]:.2f}, {mean_beam_center[0]:.2f}) pixels"
+        header['Start_angle'] = f"{phi:.4f} deg."
+        header['Angle_increment'] = f"{self.osc_angle:.4f} deg."
+        header['Phi'] = f"{phi:.4f} deg."
+        return header
+
+    def write_hdf5(self, writer: NexusWriter, i: int) -> None:
+        """Write the image+header with sequence number `i` to the HDF5 file opened by `writer`"""
+        img = np.round(self.data[i], 0)
+        writer.write(i, img, header=self.headers[i])
+
+    def close_hdf5(self, writer: NexusWriter) -> None:
+        """Store the rotation parameters and geometry in the HDF5 file opened by `writer`, and close it"""
+        nframes = max(self.complete_range)
+        omega = self.start_angle + self.osc_angle * np.arange(nframes)
+
+        attrs = {
+            "start_angle": self.start_angle,
+            "end_angle": self.end_angle,
+            "osc_angle": self.osc_angle,
+            "rotation_axis": self.rotation_axis,
+            "acquisition_time": self.acquisition_time,
+            "pixelsize": self.pixelsize,
+            "name": self.name,
+        }
+
+        geometry = {
+            "distance": self.distance,
+            "pixel_size": self.physical_pixelsize,
+            # reverse XY coordinates, x is the fast axis
+            "beam_center": (self.mean_beam_center[1], self.mean_beam_center[0]),
+            "wavelength": self.wavelength,
+        }
+
+        writer.close(attrs=attrs, omega=omega, geometry=geometry)
+
     def write_mrc(self, path: str, i: int) -> str:
         """Write the image+header with sequence number `i` to the directory `path` in TIFF format.
         Returns the path to the written image."""
@@ -520,10 +626,18 @@ class ImgConversion(object):
         logger.debug(f"ED3D file created in path: {path}")
         
     def write_xds_inp(self, path: str) -> None:
-        """Write XDS.INP input file for XDS in directory `path`"""
+        """Write XDS.INP input file for XDS in directory `path`
+        Refers to the CBF frames if they have been written, otherwise to the SMV frames."""
 
         path.mkdir(exist_ok=True)
 
+        if self.cbf_drc is not None:
+            data_drc = Path(os.path.relpath(self.cbf_drc, path)).as_posix()
+            data_ext, data_format = "cbf", "CBF"
+        else:
+            data_drc = self.smv_subdrc
+            data_ext, data_format = "img", "SMV"
+
         nframes = max(self.complete_range)
 
         invert_rotation_axis = self.start_angle > self.end_angle
@@ -549,7 +663,9 @@ class ImgConversion(object):
 
         s = self.XDS_template.format(
             date=str(time.ctime()),
-            data_drc=self.smv_subdrc,
+            data_drc=data_drc,
+            data_ext=data_ext,
+            data_format=data_format,
             data_begin=1,
             data_end=nframes,
             exclude=exclude,
@@ -23,7 +23,7 @@ class ImgConversionDM(ImgConversion):
                  wavelength: float=None,         # Angstrom, relativistic wavelength of the electron beam
                  ):
         if flatfield is not None:
-            flatfield, h = read_tiff(flatfield)
+            flatfield = FlatfieldCorrector.from_files(flatfield)
         self.flatfield = flatfield
 
         self.headers = {}
@@ -37,7 +37,7 @@ class ImgConversionDM(ImgConversion):
             self.headers[i] = h
 
             if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
+                self.data[i] = self.flatfield.apply(img)
             else:
                 self.data[i] = img
 
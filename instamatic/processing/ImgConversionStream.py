@@ -0,0 +1,240 @@
+from .ImgConversion import *
+from instamatic.formats import update_adsc_header, update_cbf_header
+import threading
+import queue
+
+
+class ImgConversionStream(ImgConversion):
+    """This class is for cRED image conversion *during* data collection.
+    Files can be generated for REDp, DIALS, XDS, and PETS.
+
+    Instead of passing a complete image buffer, frames are fed one at a time using `put`.
+    A pool of worker threads applies the flatfield correction, finds the beam center and writes
+    the TIFF/MRC/SMV/CBF/HDF5 files while the rotation is still running, so that the image data do not have
+    to be kept in memory. At most `queue_depth` frames are waiting to be processed, `put` blocks
+    if the queue is full.
+
+    Once the last frame has been added, call `finalize` with the parameters of the rotation.
+    This waits for the queue to drain, and updates the SMV/CBF headers in place with the final
+    oscillation angle and mean beam center. Afterwards, the input files for XDS/DIALS/REDp/PETS can
+    be written using the regular `ImgConversion` methods.
+
+    The frame index must start at 1.
+    """
+
+    def __init__(self,
+                 start_angle: float,             # degrees, start angle of the rotation
+                 tiff_path: str=None,            # path to write tiff files to
+                 smv_path: str=None,             # path to write SMV files to (in `smv_subdrc`)
+                 mrc_path: str=None,             # path to write MRC files to
+                 cbf_path: str=None,             # path to write CBF files to (in `smv_subdrc`)
+                 hdf5_path: str=None,            # filename of the HDF5 file to write all frames to
+                 flatfield: str='flatfield.tiff',
+                 physical_pixelsize: float=None, # mm, physical size of the pixels
+                 wavelength: float=None,         # Angstrom, relativistic wavelength of the electron beam
+                 stretch_amplitude=0.0,          # Stretch correction amplitude, %
+                 stretch_azimuth=0.0,            # Stretch correction azimuth, degrees
+                 use_beamstop: bool=False,       # use the beamstop algorithm to find the beam center
+                 untrusted_areas: list=(),       # list of (kind, coords) of untrusted areas for XDS
+                 name: str="Instamatic",         # special ID for DIALS
+                 XDS_template: str=None,         # template for XDS.INP, defaults to `XDS_template`
+                 queue_depth: int=64,            # maximum number of frames waiting for processing
+                 workers: int=4,                 # number of threads processing the frames
+                 ):
+        if flatfield is not None:
+            flatfield = FlatfieldCorrector.from_files(flatfield)
+        self.flatfield = flatfield
+
+        self.headers = {}
+        self.data = {}
+
+        self.smv_subdrc = "data"
+
+        self.untrusted_areas = list(untrusted_areas)
+
+        self.tiff_path = tiff_path
+        self.mrc_path = mrc_path
+        self.smv_path = smv_path
+
+        if smv_path is not None:
+            self.smv_path = smv_path / self.smv_subdrc
+
+        if cbf_path is not None:
+            self.cbf_drc = cbf_path / self.smv_subdrc
+
+        for path in (self.tiff_path, self.mrc_path, self.smv_path, self.cbf_drc):
+            if path is not None:
+                path.mkdir(exist_ok=True, parents=True)
+
+        if hdf5_path is not None:
+            hdf5_path.parent.mkdir(exist_ok=True, parents=True)
+            self.hdf5_writer = NexusWriter(hdf5_path)
+        else:
+            self.hdf5_writer = None
+
+        self.physical_pixelsize = physical_pixelsize
+        self.wavelength = wavelength
+
+        self.stretch_azimuth = stretch_azimuth
+        self.stretch_amplitude = stretch_amplitude
+        self.do_stretch_correction = self.stretch_amplitude != 0
+
+        self.use_beamstop = use_beamstop
+        self.name = name
+
+        if XDS_template is None:
+            from .XDS_template import XDS_template
+        self.XDS_template = XDS_template
+
+        # Provisional values used for the SMV headers during data collection, updated by `finalize`
+        self.start_angle = start_angle
+        self.osc_angle = 0.0
+        self.distance = 0.0
+        self.mean_beam_center = (0.0, 0.0)
+
+        self.beam_centers = {}
+        self.data_shape = None
+        self.exception = None
+
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.threads = [threading.Thread(target=self._worker, name=f"ImgConversionStream-{n}", daemon=True) for n in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+        logger.debug(f"Started image conversion stream with {workers} workers (queue depth: {queue_depth})")
+
+    @property
+    def nframes(self) -> int:
+        """Number of frames that have been processed"""
+        return len(self.beam_centers)
+
+    def put(self, i: int, img: np.ndarray, h: dict) -> None:
+        """Add the image+header with sequence number `i` to the processing queue.
+        Blocks if the queue is full."""
+        if self.exception:
+            exception, self.exception = self.exception, None
+            raise exception
+        self.queue.put((i, img, h))
+
+    def _worker(self) -> None:
+        """Process frames from the queue until the sentinel (None) is received"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            try:
+                self.process(*item)
+            except Exception as e:
+                logger.exception(e)
+                self.exception = e
+
+    def process(self, i: int, img: np.ndarray, h: dict) -> None:
+        """Correct the image with sequence number `i`, find the beam center and
+        write it to all formats requested."""
+        if self.flatfield is not None:
+            img = self.flatfield.apply(img)
+
+        if self.use_beamstop:
+            cx, cy = find_beam_center_with_beamstop(img, z=99)
+        else:
+            # same method as `ImgConversion.get_beam_centers`, so that offline processing agrees
+            cx, cy = find_beam_centers([img], sigma=10)[0]
+
+        h["beam_center"] = (cx, cy)
+
+        self.data_shape = img.shape
+        self.headers[i] = h
+
+        # add data to self.data so that existing functions can be used
+        # make sure to remove them afterwards, not to keep the frames in memory
+        self.data[i] = img
+
+        if self.tiff_path is not None:
+            self.write_tiff(self.tiff_path, i)
+        if self.mrc_path is not None:
+            self.write_mrc(self.mrc_path, i)
+        if self.smv_path is not None:
+            self.write_smv(self.smv_path, i)
+        if self.cbf_drc is not None:
+            self.write_cbf(self.cbf_drc, i)
+        if self.hdf5_writer is not None:
+            self.write_hdf5(self.hdf5_writer, i)
+
+        del self.data[i]
+
+        self.beam_centers[i] = (cx, cy)
+
+    def close(self) -> None:
+        """Wait for all queued frames to be processed and stop the worker threads.
+        Can be called more than once, an exception in the workers is raised only once."""
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+        if self.exception:
+            exception, self.exception = self.exception, None
+            raise exception
+
+    def finalize(self,
+                 end_angle: float,               # degrees, end angle of the rotation
+                 osc_angle: float,               # degrees, oscillation angle of the rotation
+                 rotation_axis: float,           # radians, specifies the position of the rotation axis
+                 acquisition_time: float,        # seconds, acquisition time (exposure time + overhead)
+                 pixelsize: float=None,          # p/Angstrom, size of the pixels
+                 ) -> None:
+        """Finish processing all the frames in the queue, and set the final parameters of the rotation.
+        Updates the headers of the SMV/CBF files that have been written during data collection."""
+        self.close()
+
+        self.observed_range = set(self.headers.keys())
+        self.complete_range = set(range(min(self.observed_range), max(self.observed_range) + 1))
+        self.missing_range = self.observed_range ^ self.complete_range
+
+        self.pixelsize = pixelsize
+
+        self.distance = (1/self.wavelength) * (self.physical_pixelsize / self.pixelsize)
+        self.osc_angle = osc_angle
+        self.end_angle = end_angle
+        self.rotation_axis = rotation_axis
+
+        self.acquisition_time = acquisition_time
+
+        self.mean_beam_center, self.beam_center_std = self.get_beam_centers()
+        logger.debug(f"Primary beam at: {self.mean_beam_center}")
+
+        self.check_settings()
+
+        if self.smv_path is not None:
+            for i in self.observed_range:
+                header = self.get_smv_header(i, self.data_shape)
+                update_adsc_header(self.smv_path / f"{i:05d}.img", header)
+
+            logger.debug(f"SMV headers updated in folder: {self.smv_path}")
+
+        if self.cbf_drc is not None:
+            for i in self.observed_range:
+                header = self.get_cbf_header(i)
+                update_cbf_header(self.cbf_drc / f"{i:05d}.cbf", header)
+
+            logger.debug(f"CBF headers updated in folder: {self.cbf_drc}")
+
+        if self.hdf5_writer is not None:
+            self.close_hdf5(self.hdf5_writer)
+
+    def get_beam_centers(self) -> (float, float):
+        """Return the median beam center and its standard deviation from the beam centers
+        found during processing"""
+        self._beam_centers = beam_centers = np.array([self.beam_centers[i] for i in sorted(self.beam_centers)])
+
+        median_center = np.median(beam_centers, axis=0)
+        std_center = np.std(beam_centers, axis=0)
+
+        return median_center, std_center
+
+    def threadpoolwriter(self, *args, **kwargs) -> None:
+        """The data are written while they are streamed in, so this only waits for the queued frames
+        to be written (the paths are those given to `__init__`). Call `finalize` to update the headers."""
+        self.close()
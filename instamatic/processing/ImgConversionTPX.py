@@ -1,6 +1,11 @@
 from .ImgConversion import *
 
 
+# Cross-shaped gap between the 4 chips of the Timepix quad
+TPX_UNTRUSTED_AREAS = ( ("rectangle", ((0,   255), (517, 262)) ),
+                        ("rectangle", ((255, 0  ), (262, 517)) ) )
+
+
 class ImgConversionTPX(ImgConversion):
     """This class is for post RED/cRED data collection image conversion.
     Files can be generated for REDp, DIALS, XDS, and PETS.
@@ -25,7 +30,7 @@ class ImgConversionTPX(ImgConversion):
                  stretch_azimuth=0.0             # Stretch correction azimuth, degrees
                  ):
         if flatfield is not None:
-            flatfield, h = read_tiff(flatfield)
+            flatfield = FlatfieldCorrector.from_files(flatfield)
         self.flatfield = flatfield
 
         self.headers = {}
@@ -33,8 +38,7 @@ class ImgConversionTPX(ImgConversion):
 
         self.smv_subdrc = "data"
 
-        self.untrusted_areas = [ ("rectangle", ((0,   255), (517, 262)) ),
-                                 ("rectangle", ((255, 0  ), (262, 517)) ) ]
+        self.untrusted_areas = list(TPX_UNTRUSTED_AREAS)
 
         while len(buffer) != 0:
             i, img, h = buffer.pop(0)
@@ -42,7 +46,7 @@ class ImgConversionTPX(ImgConversion):
             self.headers[i] = h
 
             if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
+                self.data[i] = self.flatfield.apply(img)
             else:
                 self.data[i] = img
 
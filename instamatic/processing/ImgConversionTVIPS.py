@@ -7,11 +7,12 @@ class ImgConversionTVIPS(ImgConversion):
 
     The image buffer is passed as a list of tuples, where each tuple contains the
     index (int), image data (2D numpy array), metadata/header (dict).
-    The buffer index must start at 1.
+    The buffer index must start at 1. The buffer can also be an iterator, so that the images
+    can be streamed in as they are read.
     """
 
     def __init__(self, 
-                 buffer: list,                   # image buffer, list of (index [int], image data [2D numpy array], header [dict])
+                 buffer: list,                   # image buffer, list or iterator of (index [int], image data [2D numpy array], header [dict])
                  osc_angle: float,               # degrees, oscillation angle of the rotation
                  start_angle: float,             # degrees, start angle of the rotation
                  end_angle: float,               # degrees, end angle of the rotation
@@ -23,7 +24,7 @@ class ImgConversionTVIPS(ImgConversion):
                  wavelength: float=None,         # Angstrom, relativistic wavelength of the electron beam
                  ):
         if flatfield is not None:
-            flatfield, h = read_tiff(flatfield)
+            flatfield = FlatfieldCorrector.from_files(flatfield)
         self.flatfield = flatfield
 
         self.headers = {}
@@ -31,13 +32,14 @@ class ImgConversionTVIPS(ImgConversion):
 
         self.smv_subdrc = "data"
 
-        while len(buffer) != 0:
-            i, img, h = buffer.pop(0)
+        if isinstance(buffer, list):
+            buffer = (buffer.pop(0) for _ in range(len(buffer)))
 
+        for i, img, h in buffer:
             self.headers[i] = h
 
             if self.flatfield is not None:
-                self.data[i] = apply_flatfield_correction(img, self.flatfield)
+                self.data[i] = self.flatfield.apply(img)
             else:
                 self.data[i] = img
 
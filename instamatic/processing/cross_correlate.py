@@ -256,3 +256,175 @@ def register_translation(src_image, target_image, upsample_factor=1,
 
     return shifts, _compute_error(CCmax, src_amp, target_amp),\
         _compute_phasediff(CCmax)
+
+
+class Registrator(object):
+    """Register many images against the same reference.
+
+    Gives the same results as `register_translation(reference, target, upsample_factor)`,
+    but the spectrum of the reference, its power, and the parts of the upsampling DFT kernels
+    that depend only on the image shape are computed once. `register_batch` registers a stack
+    of images against the reference in a single vectorized call.
+
+    reference: 2D ndarray
+        Reference image
+    upsample_factor: int
+        Images are registered to within 1 / `upsample_factor` of a pixel
+    apodize: bool
+        Multiply the reference and targets by a Hann window before the FFT to suppress
+        edge effects. This changes the results w.r.t. `register_translation`, so it is off by default.
+    """
+    def __init__(self, reference: np.ndarray, upsample_factor: int=1, apodize: bool=False):
+        super().__init__()
+        self.upsample_factor = upsample_factor
+        self.apodize = apodize
+        self.shape = None
+        self.set_reference(reference)
+
+    def _setup(self, shape: tuple) -> None:
+        """Precompute everything that depends only on the image shape"""
+        if len(shape) != 2:
+            raise NotImplementedError("Error: Registrator only supports 2D images")
+
+        self.shape = shape
+        self.size = shape[0] * shape[1]
+        self.midpoints = np.array([np.fix(axis_size / 2) for axis_size in shape])
+
+        if self.apodize:
+            self.window = np.outer(np.hanning(shape[0]), np.hanning(shape[1]))
+        else:
+            self.window = None
+
+        uf = self.upsample_factor
+        self.normalization = self.size * float(uf) ** 2
+        if uf == 1:
+            return
+
+        # The kernels of `_upsampled_dft` are exp(c * freq * (m - offset)), which is split
+        # into a constant part exp(c * freq * m) and a phase exp(-c * freq * offset) that
+        # depends on the shift estimate
+        self.region_size = int(np.ceil(uf * 1.5))
+        self.dftshift = np.fix(self.region_size / 2.0)
+        region = np.arange(self.region_size)
+
+        self.row_freq = np.fft.ifftshift(np.arange(shape[0])) - np.floor(shape[0] / 2)
+        self.col_freq = np.fft.ifftshift(np.arange(shape[1])) - np.floor(shape[1] / 2)
+        self.row_c = -1j * 2 * np.pi / (shape[0] * uf)
+        self.col_c = -1j * 2 * np.pi / (shape[1] * uf)
+
+        self.row_kernel = np.exp(self.row_c * region[:, None] * self.row_freq[None, :])  # R x H
+        self.col_kernel = np.exp(self.col_c * self.col_freq[:, None] * region[None, :])  # W x R
+
+    def _fft(self, images: np.ndarray) -> np.ndarray:
+        """FFT of the last 2 axes of `images`"""
+        images = np.asarray(images, dtype=float)
+        if self.window is not None:
+            images = images * self.window
+        return np.fft.fft2(images)
+
+    def set_reference(self, reference: np.ndarray) -> None:
+        """Replace the reference image. The cached kernels are kept if the shape does not change."""
+        reference = np.asarray(reference)
+        if reference.shape != self.shape:
+            self._setup(reference.shape)
+
+        self.ref_freq = self._fft(reference)
+        self.ref_amp = np.sum(np.abs(self.ref_freq) ** 2) / self.normalization
+
+    def register(self, target: np.ndarray) -> (np.ndarray, float, float):
+        """Register a single image against the reference
+
+        Returns: shift, error, phasediff (see `register_translation`)
+        """
+        shifts, errors, phasediffs = self.register_batch(target[None])
+        return shifts[0], errors[0], phasediffs[0]
+
+    def __call__(self, target: np.ndarray) -> np.ndarray:
+        """Return the shift required to register `target` with the reference"""
+        return self.register(target)[0]
+
+    def register_batch(self, targets: np.ndarray, batch_size: int=32) -> (np.ndarray, np.ndarray, np.ndarray):
+        """Register a stack of images (N x H x W) against the reference
+
+        batch_size: number of images transformed at the same time, limits the memory use
+
+        Returns: shifts (N x 2), errors (N), phasediffs (N)
+        """
+        targets = np.asarray(targets)
+        if targets.shape[1:] != self.shape:
+            raise ValueError("Error: images must be same size as the reference")
+
+        shifts = np.empty((len(targets), 2))
+        CCmax = np.empty(len(targets), dtype=complex)
+        target_amp = np.empty(len(targets))
+
+        for i in range(0, len(targets), batch_size):
+            batch = slice(i, i + batch_size)
+            target_freq = self._fft(targets[batch])
+            target_amp[batch] = np.sum(np.abs(target_freq) ** 2, axis=(1, 2)) / self.normalization
+            shifts[batch], CCmax[batch] = self._register_freq(target_freq)
+
+        # If its only one row or column the shift along that dimension has no effect
+        for dim in range(2):
+            if self.shape[dim] == 1:
+                shifts[:, dim] = 0
+
+        return shifts, _compute_error(CCmax, self.ref_amp, target_amp), _compute_phasediff(CCmax)
+
+    def _register_freq(self, target_freq: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Find the shifts and the values of the cross correlation maxima for a stack of spectra"""
+        n = len(target_freq)
+        image_product = self.ref_freq * target_freq.conj()
+        cross_correlation = np.fft.ifft2(image_product)
+
+        # Whole-pixel shift
+        flat = np.abs(cross_correlation).reshape(n, -1)
+        maxima = np.unravel_index(np.argmax(flat, axis=1), self.shape)
+        shifts = np.stack(maxima, axis=1).astype(np.float64)
+        wrap = shifts > self.midpoints
+        shifts[wrap] -= np.broadcast_to(self.shape, shifts.shape)[wrap]
+
+        if self.upsample_factor == 1:
+            CCmax = cross_correlation.reshape(n, -1).max(axis=1)
+            return shifts, CCmax
+
+        # Refine with a matrix multiply DFT around the current shift estimate
+        uf = self.upsample_factor
+        offset = self.dftshift - shifts * uf
+        row_kernel = self.row_kernel[None] * np.exp(-self.row_c * offset[:, 0, None, None] * self.row_freq[None, None, :])
+        col_kernel = self.col_kernel[None] * np.exp(-self.col_c * self.col_freq[None, :, None] * offset[:, 1, None, None])
+        cross_correlation = (row_kernel @ image_product.conj() @ col_kernel).conj()
+        cross_correlation /= self.normalization
+
+        flat = cross_correlation.reshape(n, -1)
+        maxima = np.unravel_index(np.argmax(np.abs(flat), axis=1), cross_correlation.shape[1:])
+        maxima = np.stack(maxima, axis=1) - self.dftshift
+        shifts = shifts + maxima / uf
+        CCmax = flat.max(axis=1)
+
+        return shifts, CCmax
+
+
+def benchmark(n: int=25, shape: tuple=(512, 512), upsample_factor: int=10) -> None:
+    """Compare `register_translation` in a loop with `Registrator` on a stack of shifted images"""
+    import time
+    from scipy import ndimage
+
+    rng = np.random.RandomState(0)
+    reference = ndimage.gaussian_filter(rng.random_sample(shape), 4)
+    true_shifts = rng.uniform(-20, 20, size=(n, 2))
+    targets = np.array([ndimage.shift(reference, shift, mode="wrap") for shift in true_shifts])
+
+    t0 = time.perf_counter()
+    loop = np.array([register_translation(reference, target, upsample_factor)[0] for target in targets])
+    t1 = time.perf_counter()
+    reg = Registrator(reference, upsample_factor=upsample_factor)
+    single = np.array([reg(target) for target in targets])
+    t2 = time.perf_counter()
+    batch = reg.register_batch(targets)[0]
+    t3 = time.perf_counter()
+
+    print(f"{n} images {shape}, upsample_factor={upsample_factor}")
+    print(f"register_translation:     {(t1 - t0) * 1000 / n:.1f} ms/image")
+    print(f"Registrator.register:     {(t2 - t1) * 1000 / n:.1f} ms/image (max diff: {np.abs(single - loop).max():.3g})")
+    print(f"Registrator.register_batch: {(t3 - t2) * 1000 / n:.1f} ms/image (max diff: {np.abs(batch - loop).max():.3g})")
@@ -18,6 +18,10 @@ from collections import namedtuple
 
 CrystalPosition = namedtuple('CrystalPosition', ['x', 'y', 'isolated', 'n_clusters', 'area_micrometer', 'area_pixel', ])
 
+# segmentation engines for `segment_crystals`
+ENGINES = ("watershed", "random_walker")
+DEFAULT_ENGINE = "watershed"
+
 
 def isedge(prop):
     """Simple edge detection routine. Checks if the bbox of the prop matches the shape of the array.
@@ -35,6 +39,36 @@ def isedge(prop):
     return False
 
 
+def isedge_slice(sl, mask, img):
+    """Same as `isedge`, for the region `mask` in the bounding box `sl` of `img`"""
+    if  (sl[0].start == 0) or \
+        (sl[1].start == 0) or \
+        (sl[0].stop == img.shape[0]) or \
+        (sl[1].stop == img.shape[1]):
+
+        hist, edges = np.histogram(img[sl][mask])
+        if np.sum(hist) // hist[0] < 2:
+            return True
+    return False
+
+
+def distance_to(arr):
+    """Distance of every pixel to the nearest True pixel in `arr`, inf if there are none"""
+    if not arr.any():
+        return np.full(arr.shape, np.inf)
+    return ndimage.distance_transform_edt(~arr)
+
+
+def dilate(arr, r):
+    """Binary dilation with `morphology.disk(r)`, using the distance transform of the background"""
+    return distance_to(arr) <= r
+
+
+def erode(arr, r):
+    """Binary erosion with `morphology.disk(r)`, using the distance transform of the features"""
+    return distance_to(~arr) > r
+
+
 def whiten(obs, check_finite=False):
     """
     Adapted from c:/python27/lib/site-packages/skimage/filters/thresholding.py
@@ -49,7 +83,7 @@ def whiten(obs, check_finite=False):
     return obs / std_dev, std_dev
 
 
-def segment_crystals(img, r=101, offset=5, footprint=5, remove_carbon_lacing=True):
+def segment_crystals(img, r=101, offset=5, footprint=5, remove_carbon_lacing=True, engine=DEFAULT_ENGINE):
     """
     r: `int`
        blocksize to calculate local threshold value
@@ -58,7 +92,14 @@ def segment_crystals(img, r=101, offset=5, footprint=5, remove_carbon_lacing=Tru
     offset: `int`
     Constant subtracted from weighted mean of neighborhood to calculate
         the local threshold value
+    engine: `str`
+        'watershed': the pixels between the features and the background are assigned to the
+            nearest of the two, i.e. watershed on the distance transform of the markers (fast)
+        'random_walker': the pixels are assigned with `segmentation.random_walker` (slow)
     """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine!r}, must be one of {ENGINES}")
+
     # workaround, because segmentation.random_walker no longer accepts floats from 0-255.0
     offset = offset / 255.0
 
@@ -72,27 +113,31 @@ def segment_crystals(img, r=101, offset=5, footprint=5, remove_carbon_lacing=Tru
 
     arr = morphology.remove_small_objects(arr, min_size=4*4, connectivity=0) # remove noise
 
-    # magic
+    # magic, erosion/dilation with a disk are done with distance transforms
     arr = morphology.binary_closing(arr, morphology.disk(footprint)) # dilation + erosion
-    arr = morphology.binary_erosion(arr, morphology.disk(footprint)) # erosion
+    arr = erode(arr, footprint) # erosion
     
     # remove carbon lines
     if remove_carbon_lacing:
         arr = morphology.remove_small_objects(arr, min_size=8*8, connectivity=0)
         arr = morphology.remove_small_holes(arr, min_size=32*32, connectivity=0)
-    arr = morphology.binary_dilation(arr, morphology.disk(footprint)) # dilation
+    arr = dilate(arr, footprint) # dilation
     
     # get background pixels
-    bkg = np.invert(morphology.binary_dilation(arr, morphology.disk(footprint*2)) | arr)
+    dist_features = distance_to(arr)
+    bkg = dist_features > footprint*2
 
-    # 2: features
-    # 1: background
-    # 0: unlabeled
-    markers = arr*2 + bkg
+    if engine == "watershed":
+        dist_bkg = distance_to(bkg)
+        segmented = (dist_features < dist_bkg).astype(int)
+    else:
+        # 2: features
+        # 1: background
+        # 0: unlabeled
+        markers = arr*2 + bkg
     
-    # segment using random_walker
-    segmented = segmentation.random_walker(img, markers, beta=50, spacing=(5,5), mode='bf')
-    segmented = segmented.astype(int) -1
+        segmented = segmentation.random_walker(img, markers, beta=50, spacing=(5,5), mode='bf')
+        segmented = segmented.astype(int) -1
 
     return arr, segmented
 
@@ -114,7 +159,8 @@ def find_crystals_timepix(img, magnification, spread=0.6, plot=False, **kwargs):
                          footprint=footprint, 
                          offset=offset, 
                          r=r,
-                         remove_carbon_lacing=False)
+                         remove_carbon_lacing=False,
+                         engine=kwargs.get("engine", DEFAULT_ENGINE))
 
 
 def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
@@ -140,7 +186,13 @@ def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
     arr, seg = segment_crystals(img, **kwargs)
     
     labels, numlabels = ndimage.label(seg)
-    props = measure.regionprops(labels, img)
+
+    # region properties for all labels at once
+    areas = np.bincount(labels.ravel(), minlength=numlabels + 1)
+    rows, cols = np.indices(labels.shape)
+    centroids = np.stack([
+        np.bincount(labels.ravel(), weights=rows.ravel(), minlength=numlabels + 1),
+        np.bincount(labels.ravel(), weights=cols.ravel(), minlength=numlabels + 1)], axis=1) / np.maximum(areas, 1)[:, None]
     
     # calculate the pixel dimensions in micrometer
     px, py = calibration.pixelsize_mag1[magnification] / 1000  # nm -> um
@@ -148,15 +200,18 @@ def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
     iters = 20
     
     crystals = []
-    for prop in props:
-        area = prop.area*px*py
-        bbox = np.array(prop.bbox)
+    for label, sl in enumerate(ndimage.find_objects(labels), start=1):
+        if sl is None:
+            continue
+        mask = labels[sl] == label
+        area_pixel = areas[label]
+        area = area_pixel*px*py
         
         # origin of the prop
-        origin = bbox[0:2]
+        origin = np.array((sl[0].start, sl[1].start))
         
         # edge detection
-        if isedge(prop):
+        if isedge_slice(sl, mask, img):
             continue
 
         # number of centroids for kmeans clustering
@@ -164,7 +219,7 @@ def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
             
         if nclust > 1:
             # use skmeans clustering to segment large blobs
-            coordinates = np.argwhere(prop.image)
+            coordinates = np.argwhere(mask)
             
             # kmeans needs normalized data (w), store std to calculate coordinates after
             w, std = whiten(coordinates)
@@ -174,10 +229,10 @@ def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
 
             # convert to image coordinates
             xy = (cluster_centroids*std + origin[0:2]) / scale
-            crystals.extend([CrystalPosition(x, y, False, nclust, area, prop.area) for x, y in xy])
+            crystals.extend([CrystalPosition(x, y, False, nclust, area, area_pixel) for x, y in xy])
         else:
-            x, y = prop.centroid
-            crystals.append(CrystalPosition(x/scale, y/scale, True, nclust, area, prop.area))
+            x, y = centroids[label]
+            crystals.append(CrystalPosition(x/scale, y/scale, True, nclust, area, area_pixel))
     
     if plot:
         plt.imshow(img)
@@ -192,11 +247,79 @@ def find_crystals(img, magnification, spread=2.0, plot=False, **kwargs):
     return crystals
 
 
+def match_positions(reference, positions, tol: float=5.0) -> tuple:
+    """Match two lists of crystal positions one-to-one within `tol` pixels.
+    Returns the number of matched positions and the mean distance between them."""
+    from scipy.optimize import linear_sum_assignment
+
+    if len(reference) == 0 or len(positions) == 0:
+        return 0, 0.0
+
+    a = np.array([(c.x, c.y) for c in reference])
+    b = np.array([(c.x, c.y) for c in positions])
+    dist = np.linalg.norm(a[:, None] - b[None, :], axis=2)
+    i, j = linear_sum_assignment(dist)
+    d = dist[i, j]
+    d = d[d <= tol]
+    return len(d), d.mean() if len(d) else 0.0
+
+
+def benchmark(fns: list, tol: float=5.0, timepix: bool=True) -> dict:
+    """Compare the latency and the crystal positions found by the segmentation `ENGINES`
+    on a set of recorded images. The positions are matched against those from 'random_walker'
+    (kmeans is seeded identically for every engine). Because kmeans is random, the reference
+    is also run with another seed to show how well the positions can be expected to match."""
+    from instamatic.formats import read_image
+    import time
+
+    func = find_crystals_timepix if timepix else find_crystals
+    reference = ENGINES[-1]
+
+    runs = ENGINES + ("reseeded",)
+    timings = {run: [] for run in runs}
+    found = {run: 0 for run in runs}
+    matched = {run: 0 for run in runs}
+    offsets = {run: [] for run in runs}
+
+    for fn in fns:
+        img, h = read_image(fn)
+        magnification = h["exp_magnification"]
+
+        results = {}
+        for run in runs:
+            engine = reference if run == "reseeded" else run
+            np.random.seed(1 if run == "reseeded" else 0)
+            t0 = time.perf_counter()
+            results[run] = func(img, magnification, engine=engine)
+            timings[run].append(time.perf_counter() - t0)
+            found[run] += len(results[run])
+
+        for run in runs:
+            n, offset = match_positions(results[reference], results[run], tol=tol)
+            matched[run] += n
+            if n:
+                offsets[run].append(offset)
+
+    print(f"{len(fns)} images, reference: {reference}, tolerance: {tol} px")
+    for run in runs:
+        t = np.array(timings[run]) * 1000
+        recall = matched[run] / max(found[reference], 1)
+        precision = matched[run] / max(found[run], 1)
+        offset = np.mean(offsets[run]) if offsets[run] else 0.0
+        print(f"{run:>14s}: {t.mean():6.1f} ms/image (max {t.max():.1f}) | found {found[run]:4d} | matched {matched[run]:4d} (recall {recall:.1%}, precision {precision:.1%}, mean offset {offset:.2f} px)")
+
+    return {"timings": timings, "found": found, "matched": matched}
+
+
 def main_entry():
     from instamatic.formats import read_image
     import warnings
     warnings.simplefilter('ignore')
 
+    if sys.argv[1:2] == ["--benchmark"]:
+        benchmark(sys.argv[2:])
+        return
+
     for fn in sys.argv[1:]:
         img, h = read_image(fn)
         
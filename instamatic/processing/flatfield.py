@@ -11,6 +11,9 @@ from pathlib import Path
 import warnings
 from instamatic import config
 
+# Timepix correction factor for the center pixels, see `get_center_pixel_correction`
+CENTER_PIXEL_CORRECTION = 1.19870594245
+
 
 def apply_corrections(img, deadpixels=None):
     """Apply image corrections"""
@@ -23,11 +26,8 @@ def apply_corrections(img, deadpixels=None):
 
 def remove_deadpixels(img, deadpixels, d=1):
     """Remove dead pixels from the images by replacing them with the average of neighbouring pixels"""
-    d = 1
-    for (i,j) in deadpixels:
-        neighbours = img[i-d:i+d+1, j-d:j+d+1].flatten()
-        img[i,j] = np.mean(neighbours)
-    return img
+    plan = DeadPixelPlan(img.shape[-2:], deadpixels, d=d)
+    return plan.apply(img)
 
 
 def get_deadpixels(img):
@@ -35,7 +35,7 @@ def get_deadpixels(img):
     return np.argwhere(img == 0)
 
 
-def apply_center_pixel_correction(img, k=1.19870594245):
+def apply_center_pixel_correction(img, k=CENTER_PIXEL_CORRECTION):
     """Correct the intensity of the center pixels"""
     img[255:261,255:261] = img[255:261,255:261] * k
     return img
@@ -75,6 +75,204 @@ def apply_flatfield_correction(img, flatfield, darkfield=None):
     return ret
 
 
+class DeadPixelPlan(object):
+    """Precomputed plan to replace dead pixels by the average of their neighbours.
+
+    For every dead pixel, the flat indices of the live pixels in the surrounding
+    (2d+1)x(2d+1) window and their weights are stored, so that all dead pixels in a frame
+    (or stack of frames) are replaced using a single gather and sum.
+
+    shape: (height, width) of the frames
+    deadpixels: (N, 2) array with the (row, column) of the dead pixels
+    d: size of the neighbourhood
+    """
+    def __init__(self, shape: tuple, deadpixels, d: int=1):
+        super().__init__()
+        self.shape = tuple(shape)
+        deadpixels = np.asarray(deadpixels, dtype=int).reshape(-1, 2)
+
+        ny, nx = self.shape
+        dead = np.zeros(self.shape, dtype=bool)
+        dead[deadpixels[:,0], deadpixels[:,1]] = True
+
+        di, dj = np.mgrid[-d:d+1, -d:d+1]
+        di, dj = di.ravel(), dj.ravel()
+
+        i = deadpixels[:,0,np.newaxis] + di
+        j = deadpixels[:,1,np.newaxis] + dj
+        valid = (i >= 0) & (i < ny) & (j >= 0) & (j < nx)
+        i = np.clip(i, 0, ny-1)
+        j = np.clip(j, 0, nx-1)
+        valid &= ~dead[i, j]
+
+        counts = valid.sum(axis=1, keepdims=True)
+
+        self.index = np.ravel_multi_index((deadpixels[:,0], deadpixels[:,1]), self.shape)
+        self.neighbours = np.ravel_multi_index((i, j), self.shape)
+        self.weights = np.divide(valid, counts, out=np.zeros(valid.shape), where=counts > 0)
+
+    def __len__(self):
+        return len(self.index)
+
+    def apply(self, img: np.ndarray) -> np.ndarray:
+        """Replace the dead pixels in `img` (frame or stack of frames) in place.
+        Only the live pixels in the neighbourhood are averaged."""
+        if not len(self):
+            return img
+        if not img.flags.c_contiguous:
+            img = np.ascontiguousarray(img)
+        flat = img.reshape(-1, self.shape[0]*self.shape[1])
+        flat[:, self.index] = (flat[:, self.neighbours] * self.weights).sum(axis=-1)
+        return img
+
+
+class FlatfieldCorrector(object):
+    """Apply the flatfield, darkfield, dead pixel and center pixel corrections to frames.
+
+    The gain map and dead pixel plan are calculated once, so that the corrections
+    can be applied to every frame using a few vectorized, in-place operations.
+
+    flatfield: flatfield image
+    darkfield: darkfield image (optional)
+    deadpixels: (N, 2) array with the coordinates of the dead pixels (optional)
+    center_pixel_correction: correction factor for the Timepix center pixels (optional),
+                             see `apply_center_pixel_correction`
+    """
+    def __init__(self, flatfield: np.ndarray, darkfield: np.ndarray=None, deadpixels=None, center_pixel_correction: float=None):
+        super().__init__()
+        flatfield = np.asarray(flatfield, dtype=float)
+        self.shape = flatfield.shape
+
+        if darkfield is None:
+            self.darkfield = None
+            self.gain = np.mean(flatfield) / flatfield
+        else:
+            self.darkfield = np.asarray(darkfield, dtype=float)
+            self.gain = np.mean(flatfield - darkfield) / (flatfield - darkfield)
+
+        if deadpixels is not None and len(deadpixels) > 0:
+            self.deadpixels = DeadPixelPlan(self.shape, deadpixels)
+        else:
+            self.deadpixels = None
+
+        self.center_pixel_correction = center_pixel_correction
+
+    def __repr__(self):
+        ndead = len(self.deadpixels) if self.deadpixels else 0
+        return f"{self.__class__.__name__}(shape={self.shape}, darkfield={self.darkfield is not None}, deadpixels={ndead})"
+
+    @classmethod
+    def from_files(cls, flatfield: str, darkfield: str=None, deadpixels=None, **kwargs):
+        """Set up the corrections from files.
+
+        deadpixels: path to a .npy file with the dead pixel coordinates, or
+                    'header' to use the coordinates stored in the flatfield header
+        """
+        flatfield, h = read_tiff(flatfield)
+
+        if darkfield is not None:
+            darkfield, _ = read_tiff(darkfield)
+
+        if isinstance(deadpixels, str) and deadpixels == "header":
+            deadpixels = h.get("deadpixels")
+        elif deadpixels is not None:
+            deadpixels = np.load(deadpixels)
+
+        return cls(flatfield, darkfield=darkfield, deadpixels=deadpixels, **kwargs)
+
+    def apply(self, img: np.ndarray, inplace: bool=False) -> np.ndarray:
+        """Apply the corrections to `img` (frame or stack of frames).
+
+        A new float array is returned, unless `inplace` is set and `img` is a C-contiguous float array."""
+        if img.shape[-2:] != self.shape:
+            msg = f"Flatfield not applied: image {img.shape} and flatfield {self.shape} do not match shapes."
+            warnings.warn(msg)
+            return img
+
+        if inplace and img.dtype.kind == "f" and img.flags.c_contiguous:
+            ret = img
+        else:
+            ret = np.array(img, dtype=float)
+
+        if self.deadpixels is not None:
+            ret = self.deadpixels.apply(ret)
+        if self.center_pixel_correction is not None:
+            ret[..., 255:261, 255:261] *= self.center_pixel_correction
+        if self.darkfield is not None:
+            ret -= self.darkfield
+        ret *= self.gain
+
+        return ret
+
+    __call__ = apply
+
+
+def benchmark(shape: tuple=(516, 516), ndead: int=2000, nframes: int=100) -> None:
+    """Compare `FlatfieldCorrector` with the per-frame correction functions"""
+    flatfield = np.random.normal(1000, 30, size=shape)
+    deadpixels = np.unique(np.random.randint(1, min(shape) - 1, size=(ndead, 2)), axis=0)
+    imgs = np.random.poisson(100, size=(nframes, *shape)).astype(np.uint16)
+
+    t0 = time.perf_counter()
+    for img in imgs:
+        img = remove_deadpixels_loop(img.astype(float), deadpixels)
+        img = apply_flatfield_correction(img, flatfield)
+    t1 = time.perf_counter()
+
+    corrector = FlatfieldCorrector(flatfield, deadpixels=deadpixels)
+    t2 = time.perf_counter()
+    for img in imgs:
+        img = corrector(img)
+    t3 = time.perf_counter()
+    corrector(imgs)
+    t4 = time.perf_counter()
+
+    print(f"{nframes} frames {shape}, {len(deadpixels)} dead pixels")
+    print(f"  functions (loop)      : {(t1-t0)/nframes*1000:8.2f} ms/frame")
+    print(f"  FlatfieldCorrector    : {(t3-t2)/nframes*1000:8.2f} ms/frame (setup {(t2-t1)*1000:.1f} ms)")
+    print(f"  FlatfieldCorrector (stack): {(t4-t3)/nframes*1000:4.2f} ms/frame")
+
+
+def remove_deadpixels_loop(img, deadpixels, d=1):
+    """Reference implementation of `remove_deadpixels` using a loop"""
+    for (i,j) in deadpixels:
+        neighbours = img[i-d:i+d+1, j-d:j+d+1].flatten()
+        img[i,j] = np.mean(neighbours)
+    return img
+
+
+def collect_average(ctrl, frames: int, exposure: float, binsize: int=1, save_images: bool=False, drc=".", name: str="Flat field") -> np.ndarray:
+    """Collect `frames` images and return their average
+
+    If the camera is a video stream and the images are not saved, the frames are recorded
+    back-to-back into its ring buffer and added to a running sum, without keeping them in memory."""
+    from instamatic.camera.videostream import VideoStream
+
+    total = None
+
+    if not save_images and isinstance(ctrl.cam, VideoStream):
+        ring = ctrl.cam.start_recording(exposure=exposure, nslots=16)
+        cursor = ring.cursor()
+        img = np.empty(ring.shape, dtype=ring.dtype)
+        total = np.zeros(ring.shape)
+        try:
+            for n in tqdm(range(frames)):
+                cursor.read(out=img)
+                total += img
+        finally:
+            ctrl.cam.stop_recording()
+    else:
+        for n in tqdm(range(frames)):
+            prefix = name.lower().replace(" ", "")
+            outfile = Path(drc) / f"{prefix}_{n:04d}.tiff" if save_images else None
+            img,h = ctrl.getImage(exposure=exposure, binsize=binsize, out=outfile, comment=f"{name} #{n:04d}", header_keys=None)
+            if total is None:
+                total = np.zeros(img.shape)
+            total += img
+
+    return total / frames
+
+
 def collect_flatfield(ctrl=None, frames=100, save_images=False, collect_darkfield=True, drc=".", **kwargs):
     """Routine to collect flatfield correction files.
     
@@ -106,15 +304,8 @@ def collect_flatfield(ctrl=None, frames=100, save_images=False, collect_darkfiel
 
     ctrl.cam.block()
 
-    buffer = []
-
     print("\nCollecting flatfield images")
-    for n in tqdm(range(frames)):
-        outfile = drc / f"flatfield_{n:04d}.tiff" if save_images else None
-        img,h = ctrl.getImage(exposure=exposure, binsize=binsize, out=outfile, comment=f"Flat field #{n:04d}", header_keys=None)
-        buffer.append(img)
-    
-    f = np.mean(buffer, axis=0)
+    f = collect_average(ctrl, frames, exposure=exposure, binsize=binsize, save_images=save_images, drc=drc, name="Flat field")
     deadpixels = get_deadpixels(f)
     get_center_pixel_correction(f)
     f = remove_deadpixels(f, deadpixels=deadpixels)
@@ -127,15 +318,8 @@ def collect_flatfield(ctrl=None, frames=100, save_images=False, collect_darkfiel
     if collect_darkfield:
         ctrl.beamblank = True
     
-        buffer = []
-    
         print("\nCollecting darkfield images")
-        for n in tqdm(range(frames)):
-            outfile = drc / f"darkfield_{n:04d}.tiff" if save_images else None
-            img,h = ctrl.getImage(exposure=exposure, binsize=binsize, out=outfile, comment=f"Dark field #{n:04d}", header_keys=None)
-            buffer.append(img)
-        
-        d = np.mean(buffer, axis=0)
+        d = collect_average(ctrl, frames, exposure=exposure, binsize=binsize, save_images=save_images, drc=drc, name="Dark field")
         d = remove_deadpixels(d, deadpixels=deadpixels)
     
         ctrl.beamblank = False
@@ -194,17 +378,14 @@ def main_entry():
         exit()
 
     if options.flatfield:
-        flatfield,h = read_tiff(options.flatfield)
-        deadpixels = h["deadpixels"]
+        corrector = FlatfieldCorrector.from_files(options.flatfield, 
+                                                  darkfield=options.darkfield, 
+                                                  deadpixels="header", 
+                                                  center_pixel_correction=CENTER_PIXEL_CORRECTION)
     else:
         print("No flatfield file specified")
         exit()
 
-    if options.darkfield:
-        darkfield,h = read_tiff(options.darkfield)
-    else:
-        darkfield = np.zeros_like(flatfield)
-
     if len(args) == 1:
         fobj = args[0]
         if not os.path.exists(fobj):
@@ -216,8 +397,7 @@ def main_entry():
     for f in args:
         img,h = read_tiff(f)
 
-        img = apply_corrections(img, deadpixels=deadpixels)
-        img = apply_flatfield_correction(img, flatfield, darkfield=darkfield)
+        img = corrector.apply(img)
 
         name = Path(f).name
         fout = drc / name
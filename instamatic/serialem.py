@@ -1,5 +1,5 @@
 from pathlib import Path
-import re
+from types import MappingProxyType
 import numpy as np
 import random
 from collections import defaultdict
@@ -48,6 +48,28 @@ list_int_map = ("BklshXY",           "MapWidthHeight", "MapFramesXY",
 unknown_map = ()
 
 
+def _list_float(value: str) -> list:
+    return [float(val) for val in value.split()]
+
+
+def _list_int(value: str) -> list:
+    return [int(val) for val in value.split()]
+
+
+# Frozen lookup table of key -> conversion function, unknown keys are kept as `str`.
+# Built in reverse order, so that the first map a key appears in takes precedence.
+KEY_TYPES = MappingProxyType({
+    **{key: _list_int for key in list_int_map},
+    **{key: _list_float for key in list_float_map},
+    **{key: str for key in str_map},
+    **{key: float for key in float_map},
+    **{key: int for key in int_map},
+})
+
+# Keys that are always parsed, also if the item body is read lazily
+NAV_INDEX_KEYS = frozenset(("Type", "Acquire", "MapID", "GroupID", "DrawnID"))
+
+
 class NavItem(object):
     """
     DataClass for SerialEM Nav items
@@ -61,7 +83,7 @@ class NavItem(object):
     TAG_ID_ITERATOR = 1
     # MAP_ID_ITERATOR = 1
     
-    def __init__(self, d: dict, tag: str):
+    def __init__(self, d: dict, tag: str, raw: list=None):
         super().__init__()
         # if not "MapID" in d:
         #     d["MapID"] = NavItem.MAP_ID_ITERATOR
@@ -78,6 +100,30 @@ class NavItem(object):
 
         self.tag = tag
 
+        # lines of the item body that have not been parsed yet (see `read_nav_file(lazy=True)`)
+        self._raw = raw
+
+    def __getattr__(self, name):
+        # only called if the attribute does not exist, parse the rest of the body of lazily read items
+        raw = self.__dict__.get("_raw")
+        if not raw:
+            raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+        self.parse()
+        return getattr(self, name)
+
+    def parse(self) -> None:
+        """Parse the remaining keys of a lazily read item. Keys that are already set are kept."""
+        raw = self.__dict__.get("_raw")
+        if not raw:
+            return
+
+        # the body is only dropped once it has been parsed, so that a bad value raises again on the next access
+        d = parse_block(raw)
+        self._raw = None
+        for key, value in d.items():
+            self.__dict__.setdefault(key, value)
+        self._keys = tuple(d.keys()) + tuple(key for key in self._keys if key not in d)
+
     def __repr__(self):
         return f"{self.__class__.__name__}({self.kind}[Item = {self.tag}])"
 
@@ -103,34 +149,23 @@ class NavItem(object):
 
     def to_string(self) -> str:
         """Convert nav item to string that can be printed to .nav file"""
-        s = f"[Item = {self.tag}]\n"
+        lines = [f"[Item = {self.tag}]"]
 
         d = self.to_dict()
 
         for key in sorted(d.keys()):
             val = d[key]
+            if KEY_TYPES.get(key) in (_list_float, _list_int):
+                val = " ".join([str(x) for x in val])
+            lines.append(f"{key} = {val}")
 
-            try:
-                if key in int_map:
-                    val = str(val)
-                elif key in float_map:
-                    val = str(val)
-                elif key in list_float_map:
-                    val = " ".join([str(x) for x in val])
-                elif key in list_int_map:
-                    val = " ".join([str(x) for x in val])
-            except TypeError as e:
-                print(e)
-                print(key, val)
-
-            s += f"{key} = {val}\n"
-
-        s += ""
+        lines.append("")
 
-        return s
+        return "\n".join(lines)
 
     def to_dict(self) -> dict:
         """Convert nav item back to dictionary"""
+        self.parse()
         return {key: self.__dict__[key] for key in self._keys}
 
 
@@ -150,30 +185,41 @@ class MapItem(NavItem):
         super().__init__(*args, **kwargs)
         
         self.markers = {}
+        self.marker_groups = []
+        self._transform_cache = None
+
+    def _transform(self) -> tuple:
+        """Return the cached matrix, inverse matrix, pixel center, and stage center.
+        The cache is invalidated when any of the map parameters change."""
+        key = (self.MapBinning, self.MontBinning, tuple(self.MapScaleMat), 
+               tuple(self.MapWidthHeight), tuple(self.StageXYZ[0:2]))
+
+        if self._transform_cache is None or self._transform_cache[0] != key:
+            mat = (self.MapBinning / self.MontBinning) * np.array(self.MapScaleMat).reshape(2, 2)
+            mati = np.linalg.inv(mat)
+            cp = np.array(self.MapWidthHeight) / 2
+            cs = np.array(self.StageXYZ[0:2])
+            self._transform_cache = key, (mat, mati, cp, cs)
+
+        return self._transform_cache[1]
 
     @property
     def map_scale_matrix(self) -> "np.array":
-        MapBinning = self.MapBinning
-        MontBinning = self.MontBinning
-        return (MapBinning / MontBinning) * np.array(self.MapScaleMat).reshape(2, 2)
+        return self._transform()[0]
 
-    def pixel_to_stagecoords(self, coords: list) -> "np.array":
-        """Convert from pixel coordinates to stage coordinates"""
-        coords = np.array(coords)
-        cp = np.array(self.MapWidthHeight) / 2
-        cs = np.array(self.StageXYZ)[0:2]
-        mati = np.linalg.inv(self.map_scale_matrix)
+    @property
+    def map_scale_matrix_inv(self) -> "np.array":
+        return self._transform()[1]
 
-        return np.dot(coords - cp, mati) + cs
+    def pixel_to_stagecoords(self, coords: list) -> "np.array":
+        """Convert from pixel coordinates to stage coordinates, `coords` can be a single (x, y) or an (N, 2) array"""
+        mat, mati, cp, cs = self._transform()
+        return np.dot(np.asarray(coords) - cp, mati) + cs
 
     def stage_to_pixelcoords(self, coords: list) -> "np.array":
-        """Convert from stage coordinates to pixel coordinates"""
-        coords = np.array(coords)
-        cp = np.array(self.MapWidthHeight) / 2
-        cs = np.array(self.StageXYZ)[0:2]
-        mat = self.map_scale_matrix
-
-        return np.dot(coords - cs, mat) + cp
+        """Convert from stage coordinates to pixel coordinates, `coords` can be a single (x, y) or an (N, 2) array"""
+        mat, mati, cp, cs = self._transform()
+        return np.dot(np.asarray(coords) - cs, mat) + cp
 
     def load_image(self, drc: str=None) -> "np.array":
         """Loads the image corresponding to this item"""
@@ -195,10 +241,15 @@ class MapItem(NavItem):
         """Plot the image including markers (optional)"""
         import matplotlib.pyplot as plt
 
+        groups = []
         if markers is True:
             markers = self.markers.values()
+            groups = self.marker_groups
         elif isinstance(markers, dict):
             markers = markers.values()
+        elif isinstance(markers, MarkerGroup):
+            groups = [markers]
+            markers = []
         elif isinstance(markers, (list, tuple, np.ndarray)):
             pass
         else:
@@ -219,19 +270,23 @@ class MapItem(NavItem):
 
             coords.append((px, py))
 
+        for group in groups:
+            pxy = self.stage_to_pixelcoords(group.stage_xy)
+            pxy[:, 1] = yres - pxy[:, 1]
+            coords.extend(pxy)
+
         if coords:
             px, py = np.array(coords).T
             plt.plot(px, py, "ro", markerfacecolor='none', markersize=20, markeredgewidth=2)
 
-    def add_marker(self, coord, tag=None, acquire=True) -> "NavItem":
-        """Add pixel coordinate (numpy) as marker to a map item"""
-
-        # assuming pixel coords from numpy
-        py, px = coord
+    def _coords_to_stage(self, coords) -> "np.array":
+        """Convert pixel coordinates (numpy, N x 2 as y, x) to stage coordinates (N x 2)"""
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
         yres = self.MapWidthHeight[1]
-        py = yres - py
-        stage_x, stage_y = self.pixel_to_stagecoords((px, py))
+        pxy = np.column_stack((coords[:, 1], yres - coords[:, 0]))
+        return self.pixel_to_stagecoords(pxy)
 
+    def _marker_dict(self, stage_x: float, stage_y: float, acquire: bool=True) -> dict:
         d = {}
         try:
             d["BklshXY"] = self.BklshXY
@@ -248,8 +303,15 @@ class MapItem(NavItem):
         d["Regis"] = self.Regis
         d["StageXYZ"] = [stage_x, stage_y, self.stage_z]
         d["Type"] = 0
+        return d
+
+    def add_marker(self, coord, tag=None, acquire=True) -> "NavItem":
+        """Add pixel coordinate (numpy) as marker to a map item"""
+
+        # assuming pixel coords from numpy
+        stage_x, stage_y = self._coords_to_stage(coord)[0]
 
-        item = NavItem(d, tag=tag)
+        item = NavItem(self._marker_dict(stage_x, stage_y, acquire=acquire), tag=tag)
 
         self.markers[item.tag] = item
 
@@ -258,20 +320,60 @@ class MapItem(NavItem):
     def add_marker_group(self, coords, acquire=True, replace=True) -> list:
         """Add pixel coordinates (numpy) as markers to a map item
         If `replace==True`, replace the entire list of existing markers
-        on the map item."""
+        on the map item.
+
+        See `add_marker_array` for large numbers of markers."""
         if replace:
             self.markers = {}
+            self.marker_groups = []
+
+        stage_xy = self._coords_to_stage(coords)
 
         ret = []
-        for i, coord in enumerate(coords):
+        for i, (stage_x, stage_y) in enumerate(stage_xy):
             tag = f"{self.tag}-{i}"
-            item = self.add_marker(coord, tag=tag, acquire=True)
+            item = NavItem(self._marker_dict(stage_x, stage_y, acquire=acquire), tag=tag)
+            self.markers[item.tag] = item
             ret.append(item)
 
         MapItem.GROUP_ID_ITERATOR += 1
 
         return ret
 
+    def add_marker_array(self, coords, acquire=True, replace=True) -> "MarkerGroup":
+        """Add pixel coordinates (numpy, N x 2) as a group of markers to a map item in one go.
+
+        Same as `add_marker_group`, but the markers are stored as arrays in a `MarkerGroup`
+        (in `self.marker_groups`) instead of individual `NavItem`s. The group can be
+        passed to `write_nav_file`/`append_nav_file` directly.
+        If `replace==True`, replace the entire list of existing markers on the map item."""
+        if replace:
+            self.markers = {}
+            self.marker_groups = []
+
+        stage_xy = self._coords_to_stage(coords)
+        n = len(stage_xy)
+
+        try:
+            backlash = self.BklshXY
+        except AttributeError:
+            backlash = 10 ,-10
+
+        group = MarkerGroup(stage_xy=stage_xy,
+                            stage_z=self.stage_z,
+                            tags=[f"{self.tag}-{i}" for i in range(n)],
+                            acquire=np.full(n, int(acquire)),
+                            drawn_id=self.MapID,
+                            group_id=MapItem.GROUP_ID_ITERATOR,
+                            regis=self.Regis,
+                            backlash=backlash)
+
+        self.marker_groups.append(group)
+
+        MapItem.GROUP_ID_ITERATOR += 1
+
+        return group
+
     def update_markers(self, *items):
         """Update the list of markers belonging to this `Map` with
         the given items."""
@@ -282,40 +384,178 @@ class MapItem(NavItem):
         """Replace the list of markers belonging to this `Map` with
         the given items."""
         self.markers = {}
+        self.marker_groups = []
         self.update_markers(*items)
 
 
-def block2dict(block: list, kind: str=None, sequence: int=-1) -> dict:
-    """Takes a text block from a SerialEM .nav file and converts it into a
-    dictionary"""
-    patt_split = re.compile("\s?=\s?")
+class MarkerGroup(object):
+    """Columnar storage for a group of markers drawn on a map item, see `MapItem.add_marker_array`
+
+    stage_xy: (N, 2) array with the stage coordinates
+    stage_z: stage z for all markers
+    tags: list of N tags
+    acquire: (N) array with the Acquire flag of every marker
+    drawn_id: MapID of the map the markers belong to
+    group_id: GroupID shared by the markers
+    regis: registration
+    backlash: BklshXY
+    color: Color
+    """
+    def __init__(self, stage_xy, stage_z: float, tags: list, acquire, drawn_id: int, group_id: int, 
+                       regis: int=1, backlash: tuple=(10, -10), color: int=0):
+        super().__init__()
+        self.stage_xy = np.asarray(stage_xy, dtype=float).reshape(-1, 2)
+        self.stage_z = stage_z
+        self.tags = list(tags)
+        self.acquire = np.asarray(acquire, dtype=int)
+        self.drawn_id = drawn_id
+        self.group_id = group_id
+        self.regis = regis
+        self.backlash = backlash
+        self.color = color
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self)} markers, GroupID = {self.group_id})"
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, i: int) -> "NavItem":
+        stage_x, stage_y = self.stage_xy[i].tolist()
+        d = {
+            "BklshXY": self.backlash,
+            "Color": self.color,
+            "DrawnID": self.drawn_id,
+            "GroupID": self.group_id,
+            "Acquire": int(self.acquire[i]),
+            "NumPts": 1,
+            "PtsX": [stage_x],
+            "PtsY": [stage_y],
+            "Regis": self.regis,
+            "StageXYZ": [stage_x, stage_y, self.stage_z],
+            "Type": 0
+        }
+        return NavItem(d, tag=self.tags[i])
+
+    def to_items(self) -> list:
+        """Convert to a list of `NavItem`s"""
+        return [self[i] for i in range(len(self))]
+
+    def to_string(self) -> str:
+        """Convert all markers to a string that can be printed to a .nav file"""
+        backlash = " ".join([str(x) for x in self.backlash])
+        const = (f"BklshXY = {backlash}\nColor = {self.color}\n"
+                 f"DrawnID = {self.drawn_id}\nGroupID = {self.group_id}\nNumPts = 1\n")
+
+        blocks = []
+        for tag, (x, y), acquire in zip(self.tags, self.stage_xy.tolist(), self.acquire.tolist()):
+            blocks.append(f"[Item = {tag}]\nAcquire = {acquire}\n{const}PtsX = {x}\nPtsY = {y}\n"
+                          f"Regis = {self.regis}\nStageXYZ = {x} {y} {self.stage_z}\nType = 0\n")
+
+        return "\n".join(blocks)
+
+
+class NavIndex(object):
+    """Lookup tables for nav items by tag, MapID, and GroupID
+
+    Use `read_nav_index` to read a .nav file into an index.
+    Only the keys in `NAV_INDEX_KEYS` are used, so lazily read items are not parsed."""
+    def __init__(self, items: list=()):
+        super().__init__()
+        self.items = []
+        self.by_tag = {}
+        self.by_map_id = {}
+        self.by_group_id = defaultdict(list)
+
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, tag: str) -> "NavItem":
+        return self.by_tag[tag]
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.by_tag
+
+    def add(self, item: "NavItem") -> None:
+        """Add item to the index"""
+        self.items.append(item)
+        self.by_tag[item.tag] = item
+
+        map_id = item.__dict__.get("MapID")
+        if map_id is not None:
+            self.by_map_id[map_id] = item
+
+        group_id = item.__dict__.get("GroupID")
+        if group_id is not None:
+            self.by_group_id[group_id].append(item)
+
+    def get_map(self, map_id: int) -> "NavItem":
+        """Return the item with the given MapID"""
+        return self.by_map_id[map_id]
+
+    def get_group(self, group_id: int) -> list:
+        """Return the items with the given GroupID"""
+        return self.by_group_id.get(group_id, [])
+
+
+def iter_blocks(f) -> tuple:
+    """Single pass tokenizer for the lines of a SerialEM .nav/.mdoc file
+
+    Yields a tuple `(header, lines)` for every `[key = value]` section, with
+    `header = (key, value)` and the (stripped) lines of the body. The lines before
+    the first section (i.e. `AdocVersion`) are yielded with `header = None`."""
+    header = None
+    block = []
+
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+
+        if line[0] == "[" and line[-1] == "]":
+            if block or header:
+                yield header, block
+            key, _, value = line[1:-1].partition("=")
+            header = key.strip(), value.strip()
+            block = []
+        else:
+            block.append(line)
+
+    if block or header:
+        yield header, block
+
+
+def parse_block(block: list, only: frozenset=None) -> dict:
+    """Convert the lines of a block to a dict, the values are converted using `KEY_TYPES`
+
+    only: parse only these keys"""
     d = {}
 
-    for item in block:
-        key, value = re.split(patt_split, item)
+    for line in block:
+        key, _, value = line.partition("=")
+        key = key.strip()
+
+        if only is not None and key not in only:
+            continue
 
         try:
-            if key in int_map:
-                value = int(value)
-            elif key in float_map:
-                value = float(value)
-            elif key in str_map:
-                value = str(value)
-            elif key in list_float_map:
-                value = [float(val) for val in value.split()]
-            elif key in list_int_map:
-                value = [int(val) for val in value.split()]
-            elif key in unknown_map:
-                print(item)
-            else:
-                print("Unknown item:", item)
-        except Exception as e:
-            print(e)
-            print(item)
-            print(key, value)
-            raise
+            d[key] = KEY_TYPES.get(key, str)(value.strip())
+        except ValueError as e:
+            raise ValueError(f"Could not parse `{line}`: {e}") from e
+
+    return d
 
-        d[key] = value
+
+def block2dict(block: list, kind: str=None, sequence: int=-1) -> dict:
+    """Takes a text block from a SerialEM .nav file and converts it into a
+    dictionary"""
+    d = parse_block(block)
 
     if sequence >= 0:
         d["sequence"] = sequence
@@ -325,64 +565,44 @@ def block2dict(block: list, kind: str=None, sequence: int=-1) -> dict:
     return d
 
 
-def block2nav(block: list, tag=None) -> "NavItem":
+def block2nav(block: list, tag=None, lazy: bool=False) -> "NavItem":
     """Takes a text block from a SerialEM .nav file and converts it into a
-    instance of `NavItem` or `MapItem`"""
-    d = block2dict(block)
+    instance of `NavItem` or `MapItem`
+
+    lazy: only parse the keys in `NAV_INDEX_KEYS`, the rest is parsed when first accessed"""
+    if lazy:
+        d = parse_block(block, only=NAV_INDEX_KEYS)
+    else:
+        d = parse_block(block)
     kind = d["Type"]
 
     if kind == 2:
-        ret = MapItem(d, tag=tag)
+        ret = MapItem(d, tag=tag, raw=block if lazy else None)
     else:
-        ret = NavItem(d, tag=tag)
+        ret = NavItem(d, tag=tag, raw=block if lazy else None)
 
     return ret 
 
 
-def read_nav_file(fn: str, acquire_only: bool=False) -> list:
+def read_nav_file(fn: str, acquire_only: bool=False, lazy: bool=False) -> list:
     """
     Reads a SerialEM .nav file and returns a list of dictionaries
     containing nav item data.
 
     acquire_only: bool
         read only files with the Acquire tag set
+    lazy: bool
+        only parse the keys needed to index the items (`NAV_INDEX_KEYS`),
+        the rest of the body of an item is parsed when it is first accessed
     """
-
-    # https://regex101.com/
-    patt_match = re.compile("\[Item\s?=\s?([a-zA-Z0-9_-]*)\]")
-
-    capture = False
-    block = []
     items = []
-    tag = ""
-
-    f = open(fn, "r")
-    for line in f:
-        line = line.strip()
-        if not line:
-            continue
-
-        m = re.match(patt_match, line)
-        
-        if m:
-            if block:
-                items.append(block2nav(block, tag=tag))
 
-            # prep for next block
-            tag = m.groups()[0]
-            block = []
-            capture = True
-        elif capture:
-            block.append(line)
-        else:
-            if line.startswith("AdocVersion"):
-                pass
-            elif line.startswith("LastSavedAs"):
-                pass
-            else:
-                print(line)
-
-    items.append(block2nav(block, tag=tag))
+    with open(fn, "r") as f:
+        for header, block in iter_blocks(f):
+            if header is None:
+                continue  # AdocVersion, LastSavedAs
+            tag = header[1]
+            items.append(block2nav(block, tag=tag, lazy=lazy))
 
     if acquire_only:
         items = [item for item in items if item.Acquire]
@@ -403,14 +623,19 @@ def read_nav_file(fn: str, acquire_only: bool=False) -> list:
     return items
 
 
+def read_nav_index(fn: str, acquire_only: bool=False, lazy: bool=True) -> "NavIndex":
+    """Read a SerialEM .nav file into a `NavIndex`, see `read_nav_file`"""
+    return NavIndex(read_nav_file(fn, acquire_only=acquire_only, lazy=lazy))
+
+
 def write_nav_file(fn: str, *items, mode="w") -> None:
     """
     Write list of nav items to a navigator file with filename `fn` to be read by SerialEM
 
-    `items` must be a list of NavItem / MapItem objects
+    `items` must be a list of NavItem / MapItem / MarkerGroup objects
 
     mode can be "w" to write a new file, or "a" to append
-    items to an existing file
+    items to an existing file (see also `append_nav_file`)
     """
     f = open(fn, mode) if fn else None
     version = "2.00"
@@ -423,6 +648,50 @@ def write_nav_file(fn: str, *items, mode="w") -> None:
     for item in items:
         print(item.to_string(), file=f)
 
+    if f:
+        f.close()
+
+
+def append_nav_file(fn: str, *items) -> None:
+    """
+    Append nav items (i.e. new markers) to an existing navigator file, without
+    reading or re-writing the items that are already in the file.
+
+    Raises ValueError if the tag or MapID of one of the items is already used in the file.
+    """
+    tags = set()
+    map_ids = set()
+
+    with open(fn, "r") as f:
+        for line in f:
+            if line.startswith("[Item"):
+                tags.add(line.strip()[1:-1].partition("=")[2].strip())
+            elif line.startswith("MapID"):
+                map_ids.add(int(line.partition("=")[2]))
+
+    for item in items:
+        for tag in (item.tags if isinstance(item, MarkerGroup) else (item.tag, )):
+            if tag in tags:
+                raise ValueError(f"Tag `{tag}` already exists in {fn}")
+            tags.add(tag)
+        map_id = item.__dict__.get("MapID")
+        if map_id is not None and map_id in map_ids:
+            raise ValueError(f"MapID `{map_id}` ({item}) already exists in {fn}")
+
+    with open(fn, "rb") as f:
+        f.seek(0, 2)
+        if f.tell():
+            f.seek(-1, 2)
+            newline = f.read(1) != b"\n"
+        else:
+            newline = False
+
+    with open(fn, "a") as f:
+        if newline:
+            print("", file=f)
+        for item in items:
+            print(item.to_string(), file=f)
+
 
 def read_mdoc_file(fn: str, only_kind: str=None) -> list:
     """
@@ -438,43 +707,23 @@ def read_mdoc_file(fn: str, only_kind: str=None) -> list:
     --------
     List of dicts with header information from the .mdoc file
     """
+    if only_kind:
+        only_kind = only_kind.lower()
 
-    # https://regex101.com/
-    patt_match = re.compile("\[([a-zA-Z]+)\s?=\s?([0-9]+)\]")
-
-    capture = False
-    block = []
     items = []
-    tag = ""
-
-    f = open(fn, "r")
-    for line in f:
-        line = line.strip()
-        if not line:
-            continue
-
-        m = re.match(patt_match, line)
-        
-        if m:
-            if block:
-                items.append(block2dict(block, kind=kind, sequence=sequence))
 
-            # prep for next block
-            kind = m.groups()[0]
-            sequence = int(m.groups()[1])
+    with open(fn, "r") as f:
+        for header, block in iter_blocks(f):
+            if header is None:
+                continue  # global keys, i.e. PixelSpacing, ImageFile
             
-            block = []
-            capture = True
-        elif capture:
-            block.append(line)
-        else:
-            print(line)
+            kind, sequence = header
+            if not sequence.isdigit():
+                continue  # title lines, i.e. [T = SerialEM: ...]
+            if only_kind and kind.lower() != only_kind:
+                continue
 
-    items.append(block2dict(block, kind=kind, sequence=sequence))
-    
-    if only_kind:
-        only_kind = only_kind.lower()
-        items = [item for item in items if item["kind"].lower() == only_kind]
+            items.append(block2dict(block, kind=kind, sequence=int(sequence)))
 
     return items
 
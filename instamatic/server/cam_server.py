@@ -1,11 +1,13 @@
 import threading
 import queue
 import socket
-import pickle
 import logging
 import datetime
 from instamatic import config
 from instamatic.camera import Camera
+from instamatic.server.serializer import send_message, recv_message
+from instamatic.server.response_cache import ResponseCache
+from concurrent.futures import Future
 import traceback
 
 from instamatic.utils import high_precision_timers
@@ -14,15 +16,26 @@ high_precision_timers.enable()
 # import sys
 # sys.setswitchinterval(0.001)  # seconds
 
-condition = threading.Condition()
-box = []
-
 # HOST = 'localhost'
 # PORT = 8088
 
 HOST = config.cfg.cam_server_host
 PORT = config.cfg.cam_server_port
-BUFSIZE = 4096
+
+# time in seconds that the return values of read-only calls are served from the cache
+CACHE_TTL = 1.0
+
+# camera functions that only read the camera state, the (non-callable) camera attributes are added on startup
+readonly_attrs = {"getDimensions", "getImageDimensions", "getCameraDimensions", "getName", "getCameraName",
+                  "getCameraType", "getPhysicalPixelsize", "isCameraInfoAvailable", "get_attrs"}
+
+
+def is_readonly(attr_name: str) -> bool:
+    """Check if the call `attr_name` only reads the state of the camera"""
+    return attr_name in readonly_attrs
+
+
+cache = ResponseCache(readonly=is_readonly, ttl=CACHE_TTL, key="attr_name", keep=("getImage",))
 
 
 class CamServer(threading.Thread):
@@ -30,12 +43,17 @@ class CamServer(threading.Thread):
     name of the camera `name` that is used to initialize the connection to the camera.
     Start the server using `CamServer.run` which will wait for items to appear on `q` and
     execute them on the specified camera instance.
+
+    Items on the queue are tuples of the command (dict) and a `concurrent.futures.Future`,
+    which is used to send the response back to the connection that made the request.
+    All calls to the camera are made from this thread.
     """
-    def __init__(self, log=None, q=None, name=None):
+    def __init__(self, log=None, q=None, name=None, verbose=True):
         super().__init__()
 
         self.log = log
         self.q = q
+        self.verbose = verbose
     
         # self.name is a reserved parameter for threads
         self._name = name
@@ -45,30 +63,32 @@ class CamServer(threading.Thread):
         self.cam = Camera(name=self._name, use_server=False)
         self.cam.get_attrs = self.get_attrs
 
+        readonly_attrs.update(self.get_attrs())
+
         print(f"Initialized connection to camera: {self.cam.name}")
 
         while True:
             now = datetime.datetime.now().strftime("%H:%M:%S.%f")
             
-            cmd = self.q.get()
-
-            with condition:
-                attr_name = cmd["attr_name"]
-                args = cmd.get("args", ())
-                kwargs = cmd.get("kwargs", {})
-
-                try:
-                    ret = self.evaluate(attr_name, args, kwargs)
-                    status = 200
-                except Exception as e:
-                    traceback.print_exc()
-                    if self.log:
-                        self.log.exception(e)
-                    ret = e
-                    status = 500
-
-                box.append((status, ret))
-                condition.notify()
+            cmd, future = self.q.get()
+
+            attr_name = cmd["attr_name"]
+            args = cmd.get("args", ())
+            kwargs = cmd.get("kwargs", {})
+
+            try:
+                ret = self.evaluate(attr_name, args, kwargs)
+                status = 200
+            except Exception as e:
+                traceback.print_exc()
+                if self.log:
+                    self.log.exception(e)
+                ret = e
+                status = 500
+
+            cache.update(cmd, status, ret)
+            future.set_result((status, ret))
+            if self.verbose:
                 print(f"{now} | {status} {attr_name}: {ret}")
 
     def evaluate(self, attr_name: str, args: list, kwargs: dict):
@@ -95,15 +115,16 @@ class CamServer(threading.Thread):
 
 def handle(conn, q):
     """Handle incoming connection, put command on the Queue `q`,
-    which is then handled by TEMServer."""
+    which is then handled by CamServer.
+
+    Read-only calls are answered directly from the cache if a recent value is available,
+    so that they do not have to wait for calls from other connections (i.e. `getImage`)."""
     with conn:
         while True:
-            data = conn.recv(BUFSIZE)
-            if not data:
+            data = recv_message(conn)
+            if data is None:
                 break
 
-            data = pickle.loads(data)
-
             if data == "exit":
                 break
 
@@ -112,12 +133,14 @@ def handle(conn, q):
                 # s.shutdown() ?
                 break
     
-            with condition:
-                q.put(data)
-                condition.wait()
-                response = box.pop()
-                conn.sendall(pickle.dumps(response))
-                # conn.send(pickle.dumps(response))
+            response = cache.get(data)
+
+            if response is None:
+                future = Future()
+                q.put((data, future))
+                response = future.result()
+
+            send_message(conn, response)
 
 
 def main():
@@ -126,10 +149,14 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--camera", action="store", dest="camera",
                         help="""Override camera to use""")
+    parser.add_argument("--cache-ttl", action="store", type=float, dest="cache_ttl",
+                        help="""Time in seconds that the values of read-only calls are served from the cache (0 to disable)""")
 
-    parser.set_defaults(camera=None)
+    parser.set_defaults(camera=None,
+                        cache_ttl=CACHE_TTL)
     options = parser.parse_args()
     camera = options.camera
+    cache.ttl = options.cache_ttl
 
     date = datetime.datetime.now().strftime("%Y-%m-%d")
     logfile = config.logs_drc / f"instamatic_CAMServer_{date}.log"
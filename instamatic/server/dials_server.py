@@ -1,27 +1,20 @@
 import sys
 import subprocess as sp
-from socket import *
 import datetime
 
 from instamatic import config
+from instamatic.server.job_queue import JobQueue, serve
 import logging
-import threading
 from pathlib import Path
 
-import pickle
-import ast
 
-
-try:
-    EXE = Path(sys.argv[1])
-except:
-    EXE = Path(config.cfg.dials_script)
-
-CWD = EXE.parent
+EXE = Path(config.cfg.dials_script)
 
 HOST = config.cfg.indexing_server_host
 PORT = config.cfg.indexing_server_port
-BUFF = 1024
+
+# number of DIALS jobs run at the same time
+WORKERS = getattr(config.cfg, "indexing_server_workers", 2)
 
 
 def parse_dials_index_log(fn="dials.index.log"):
@@ -29,13 +22,15 @@ def parse_dials_index_log(fn="dials.index.log"):
         print("Unit cell = ...")
 
 
-def run_dials_indexing(data):
-    cmd = [str(EXE), data["path"]]
+def run_dials_indexing(data, exe=EXE):
+    """Run the DIALS script on `data["path"]`, returns the unit cell found (if any)"""
+    exe = Path(exe)
+    cmd = [str(exe), data["path"]]
     date = datetime.datetime.now().strftime("%Y-%m-%d")
     fn = config.logs_drc / f"Dials_indexing_{date}.log"
     unitcelloutput = []
 
-    p = sp.Popen(cmd, cwd=CWD, stdout = sp.PIPE)
+    p = sp.Popen(cmd, cwd=exe.parent, stdout = sp.PIPE)
     for line in p.stdout:
         if b'Unit cell:' in line:
             print(line.decode('utf-8'))
@@ -43,53 +38,43 @@ def run_dials_indexing(data):
 
     if unitcelloutput:
         with open(fn, "a") as f:
-            f.write(f"\nData Path: {data["path"]}\n")
+            f.write(f"\nData Path: {data['path']}\n")
             f.write("{}".format(unitcelloutput[4:].decode('utf-8')))
-            f.write(f"Rotation range: {data["rotrange"]} degrees\n")
-            f.write(f"Number of frames: {data["nframes"]}\n")
-            f.write(f"Oscillation angle: {data["osc"]} deg\n\n\n\n")
-            print(f"Indexing result written to dials indexing log file; path: {data["path"]}")
+            f.write(f"Rotation range: {data['rotrange']} degrees\n")
+            f.write(f"Number of frames: {data['nframes']}\n")
+            f.write(f"Oscillation angle: {data['osc']} deg\n\n\n\n")
+            print(f"Indexing result written to dials indexing log file; path: {data['path']}")
     
     p.wait()
-    unitcelloutput = []
     now = datetime.datetime.now().strftime("%H:%M:%S.%f")
     print(f"{now} | DIALS indexing has finished")
 
-
-def handle(conn):
-    """Handle incoming connection."""
-    ret = 0
-
-    while True:
-        data = conn.recv(BUFF).decode()
-        data = ast.literal_eval(data)
-        now = datetime.datetime.now().strftime("%H:%M:%S.%f")
-
-        if not data:
-            break
-    
-        print(f"{now} | {data}")
-        if data == "close":
-            print(f"{now} | Closing connection")
-            break
-
-        elif data == "kill":
-            print(f"{now} | Killing server")
-            ret = 1
-            break
-
-        else:
-            conn.send(b"OK")
-            run_dials_indexing(data)
-
-    conn.send(b"Connection closed")
-    conn.close()
-    print("Connection closed")
-
-    return ret
+    if unitcelloutput:
+        return unitcelloutput.decode('utf-8').strip()
+    else:
+        return f"{data['path']}: no unit cell found"
 
 
 def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Indexing server (DIALS), runs the submitted jobs in a queue")
+    parser.add_argument("exe", nargs="?", action="store",
+                        help="""DIALS script to run on the data path (default: `dials_script` from the config)""")
+    parser.add_argument("-w", "--workers", action="store", type=int, dest="workers",
+                        help="""Number of DIALS jobs that run at the same time""")
+    parser.add_argument("--state", action="store", dest="state",
+                        help="""JSON file to keep the jobs in, unfinished jobs are resumed on restart""")
+    parser.add_argument("--port", action="store", type=int, dest="port",
+                        help="""Port to listen on""")
+
+    parser.set_defaults(exe=EXE,
+                        workers=WORKERS,
+                        state=config.logs_drc / "indexing_server_jobs_dials.json",
+                        port=PORT)
+    options = parser.parse_args()
+    exe = Path(options.exe)
+
     date = datetime.datetime.now().strftime("%Y-%m-%d")
     logfile = config.logs_drc / f"instamatic_indexing_server_{date}.log"
     logging.basicConfig(format="%(asctime)s | %(module)s:%(lineno)s | %(levelname)s | %(message)s", 
@@ -98,21 +83,16 @@ def main():
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
-    s = socket(AF_INET, SOCK_STREAM)
-    s.bind((HOST,PORT))
-    s.listen(5)
-
-    log.info(f"Indexing server (DIALS) listening on {HOST}:{PORT}")
-    log.info(f"Running command: {EXE}")
-    print(f"Indexing server (DIALS) listening on {HOST}:{PORT}")
-    print(f"Running command: {EXE}")
-
-    with s:
-        while True:
-            conn, addr = s.accept()
-            log.info('Connected by %s', addr)
-            print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn,)).start()
+    jobs = JobQueue(lambda data: run_dials_indexing(data, exe=exe), workers=options.workers, state_file=options.state, name="dials")
+
+    log.info(f"Indexing server (DIALS) listening on {HOST}:{options.port}")
+    log.info(f"Running command: {exe} ({options.workers} workers)")
+    print(f"Indexing server (DIALS) listening on {HOST}:{options.port}")
+    print(f"Running command: {exe} ({options.workers} workers)")
+    print(jobs)
+
+    # the autocRED client does not wait for the result
+    serve(jobs, HOST, options.port, log=log, wait_for_result=False)
 
     
 if __name__ == '__main__':
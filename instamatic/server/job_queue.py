@@ -0,0 +1,302 @@
+import ast
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from pathlib import Path
+from socket import *
+
+
+BUFF = 1024
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue(object):
+    """Queue of indexing jobs, processed by `workers` threads. Each worker runs one job
+    (i.e. one external indexing process) at a time, so that no more than `workers` jobs run
+    at the same time, however many datasets are submitted.
+
+    run_job: callable
+        Called with the payload of the job, the return value is stored as the result
+    state_file: str or Path
+        JSON file the jobs are stored in after every change. Jobs that were queued or running when
+        the server stopped are queued again when it is restarted.
+    """
+    def __init__(self, run_job, workers: int=2, state_file=None, name: str="indexing"):
+        super(JobQueue, self).__init__()
+        self.run_job = run_job
+        self.workers = workers
+        self.state_file = Path(state_file) if state_file else None
+        self.name = name
+
+        self.jobs = {}
+        self.counter = 0
+        self._queue = queue.Queue()
+        self._lock = threading.RLock()
+        self._finished = threading.Condition(self._lock)
+        self._threads = []
+
+        self.load()
+
+    def __repr__(self):
+        counts = self.counts()
+        return f"{self.__class__.__name__}(name={self.name!r}, workers={self.workers}, {', '.join(f'{k}={v}' for k, v in counts.items())})"
+
+    def load(self) -> None:
+        """Load the jobs from `state_file` and queue the unfinished ones again"""
+        if not (self.state_file and self.state_file.exists()):
+            return
+
+        with open(self.state_file, "r") as f:
+            state = json.load(f)
+
+        with self._lock:
+            self.counter = state["counter"]
+            self.jobs = {job["id"]: job for job in state["jobs"]}
+            for job_id, job in sorted(self.jobs.items()):
+                if job["status"] in (QUEUED, RUNNING):
+                    job["status"] = QUEUED
+                    job["started"] = None
+                    self._queue.put(job_id)
+
+    def save(self) -> None:
+        """Write the jobs to `state_file`, the file is replaced atomically"""
+        if not self.state_file:
+            return
+
+        with self._lock:
+            state = {"counter": self.counter, "jobs": list(self.jobs.values())}
+            tmp = self.state_file.with_suffix(".tmp")
+            with open(tmp, "w") as f:
+                json.dump(state, f, indent=1)
+            os.replace(tmp, self.state_file)
+
+    def start(self) -> None:
+        """Start the worker threads"""
+        for n in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"{self.name}-worker-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, wait: bool=True) -> None:
+        """Stop the workers after the jobs that are running, queued jobs are kept"""
+        for t in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+        self._threads = []
+
+    def submit(self, payload) -> int:
+        """Add a job to the queue, returns the job id"""
+        with self._lock:
+            self.counter += 1
+            job_id = self.counter
+            self.jobs[job_id] = {
+                "id": job_id,
+                "payload": payload,
+                "status": QUEUED,
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "result": None,
+                "error": None,
+            }
+            self.save()
+
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id: int) -> dict:
+        """Return a copy of the job, or None if it does not exist"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id: int, timeout: float=None) -> dict:
+        """Wait for the job to finish, returns a copy of the job"""
+        with self._finished:
+            self._finished.wait_for(lambda: self.jobs[job_id]["status"] in (DONE, FAILED), timeout)
+            return dict(self.jobs[job_id])
+
+    def counts(self) -> dict:
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self.jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+    def list(self, status: str=None) -> list:
+        """Summary of all jobs (without results), optionally only those with `status`"""
+        with self._lock:
+            return [{key: job[key] for key in ("id", "payload", "status", "submitted", "started", "finished")}
+                    for job in self.jobs.values() if status in (None, job["status"])]
+
+    def _work(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+
+            with self._lock:
+                job = self.jobs[job_id]
+                if job["status"] != QUEUED:
+                    continue
+                job["status"] = RUNNING
+                job["started"] = time.time()
+                payload = job["payload"]
+                self.save()
+
+            now = datetime.datetime.now().strftime("%H:%M:%S.%f")
+            print(f"{now} | Job {job_id} started: {payload}")
+
+            try:
+                result = self.run_job(payload)
+            except Exception as e:
+                traceback.print_exc()
+                status, result, error = FAILED, None, f"{type(e).__name__}: {e}"
+            else:
+                status, error = DONE, None
+
+            with self._finished:
+                job["status"] = status
+                job["finished"] = time.time()
+                job["result"] = result
+                job["error"] = error
+                self.save()
+                self._finished.notify_all()
+
+            now = datetime.datetime.now().strftime("%H:%M:%S.%f")
+            print(f"{now} | Job {job_id} {status} ({job['finished'] - job['started']:.1f} s)")
+
+    def request(self, request: dict) -> dict:
+        """Answer a request from a client:
+
+            {"cmd": "submit", "payload": ...}           -> {"job_id": id}
+            {"cmd": "status", "job_id": id}             -> job without result
+            {"cmd": "result", "job_id": id, "wait": t}  -> job, waits up to `t` seconds (null: until finished)
+            {"cmd": "jobs", "status": None}             -> {"jobs": [...], "counts": {...}}
+        """
+        cmd = request.get("cmd")
+
+        if cmd == "submit":
+            return {"job_id": self.submit(request["payload"])}
+        elif cmd == "jobs":
+            return {"jobs": self.list(request.get("status")), "counts": self.counts()}
+        elif cmd in ("status", "result"):
+            job_id = request.get("job_id")
+            job = self.get(job_id)
+            if job is None:
+                return {"error": f"Unknown job: {job_id}"}
+            if cmd == "status":
+                del job["result"]
+            elif "wait" in request:
+                job = self.wait(job_id, timeout=request["wait"])
+            return job
+        else:
+            return {"error": f"Unknown command: {cmd}"}
+
+
+def parse_message(data: str):
+    """Decode a message from a client: a JSON/python literal (dict or string), or a plain path"""
+    try:
+        return json.loads(data)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(data)
+    except (ValueError, SyntaxError):
+        return data
+
+
+def handle(conn, jobs: JobQueue, stop_event, wait_for_result: bool=True) -> int:
+    """Handle incoming connection.
+
+    Requests with a "cmd" are answered with a JSON reply terminated by a newline (see `JobQueue.request`).
+    Any other message is submitted as a job and answered with b"OK", followed by the result
+    when `wait_for_result` is set (the protocol of the old synchronous server)."""
+    ret = 0
+
+    while True:
+        data = conn.recv(BUFF).decode()
+        now = datetime.datetime.now().strftime("%H:%M:%S.%f")
+
+        if not data:
+            break
+
+        print(f"{now} | {data}")
+        if data == "close":
+            print(f"{now} | Closing connection")
+            break
+
+        elif data == "kill":
+            print(f"{now} | Killing server")
+            stop_event.set()
+            ret = 1
+            break
+
+        message = parse_message(data)
+
+        if isinstance(message, dict) and "cmd" in message:
+            reply = jobs.request(message)
+            conn.sendall(json.dumps(reply).encode() + b"\n")
+        else:
+            job_id = jobs.submit(message)
+            conn.send(b"OK")
+            if wait_for_result:
+                job = jobs.wait(job_id)
+                conn.send(str(job["result"] if job["status"] == DONE else job["error"]).encode())
+
+    conn.send(b"Connection closed")
+    conn.close()
+    print("Connection closed")
+
+    return ret
+
+
+def serve(jobs: JobQueue, host: str, port: int, log=None, wait_for_result: bool=True) -> None:
+    """Accept connections until a client sends `kill`, then stop the workers"""
+    stop_event = threading.Event()
+
+    s = socket(AF_INET, SOCK_STREAM)
+    s.bind((host, port))
+    s.listen(5)
+    s.settimeout(0.5)
+
+    jobs.start()
+
+    with s:
+        while not stop_event.is_set():
+            try:
+                conn, addr = s.accept()
+            except timeout:
+                continue
+            conn.settimeout(None)
+            if log:
+                log.info('Connected by %s', addr)
+            print('Connected by', addr)
+            threading.Thread(target=handle, args=(conn, jobs, stop_event, wait_for_result), daemon=True).start()
+
+    jobs.stop(wait=False)
+
+
+def send_request(request: dict, host: str, port: int) -> dict:
+    """Send a request (see `JobQueue.request`) to an indexing server and return the reply"""
+    with socket(AF_INET, SOCK_STREAM) as s:
+        s.connect((host, port))
+        s.sendall(json.dumps(request).encode())
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = s.recv(BUFF)
+            if not chunk:
+                break
+            data += chunk
+        s.send(b"close")
+    return json.loads(data)
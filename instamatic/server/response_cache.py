@@ -0,0 +1,63 @@
+import threading
+import time
+
+
+class ResponseCache(object):
+    """Snapshot of the return values of read-only calls on the server, so that they
+    can be answered directly from the connection threads without waiting for the
+    hardware thread. Values expire after `ttl` seconds.
+
+    Only calls without arguments are cached. Any call that is not read-only may change the
+    state of the instrument, and should clear the cache (see `.update`).
+
+    readonly: function that takes the name of a call and returns True if it is read-only
+    ttl: time in seconds for which a cached value is valid
+    key: the item in the command dict that gives the name of the call
+    keep: names of calls that are not read-only, but do not invalidate the cache (i.e. `getImage`)
+    cacheable: function that takes the name of a call and returns True if its return value may be
+               served from the cache (default: `readonly`), i.e. to exclude fast-changing values
+    """
+    def __init__(self, readonly, ttl: float=0.1, key: str="func_name", keep: tuple=(), cacheable=None):
+        super().__init__()
+        self.readonly = readonly
+        self.cacheable = cacheable if cacheable is not None else readonly
+        self.ttl = ttl
+        self.key = key
+        self.keep = frozenset(keep)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def is_cacheable(self, cmd: dict) -> bool:
+        """Check if the response to `cmd` can be served from the cache"""
+        return (not cmd.get("args")) and (not cmd.get("kwargs")) and self.cacheable(cmd[self.key])
+
+    def get(self, cmd: dict):
+        """Returns the cached (status, return value) for `cmd`, or None if not available"""
+        if not self.is_cacheable(cmd):
+            return None
+
+        with self._lock:
+            try:
+                t, ret = self._cache[cmd[self.key]]
+            except KeyError:
+                return None
+
+        if time.perf_counter() - t > self.ttl:
+            return None
+
+        return 200, ret
+
+    def update(self, cmd: dict, status: int, ret) -> None:
+        """Update the cache with the response (`status`, `ret`) to `cmd`,
+        the cache is cleared if `cmd` is not read-only"""
+        if self.is_cacheable(cmd):
+            if status == 200:
+                with self._lock:
+                    self._cache[cmd[self.key]] = (time.perf_counter(), ret)
+        elif not (self.readonly(cmd[self.key]) or cmd[self.key] in self.keep):
+            self.clear()
+
+    def clear(self) -> None:
+        """Remove all items from the cache"""
+        with self._lock:
+            self._cache.clear()
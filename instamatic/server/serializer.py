@@ -0,0 +1,167 @@
+import socket
+import struct
+import pickle
+import numpy as np
+from collections import namedtuple
+
+# Every message is sent as a fixed size header giving the size of the pickled payload,
+# followed by the payload itself. Numpy arrays in the message are not pickled, but replaced
+# by an `ArrayInfo` placeholder (dtype, shape), and their raw buffers are sent directly after
+# the payload in the order in which they appear.
+HEADER = struct.Struct("!Q")
+
+ArrayInfo = namedtuple("ArrayInfo", ("dtype", "shape"))
+
+
+def _extract_arrays(obj, arrays: list):
+    """Replace numpy arrays in `obj` by `ArrayInfo` placeholders, and append them to `arrays`.
+    Only looks inside tuples and lists."""
+    if isinstance(obj, np.ndarray):
+        arr = np.ascontiguousarray(obj)
+        arrays.append(arr)
+        return ArrayInfo(arr.dtype.str, arr.shape)
+    elif type(obj) in (tuple, list):
+        return type(obj)(_extract_arrays(item, arrays) for item in obj)
+    else:
+        return obj
+
+
+def _restore_arrays(obj, sock, buffers: dict=None):
+    """Replace the `ArrayInfo` placeholders in `obj` by arrays read from `sock`"""
+    if isinstance(obj, ArrayInfo):
+        return recv_array(sock, obj.dtype, obj.shape, buffers=buffers)
+    elif type(obj) in (tuple, list):
+        return type(obj)(_restore_arrays(item, sock, buffers=buffers) for item in obj)
+    else:
+        return obj
+
+
+def recv_exactly(sock, view: memoryview) -> None:
+    """Fill the writable buffer `view` with data from `sock`"""
+    view = memoryview(view).cast("B")
+    nbytes = len(view)
+    pos = 0
+    while pos < nbytes:
+        n = sock.recv_into(view[pos:], nbytes - pos)
+        if n == 0:
+            raise ConnectionError("Connection closed while receiving data")
+        pos += n
+
+
+def recv_array(sock, dtype: str, shape: tuple, buffers: dict=None) -> np.ndarray:
+    """Read the raw buffer of an array with `dtype` and `shape` from `sock`.
+
+    The data are received directly into a newly allocated array. If `buffers` is a dict,
+    arrays are reused for every (dtype, shape), so that no memory is allocated. Note that
+    in that case the contents of the array are overwritten on the next call."""
+    key = (dtype, shape)
+    if buffers is None:
+        arr = np.empty(shape, dtype=dtype)
+    else:
+        try:
+            arr = buffers[key]
+        except KeyError:
+            arr = buffers[key] = np.empty(shape, dtype=dtype)
+
+    if arr.nbytes:
+        recv_exactly(sock, arr.reshape(-1).view(np.uint8))
+    return arr
+
+
+def send_message(sock, obj) -> None:
+    """Send the python object `obj` over `sock`. Numpy arrays are sent as raw buffers."""
+    arrays = []
+    payload = pickle.dumps(_extract_arrays(obj, arrays), protocol=pickle.HIGHEST_PROTOCOL)
+
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+    for arr in arrays:
+        if arr.nbytes:
+            sock.sendall(arr.reshape(-1).view(np.uint8))
+
+
+def recv_message(sock, buffers: dict=None):
+    """Receive a python object sent using `send_message` from `sock`.
+    Returns None if the connection was closed."""
+    header = bytearray(HEADER.size)
+    try:
+        recv_exactly(sock, header)
+    except ConnectionError:
+        return None
+    size, = HEADER.unpack(header)
+
+    payload = bytearray(size)
+    recv_exactly(sock, payload)
+    obj = pickle.loads(payload)
+
+    return _restore_arrays(obj, sock, buffers=buffers)
+
+
+def benchmark(shape: tuple=(516, 516), dtype: str="int32", nframes: int=500) -> None:
+    """Loopback benchmark comparing the framed raw buffer transport
+    with the pickle transport for images of `shape` and `dtype`"""
+    import threading
+    import time
+
+    img = np.random.randint(0, 10000, size=shape).astype(dtype)
+
+    def serve_pickle(conn):
+        for n in range(nframes):
+            conn.recv(1024)
+            conn.sendall(pickle.dumps((200, img)))
+
+    def serve_framed(conn):
+        for n in range(nframes):
+            recv_message(conn)
+            send_message(conn, (200, img))
+
+    def fetch_pickle(conn):
+        bufsize = img.nbytes + 4096
+        nbytes = len(pickle.dumps((200, img)))
+        for n in range(nframes):
+            conn.send(pickle.dumps({"attr_name": "getImage"}))
+            # a single `recv` may return only part of the data, keep reading until complete
+            response = conn.recv(bufsize)
+            while len(response) < nbytes:
+                response += conn.recv(bufsize)
+            status, arr = pickle.loads(response)
+
+    def fetch_framed(conn, buffers=None):
+        for n in range(nframes):
+            send_message(conn, {"attr_name": "getImage"})
+            status, arr = recv_message(conn, buffers=buffers)
+
+    def run(server, client, **kwargs):
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.bind(("localhost", 0))
+        srv.listen(1)
+        conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        conn.connect(srv.getsockname())
+        s_conn, addr = srv.accept()
+
+        t = threading.Thread(target=server, args=(s_conn,))
+        t.start()
+        t0 = time.perf_counter()
+        client(conn, **kwargs)
+        t1 = time.perf_counter()
+        t.join()
+
+        for sock in (conn, s_conn, srv):
+            sock.close()
+
+        dt = t1 - t0
+        fps = nframes / dt
+        mbps = nframes * img.nbytes / dt / 1024**2
+        return fps, mbps
+
+    print(f"Loopback transport of {nframes} frames: {shape} {dtype} ({img.nbytes/1024:.0f} kB)")
+    for label, server, client, kwargs in (
+        ("pickle", serve_pickle, fetch_pickle, {}),
+        ("framed", serve_framed, fetch_framed, {}),
+        ("framed (reuse buffer)", serve_framed, fetch_framed, {"buffers": {}})):
+        fps, mbps = run(server, client, **kwargs)
+        print(f"{label:>22s}: {fps:8.1f} frames/s | {mbps:8.1f} MB/s")
+
+
+if __name__ == '__main__':
+    benchmark()
+    benchmark(shape=(2048, 2048), dtype="uint16", nframes=100)
@@ -0,0 +1,146 @@
+import threading
+import queue
+import socket
+import time
+import numpy as np
+
+from instamatic.server import tem_server, cam_server
+
+# Stress test for the TEM and camera servers.
+#
+# Starts both servers in this process using the simulated microscope/camera, and connects
+# `nclients` clients to each of them that make calls at the same time. Every response is
+# checked to make sure that it was routed to the connection that made the request, and the
+# throughput is reported for read-only calls (served from the cache) and for calls that
+# need to go through the hardware thread.
+
+
+def serve(server_module, server, host: str, port: int) -> None:
+    """Start `server` and accept connections on `host`:`port` in background threads"""
+    q = server.q
+    server.daemon = True
+    server.start()
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind((host, port))
+    s.listen(32)
+
+    def accept():
+        while True:
+            conn, addr = s.accept()
+            threading.Thread(target=server_module.handle, args=(conn, q), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+
+def tem_worker(n: int, ncalls: int, errors: list, timings: dict) -> None:
+    """Set/get a unique value on the microscope, and check that the correct value is returned.
+    The set/get is sent as a batch so that they are evaluated without calls from other clients in between."""
+    from instamatic.TEMController.microscope_client import MicroscopeClient
+    tem = MicroscopeClient("simulate")
+
+    t0 = time.perf_counter()
+    for i in range(ncalls):
+        value = (n, i)
+        ret = tem.batch([("setGunShift", value), ("getGunShift",)])
+        if tuple(ret[1]) != value:
+            errors.append(f"TEM client {n}: expected {value}, got {ret[1]}")
+    t1 = time.perf_counter()
+
+    for i in range(ncalls):
+        ret = tem.getStagePosition()
+        if len(ret) != 5:
+            errors.append(f"TEM client {n}: expected stage position, got {ret}")
+    t2 = time.perf_counter()
+
+    timings["tem_mutating"].append(t1 - t0)
+    timings["tem_readonly"].append(t2 - t1)
+
+
+def cam_worker(n: int, ncalls: int, errors: list, timings: dict, exposure: float=0.001) -> None:
+    """Interleave image acquisition with read-only calls and check the type of every response"""
+    from instamatic.camera.camera_client import CamClient
+    cam = CamClient("simulate")
+
+    dimensions = tuple(cam.getDimensions())
+
+    t0 = time.perf_counter()
+    for i in range(ncalls):
+        img = cam.getImage(exposure=exposure)
+        if not isinstance(img, np.ndarray) or img.shape != dimensions:
+            errors.append(f"CAM client {n}: expected image {dimensions}, got {type(img)}")
+    t1 = time.perf_counter()
+
+    for i in range(ncalls):
+        ret = cam.getName()
+        if ret != "simulate":
+            errors.append(f"CAM client {n}: expected name, got {type(ret)}")
+    t2 = time.perf_counter()
+
+    timings["cam_mutating"].append(t1 - t0)
+    timings["cam_readonly"].append(t2 - t1)
+
+
+def stress_test(nclients: int=8, ncalls: int=200) -> bool:
+    """Run `nclients` TEM clients and `nclients` camera clients simultaneously, making `ncalls` calls each.
+    Returns True if all responses were correct."""
+    serve(tem_server, tem_server.TemServer(name="simulate", q=queue.Queue(maxsize=100), verbose=False),
+          host=tem_server.HOST, port=tem_server.PORT)
+    serve(cam_server, cam_server.CamServer(name="simulate", q=queue.Queue(maxsize=100), verbose=False),
+          host=cam_server.HOST, port=cam_server.PORT)
+
+    errors = []
+    timings = {"tem_mutating": [], "tem_readonly": [], "cam_mutating": [], "cam_readonly": []}
+
+    threads = []
+    for n in range(nclients):
+        threads.append(threading.Thread(target=tem_worker, args=(n, ncalls, errors, timings)))
+        threads.append(threading.Thread(target=cam_worker, args=(n, ncalls, errors, timings)))
+
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    t1 = time.perf_counter()
+
+    print()
+    print(f"{nclients} TEM clients + {nclients} CAM clients, {ncalls} calls each ({t1-t0:.2f} s)")
+    for key, label in (("tem_mutating", "TEM set/get batch"),
+                       ("tem_readonly", "TEM getStagePosition"),
+                       ("cam_mutating", "CAM getImage"),
+                       ("cam_readonly", "CAM getName")):
+        if len(timings[key]) != nclients:
+            print(f"{label:>22s}: incomplete ({len(timings[key])}/{nclients} clients finished)")
+            continue
+        total = nclients * ncalls / max(timings[key])
+        print(f"{label:>22s}: {total:8.1f} calls/s")
+
+    for error in errors[:10]:
+        print(error)
+
+    ok = len(errors) == 0 and all(len(val) == nclients for val in timings.values())
+    print(f"Errors: {len(errors)}", "(OK)" if ok else "(FAILED)")
+    return ok
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stress test for the TEM/CAM servers using the simulated microscope and camera")
+    parser.add_argument("-n", "--clients", action="store", type=int, dest="nclients",
+                        help="""Number of clients connecting to each server""")
+    parser.add_argument("-c", "--calls", action="store", type=int, dest="ncalls",
+                        help="""Number of calls made by each client per test""")
+
+    parser.set_defaults(nclients=8,
+                        ncalls=200)
+    options = parser.parse_args()
+
+    ok = stress_test(nclients=options.nclients, ncalls=options.ncalls)
+    exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
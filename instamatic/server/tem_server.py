@@ -2,25 +2,52 @@ from instamatic import TEMController
 import threading
 import queue
 import socket
-import pickle
 import logging
 import datetime
 from instamatic import config
 from instamatic.TEMController import Microscope
+from instamatic.server.serializer import send_message, recv_message
+from instamatic.server.response_cache import ResponseCache
+from concurrent.futures import Future
 import traceback
 
 # import sys
 # sys.setswitchinterval(0.001)  # seconds
 
-condition = threading.Condition()
-box = []
-
 # HOST = 'localhost'
 # PORT = 8088
 
 HOST = config.cfg.tem_server_host
 PORT = config.cfg.tem_server_port
-BUFSIZE = 1024
+
+# time in seconds that the return values of cacheable calls are served from the cache
+CACHE_TTL = 0.1
+
+# calls starting with `get`/`is` that change the state of the microscope
+NOT_READONLY = frozenset(("getMagnificationRanges",))
+
+# read-only calls that may be answered from the cache. These values only change when they are set
+# (which clears the cache), fast-changing values (i.e. `isStageMoving`, `getStagePosition`,
+# `getScreenCurrent`) are always read from the microscope
+cacheable_calls = {"getHTValue", "getFunctionMode", "getProbeMode",
+                   "getMagnification", "getMagnificationIndex", "getSpotSize", "getBrightness",
+                   "getDiffFocus", "getFocus", "getBeamShift", "getBeamTilt", "getGunShift", "getGunTilt",
+                   "getImageShift1", "getImageShift2", "getImageBeamShift", "getDiffShift",
+                   "getCondensorLensStigmator", "getObjectiveLensStigmator", "getIntermediateLensStigmator",
+                   "isBeamBlanked", "getHolderType"}
+
+
+def is_readonly(func_name: str) -> bool:
+    """Check if the call `func_name` only reads the state of the microscope"""
+    return func_name.startswith(("get", "is")) and func_name not in NOT_READONLY
+
+
+def is_cacheable(func_name: str) -> bool:
+    """Check if the return value of `func_name` may be served from the cache"""
+    return func_name in cacheable_calls
+
+
+cache = ResponseCache(readonly=is_readonly, ttl=CACHE_TTL, cacheable=is_cacheable)
 
 
 class TemServer(threading.Thread):
@@ -28,12 +55,17 @@ class TemServer(threading.Thread):
     name of the microscope `name` that is used to initialize the connection to the microscope.
     Start the server using `TemServer.run` which will wait for items to appear on `q` and
     execute them on the specified microscope instance.
+
+    Items on the queue are tuples of the command (dict) and a `concurrent.futures.Future`,
+    which is used to send the response back to the connection that made the request.
+    All calls to the microscope are made from this thread.
     """
-    def __init__(self, log=None, q=None, name=None):
+    def __init__(self, log=None, q=None, name=None, verbose=True):
         super().__init__()
 
         self.log = log
         self.q = q
+        self.verbose = verbose
 
         # self.name is a reserved parameter for threads
         self._name = name
@@ -46,27 +78,40 @@ class TemServer(threading.Thread):
         while True:
             now = datetime.datetime.now().strftime("%H:%M:%S.%f")
             
-            cmd = self.q.get()
+            cmd, future = self.q.get()
 
-            with condition:
+            if "batch" in cmd:
+                func_name = "batch"
+                ret = [self.process(item) for item in cmd["batch"]]
+                status = 200
+            else:
                 func_name = cmd["func_name"]
-                args = cmd.get("args", ())
-                kwargs = cmd.get("kwargs", {})
-    
-                try:
-                    ret = self.evaluate(func_name, args, kwargs)
-                    status = 200
-                except Exception as e:
-                    traceback.print_exc()
-                    if self.log:
-                        self.log.exception(e)
-                    ret = e
-                    status = 500
-    
-                box.append((status, ret))
-                condition.notify()
+                status, ret = self.process(cmd)
+
+            future.set_result((status, ret))
+            if self.verbose:
                 print(f"{now} | {status} {func_name}: {ret}")
 
+    def process(self, cmd: dict) -> (int, object):
+        """Evaluate a single command, returns the status code and the return value (or exception)"""
+        func_name = cmd["func_name"]
+        args = cmd.get("args", ())
+        kwargs = cmd.get("kwargs", {})
+
+        try:
+            ret = self.evaluate(func_name, args, kwargs)
+            status = 200
+        except Exception as e:
+            traceback.print_exc()
+            if self.log:
+                self.log.exception(e)
+            ret = e
+            status = 500
+
+        cache.update(cmd, status, ret)
+
+        return status, ret
+
     def evaluate(self, func_name: str, args: list, kwargs: dict):
         """Evaluate the function `func_name` on `self.tem` with *args and **kwargs."""
         # print(func_name, args, kwargs)
@@ -77,15 +122,20 @@ class TemServer(threading.Thread):
 
 def handle(conn, q):
     """Handle incoming connection, put command on the Queue `q`,
-    which is then handled by TEMServer."""
+    which is then handled by TEMServer.
+
+    Requests are handled in the order in which they arrive, so a client can send several
+    requests before reading the responses (pipelining). The request id is sent back
+    with every response so that the client can match them.
+
+    Read-only calls are answered directly from the cache if a recent value is available,
+    so that they do not have to wait for calls from other connections."""
     with conn:
         while True:
-            data = conn.recv(BUFSIZE)
-            if not data:
+            data = recv_message(conn)
+            if data is None:
                 break
 
-            data = pickle.loads(data)
-
             if data == "exit":
                 break
 
@@ -94,11 +144,26 @@ def handle(conn, q):
                 # s.shutdown() ?
                 break
     
-            with condition:
-                q.put(data)
-                condition.wait()
-                response = box.pop()
-                conn.send(pickle.dumps(response))
+            response = get_cached_response(data)
+
+            if response is None:
+                future = Future()
+                q.put((data, future))
+                response = future.result()
+
+            status, ret = response
+            send_message(conn, (data.get("id"), status, ret))
+
+
+def get_cached_response(cmd: dict):
+    """Return the cached response (status, ret) to `cmd` if all the values are available,
+    otherwise return None"""
+    if "batch" in cmd:
+        ret = [cache.get(item) for item in cmd["batch"]]
+        if all(ret):
+            return 200, ret
+    else:
+        return cache.get(cmd)
 
 
 def main():
@@ -113,10 +178,14 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-t", "--microscope", action="store", dest="microscope",
                         help="""Override microscope to use""")
+    parser.add_argument("--cache-ttl", action="store", type=float, dest="cache_ttl",
+                        help="""Time in seconds that the values of read-only calls are served from the cache (0 to disable)""")
 
-    parser.set_defaults(microscope=None)
+    parser.set_defaults(microscope=None,
+                        cache_ttl=CACHE_TTL)
     options = parser.parse_args()
     microscope = options.microscope
+    cache.ttl = options.cache_ttl
 
     date = datetime.datetime.now().strftime("%Y-%m-%d")
     logfile = config.logs_drc / f"instamatic_TEMServer_{date}.log"
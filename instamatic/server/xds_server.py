@@ -1,15 +1,22 @@
+import sys
 import subprocess as sp
-from socket import *
 import datetime
 
 from instamatic import config
+from instamatic.server.job_queue import JobQueue, serve
 import logging
 import threading
 from pathlib import Path
 
 HOST = config.cfg.indexing_server_host
 PORT = config.cfg.indexing_server_port
-BUFF = 1024
+
+# number of XDS jobs run at the same time
+WORKERS = getattr(config.cfg, "indexing_server_workers", 2)
+
+XDS_COMMAND = "bash -c xds_par 2>&1 >/dev/null"
+# stand-in for XDS for testing, see `instamatic.server.xds_standin`
+STANDIN_COMMAND = f"{sys.executable} -m instamatic.server.xds_standin"
 
 rlock = threading.RLock()
 
@@ -42,9 +49,9 @@ def parse_xds(path):
 
     return msg
 
-def run_xds_indexing(path):
+def run_xds_indexing(path, command=XDS_COMMAND):
     """Call XDS on the given `path`. Uses WSL (Windows 10 only)."""
-    p = sp.Popen("bash -c xds_par 2>&1 >/dev/null", cwd=path)
+    p = sp.Popen(command, cwd=path, shell=sys.platform != "win32")
     p.wait()
 
     msg = parse_xds(path)
@@ -55,40 +62,29 @@ def run_xds_indexing(path):
     return msg
 
 
-def handle(conn):
-    """Handle incoming connection."""
-    ret = 0
-
-    while True:
-        data = conn.recv(BUFF).decode()
-        now = datetime.datetime.now().strftime("%H:%M:%S.%f")
-
-        if not data:
-            break
-    
-        print(f"{now} | {data}")
-        if data == "close":
-            print(f"{now} | Closing connection")
-            break
-
-        elif data == "kill":
-            print(f"{now} | Killing server")
-            ret = 1
-            break
-
-        else:
-            conn.send(b"OK")
-            msg = run_xds_indexing(data)
-            conn.send(msg.encode())
-
-    conn.send(b"Connection closed")
-    conn.close()
-    print("Connection closed")
-
-    return ret
-
-
 def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Indexing server (XDS), runs the submitted jobs in a queue")
+    parser.add_argument("-w", "--workers", action="store", type=int, dest="workers",
+                        help="""Number of XDS jobs that run at the same time""")
+    parser.add_argument("-c", "--command", action="store", dest="command",
+                        help="""Command to run XDS in the data directory""")
+    parser.add_argument("--standin", action="store_true", dest="standin",
+                        help="""Run the stand-in command instead of XDS (for testing)""")
+    parser.add_argument("--state", action="store", dest="state",
+                        help="""JSON file to keep the jobs in, unfinished jobs are resumed on restart""")
+    parser.add_argument("--port", action="store", type=int, dest="port",
+                        help="""Port to listen on""")
+
+    parser.set_defaults(workers=WORKERS,
+                        command=XDS_COMMAND,
+                        standin=False,
+                        state=config.logs_drc / "indexing_server_jobs_xds.json",
+                        port=PORT)
+    options = parser.parse_args()
+    command = STANDIN_COMMAND if options.standin else options.command
+
     date = datetime.datetime.now().strftime("%Y-%m-%d")
     logfile = config.logs_drc / f"instamatic_indexing_server_{date}.log"
     logging.basicConfig(format="%(asctime)s | %(module)s:%(lineno)s | %(levelname)s | %(message)s", 
@@ -97,20 +93,16 @@ def main():
     logging.captureWarnings(True)
     log = logging.getLogger(__name__)
 
-    s = socket(AF_INET, SOCK_STREAM)
-    s.bind((HOST,PORT))
-    s.listen(5)
+    jobs = JobQueue(lambda path: run_xds_indexing(path, command=command), workers=options.workers, state_file=options.state, name="xds")
 
-    log.info(f"Indexing server (XDS) listening on {HOST}:{PORT}")
-    print(f"Indexing server (XDS) listening on {HOST}:{PORT}")
+    log.info(f"Indexing server (XDS) listening on {HOST}:{options.port}")
+    log.info(f"Running command: {command} ({options.workers} workers)")
+    print(f"Indexing server (XDS) listening on {HOST}:{options.port}")
+    print(f"Running command: {command} ({options.workers} workers)")
+    print(jobs)
 
-    with s:
-        while True:
-            conn, addr = s.accept()
-            log.info('Connected by %s', addr)
-            print('Connected by', addr)
-            threading.Thread(target=handle, args=(conn,)).start()
+    serve(jobs, HOST, options.port, log=log)
 
     
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
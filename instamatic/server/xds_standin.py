@@ -0,0 +1,50 @@
+"""Stand-in for `xds_par` to test the indexing server without XDS.
+
+Waits `--delay` seconds and writes a minimal `CORRECT.LP` to the working directory
+that can be read by `instamatic.utils.xds_parser`. With `--fail`, no file is written.
+
+    python -m instamatic.server.xds_standin --delay 2
+"""
+import argparse
+import time
+from pathlib import Path
+
+
+CORRECT_LP = """\
+ SPACE GROUP NUMBER      1
+ UNIT CELL PARAMETERS     10.000    11.000    12.000  90.000  90.000  90.000
+ UNIT_CELL_CONSTANTS=    10.000    11.000    12.000  90.000  90.000  90.000 as used by INTEGRATE
+     a        b          ISa
+  1.000E+00  1.000E-03    9.99
+   WILSON LINE (using all data) : A=   1.000 B=  10.000 CORRELATION=   0.99
+   --------------------------------------------------------------------------
+   20.00   0.80
+ SUBSET OF INTENSITY DATA WITH SIGNAL/NOISE >= -3.0 AS FUNCTION OF RESOLUTION
+ RESOLUTION     NUMBER OF REFLECTIONS    COMPLETENESS R-FACTOR  R-FACTOR COMPARED I/SIGMA   R-meas  CC(1/2)  Anomal  SigAno   Nano
+   LIMIT     OBSERVED  UNIQUE  POSSIBLE     OF DATA   observed  expected                                      Corr
+
+     2.00        1000     500       600       83.3%       5.0%      5.5%      900   10.00      6.0%    99.0*    10    0.900     100
+     1.00        2000    1000      1200       83.3%      15.0%     16.0%     1800    3.00     18.0%    90.0*     5    0.800     200
+     0.80        1000     500       600       83.3%      50.0%     55.0%      900    0.50     60.0%    30.0*     0    0.700     100
+    total        4000    2000      2400       83.3%      10.0%     11.0%     3600    4.00     12.0%    95.0*     5    0.800     400
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delay", action="store", type=float, dest="delay",
+                        help="""Time in seconds to wait before writing the output""")
+    parser.add_argument("--fail", action="store_true", dest="fail",
+                        help="""Do not write `CORRECT.LP`, as if indexing failed""")
+
+    parser.set_defaults(delay=1.0, fail=False)
+    options = parser.parse_args()
+
+    time.sleep(options.delay)
+
+    if not options.fail:
+        Path("CORRECT.LP").write_text(CORRECT_LP)
+
+
+if __name__ == '__main__':
+    main()
@@ -143,13 +143,13 @@ def find_peak_max(arr: np.ndarray, sigma: int, m: int=50, w: int=10, kind: int=3
     try:
         r1 = np.linspace(c1-w, c1+w, win_len)
         f  = interpolate.interp1d(r1, y1[c1-w: c1+w+1], kind=kind)
-        r2 = np.linspace(c1-w, c1+w, win_len*m)  # extrapolate for subpixel accuracy
+        r2 = np.linspace(c1-w, c1+w, 2*w*m+1)  # extrapolate for subpixel accuracy, step 1/m
         y2 = f(r2)
-        c2 = np.argmax(y2) / m  # find beam center with `m` precision
+        c2 = r2[np.argmax(y2)]  # find beam center with `m` precision
     except ValueError as e:  # if c1 is too close to the edges, return initial guess
         return c1
 
-    return c2 + c1 - w
+    return c2
 
 
 def find_beam_center(img: np.ndarray, sigma: int=30, m: int=100, kind: int=3) -> (float, float):
@@ -167,6 +167,96 @@ def find_beam_center(img: np.ndarray, sigma: int=30, m: int=100, kind: int=3) ->
     return center
 
 
+def find_peak_max_batch(arr: np.ndarray, sigma: int, w: int=10) -> np.ndarray:
+    """Find the index of the peak maximum for every row in the 2D array `arr` (N, L)
+    The rows are smoothed using a gaussian filter with standard deviation `sigma`, and
+    the position of the largest value is refined by fitting a parabola through it and its
+    two neighbours, which gives subpixel precision for the (smooth) filtered peak.
+    Rows where the maximum is within `w` pixels of the edge return the initial guess,
+    as in `find_peak_max`."""
+    y1 = ndimage.filters.gaussian_filter1d(np.asarray(arr, dtype=float), sigma, axis=-1)
+    c1 = np.argmax(y1, axis=-1)
+
+    n, length = y1.shape
+    rows = np.arange(n)
+    inside = (c1 >= w) & (c1 < length - w)
+    c = np.clip(c1, 1, length - 2)
+
+    ym = y1[rows, c - 1]
+    y0 = y1[rows, c]
+    yp = y1[rows, c + 1]
+    denom = ym - 2*y0 + yp
+    offset = np.divide(ym - yp, 2*denom, out=np.zeros(n), where=denom < 0)
+
+    return np.where(inside, c + np.clip(offset, -0.5, 0.5), c1)
+
+
+def find_beam_centers(stack, sigma: int=30, use_beamstop: bool=False, z: int=99, workers: int=None) -> np.ndarray:
+    """Find the center of the primary beam for all images in `stack`
+    `stack` can be a 3D array (N, H, W) or a sequence of 2D images. Returns an (N, 2) array.
+
+    The projections along X/Y are smoothed and their maxima located with subpixel precision
+    for all frames at once (see `find_peak_max_batch`).
+
+    If `use_beamstop` is set, `find_beam_center_with_beamstop` is used instead (with percentile `z`)
+    which cannot be vectorized, the frames are then distributed over a pool of `workers` processes."""
+    if use_beamstop:
+        from concurrent.futures import ProcessPoolExecutor
+        from functools import partial
+
+        func = partial(find_beam_center_with_beamstop, z=z)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            centers = list(executor.map(func, stack, chunksize=16))
+        return np.array(centers, dtype=float).reshape(-1, 2)
+
+    if isinstance(stack, np.ndarray) and stack.ndim == 3:
+        xx = np.sum(stack, axis=2)
+        yy = np.sum(stack, axis=1)
+    else:
+        # single pass, so that `stack` can be a generator
+        xx, yy = [], []
+        for img in stack:
+            xx.append(np.sum(img, axis=1))
+            yy.append(np.sum(img, axis=0))
+        xx = np.array(xx)
+        yy = np.array(yy)
+
+    if len(xx) == 0:
+        return np.empty((0, 2))
+
+    cx = find_peak_max_batch(xx, sigma)
+    cy = find_peak_max_batch(yy, sigma)
+
+    return np.stack([cx, cy], axis=1)
+
+
+def benchmark_find_beam_centers(nframes: int=1000, shape: tuple=(516, 516), sigma: int=10) -> None:
+    """Compare `find_beam_centers` with calling `find_beam_center` for every frame
+    on simulated diffraction patterns with a gaussian primary beam"""
+    import time
+
+    rng = np.random.RandomState(0)
+    true = np.array(shape) / 2 + rng.uniform(-20, 20, size=(nframes, 2))
+    ii, jj = np.mgrid[0:shape[0], 0:shape[1]]
+
+    stack = np.empty((nframes, *shape), dtype=np.float32)
+    for n, (x, y) in enumerate(true):
+        beam = 5000 * np.exp(-((ii - x)**2 + (jj - y)**2) / (2 * 3.0**2))
+        stack[n] = rng.poisson(beam + 5)
+
+    t0 = time.perf_counter()
+    ref = np.array([find_beam_center(img, sigma=sigma) for img in stack])
+    t1 = time.perf_counter()
+    new = find_beam_centers(stack, sigma=sigma)
+    t2 = time.perf_counter()
+
+    print(f"{nframes} frames {shape}")
+    print(f"  find_beam_center (loop): {(t1-t0)*1000:8.1f} ms")
+    print(f"  find_beam_centers      : {(t2-t1)*1000:8.1f} ms ({(t1-t0)/(t2-t1):.1f}x)")
+    print(f"  max difference         : {np.abs(ref - new).max():.3f} px")
+    print(f"  rms error (loop/batch) : {np.sqrt(np.mean((ref - true)**2)):.3f} / {np.sqrt(np.mean((new - true)**2)):.3f} px")
+
+
 def find_beam_center_with_beamstop(img, z: int=None, method="thresh", plot=False) -> (float, float):
     """Find the beam center when a beam stop is present. 
 
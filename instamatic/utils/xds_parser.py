@@ -2,10 +2,24 @@ import sys
 from pathlib import Path
 import os
 import time
+import pickle
 from math import radians, cos
 import shutil
 
 
+# markers of the lines in `CORRECT.LP` that are read, the last occurrence is used
+MARKER_BLOCK = " SUBSET OF INTENSITY DATA WITH SIGNAL/NOISE >= -3.0 AS FUNCTION OF RESOLUTION"
+MARKER_TOTAL = "    total"
+MARKER_CELL = " UNIT CELL PARAMETERS"
+MARKER_RAW_CELL = "as used by INTEGRATE\n"
+MARKER_SPGR = " SPACE GROUP NUMBER"
+MARKER_ISA = "     a        b          ISa"
+MARKER_WILSON = "   WILSON LINE (using all data)"
+MARKER_RESOLUTION = "   --------------------------------------------------------------------------"
+
+INDEX_FILE = ".xds_parser_index.pkl"
+
+
 def volume(cell):
     """Returns volume for the general case from cell parameters"""
     a, b, c, al, be, ga = cell
@@ -18,16 +32,182 @@ def volume(cell):
     return vol
 
 
+class ParseIndex(object):
+    """On-disk cache of parsed `CORRECT.LP` files, keyed by path, modification time and size,
+    so that unchanged files are not parsed again"""
+    def __init__(self, filename=INDEX_FILE):
+        super(ParseIndex, self).__init__()
+        self.filename = Path(filename)
+        self.entries = {}
+        self.changed = False
+
+        if self.filename.exists():
+            try:
+                with open(self.filename, "rb") as f:
+                    self.entries = pickle.load(f)
+            except Exception:
+                print(f"Cannot read index `{self.filename}`, starting a new one")
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(fn):
+        st = os.stat(fn)
+        return str(fn), st.st_mtime_ns, st.st_size
+
+    def get(self, fn):
+        """Return (True, d) if `fn` is in the index and unchanged, else (False, None)"""
+        path, mtime, size = self.key(fn)
+        entry = self.entries.get(path)
+        if entry and entry[0] == mtime and entry[1] == size:
+            return True, entry[2]
+        return False, None
+
+    def put(self, fn, d):
+        path, mtime, size = self.key(fn)
+        self.entries[path] = (mtime, size, d)
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp = self.filename.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(self.entries, f)
+        os.replace(tmp, self.filename)
+        self.changed = False
+
+
 class xds_parser(object):
     """docstring for xds_parser"""
-    def __init__(self, filename):
+    def __init__(self, filename, index=None, d=None):
+        """index: `ParseIndex`, results are taken from/stored in the index
+        d: already parsed results (see `parse_many`)"""
         super(xds_parser, self).__init__()
         self.ios_threshold = 0.8
         
         self.filename = Path(filename).resolve()
+
+        if d is not None:
+            self.d = d
+            return
+
+        if index is not None:
+            found, d = index.get(self.filename)
+            if found:
+                self.d = d
+                return
+
         self.d = self.parse()
 
+        if index is not None:
+            index.put(self.filename, self.d)
+
     def parse(self):
+        """Read `CORRECT.LP` at once, and parse only the lines following the section markers"""
+        fn = self.filename
+
+        with open(fn, "r") as f:
+            text = "\n" + f.read()
+
+        def line_at(i):
+            j = text.find("\n", i)
+            return text[i:] if j < 0 else text[i:j]
+
+        def last_line(marker, offset=0):
+            """Last line starting with `marker`, or the line `offset` lines below it"""
+            i = text.rfind("\n" + marker)
+            if i < 0:
+                # same error as an unassigned variable in `parse_loop`, which callers expect
+                raise UnboundLocalError(f"`{marker.strip()}` not found in {fn}")
+            i += 1
+            for _ in range(offset):
+                i = text.find("\n", i) + 1
+            return line_at(i)
+
+        cell = list(map(float, last_line(MARKER_CELL).split()[3:9]))
+
+        i = text.rfind(MARKER_RAW_CELL)
+        if i < 0:
+            raise UnboundLocalError(f"`{MARKER_RAW_CELL.strip()}` not found in {fn}")
+        raw_cell = list(map(float, line_at(text.rfind("\n", 0, i) + 1).split()[1:7]))
+
+        ISa = float(last_line(MARKER_ISA, offset=1).split()[2])
+        Boverall = float(last_line(MARKER_WILSON).split()[-3])
+
+        start = text.rfind("\n" + MARKER_BLOCK)
+        if start < 0:
+            block = []
+        else:
+            # up to and including the first `total` line
+            end = text.find("\n" + MARKER_TOTAL, start + 1)
+            if end >= 0:
+                end = text.find("\n", end + 1)
+            if end < 0:
+                end = len(text)
+            block = text[start+1:end].split("\n")
+
+        d = self.parse_block(block, cell=cell, raw_cell=raw_cell, ISa=ISa, Boverall=Boverall)
+        if d is None:
+            return
+
+        d["res_range"] = tuple(map(float, last_line(MARKER_RESOLUTION, offset=1).split()[0:2]))
+        d["spgr"] = int(last_line(MARKER_SPGR).split()[-1])
+
+        return d
+
+    def parse_block(self, block, cell, raw_cell, ISa, Boverall):
+        """Parse the table of statistics as function of resolution, returns None if it is empty"""
+        ios_threshold = self.ios_threshold
+        fn = self.filename
+
+        d = {}
+        d["ISa"] = ISa
+        d["Boverall"] = Boverall
+    
+        dmin = 999
+    
+        for line in block:
+            inp = line.split()
+            if len(inp) != 14:
+                continue
+    
+            try:
+                res = float(inp[0])
+            except ValueError:
+                res = inp[0]
+                if res != "total":
+                    continue
+    
+            res = float(inp[0]) if inp[0] != "total" else inp[0]
+            ntot, nuniq, completeness = int(inp[1]), int(inp[2]), float(inp[4].strip("%"))
+            ios, rmeas, cchalf = float(inp[8]), float(inp[9].strip("%")), float(inp[10].strip("*"))
+    
+            if ios < ios_threshold and res != "total":
+                continue
+    
+            if (res != "total") and (res < dmin):
+                shell = (dmin, res)
+                dmin = res
+    
+            d[res] = {"ntot": ntot, "nuniq": nuniq, "completeness": completeness, "ios": ios, "rmeas": rmeas, "cchalf": cchalf}
+    
+        if dmin == 999:
+            return
+    
+        d["outer"] = dmin
+        d["outer_shell"] = shell
+        d["volume"] = volume(cell)
+        d["cell"] = cell
+        d["raw_cell"] = raw_cell
+        d["raw_volume"] = volume(raw_cell)
+        d["fn"] = fn
+
+        return d
+
+    def parse_loop(self):
+        """Line by line parser, reference for `benchmark`"""
         ios_threshold = self.ios_threshold
 
         fn = self.filename
@@ -236,6 +416,82 @@ def gather_xds_ascii(ps, min_completeness=10.0, min_cchalf=90.0):
             print(f" {i: 3d} {dst} {dmax:8.2f} {dmin:8.2f}  # {fn}", file=f)  
 
 
+def _parse_file(fn):
+    """Parse `fn`, returns None if it cannot be parsed"""
+    try:
+        return xds_parser(fn).d
+    except UnboundLocalError:
+        return None
+
+
+def parse_many(fns, index=None, workers: int=None) -> list:
+    """Parse the `CORRECT.LP` files in `fns` in parallel with `workers` processes (0 to parse
+    serially), files found unchanged in `index` (`ParseIndex`) are not read.
+    Returns the `xds_parser` instances of the files that could be parsed."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = {}
+    todo = []
+    for fn in fns:
+        found, d = index.get(fn) if index is not None else (False, None)
+        if found:
+            results[fn] = d
+        else:
+            todo.append(fn)
+
+    if workers == 0 or len(todo) < 2:
+        parsed = map(_parse_file, todo)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        parsed = executor.map(_parse_file, todo, chunksize=max(1, len(todo) // (4 * (executor._max_workers))))
+
+    for fn, d in zip(todo, parsed):
+        results[fn] = d
+        if index is not None:
+            index.put(fn, d)
+
+    if todo and workers != 0 and len(todo) >= 2:
+        executor.shutdown()
+    if index is not None:
+        index.save()
+
+    return [xds_parser(fn, d=results[fn]) for fn in fns if results[fn]]
+
+
+TABLE_COLUMNS = ("spgr", "a", "b", "c", "al", "be", "ga", "volume", "ISa", "Boverall", "dmin", "ntot", "nuniq", "completeness", "ios", "rmeas", "cchalf", "fn")
+
+
+def summary_table(ps) -> list:
+    """Rows (dicts with `TABLE_COLUMNS`) with the cell and the overall statistics of `xds_parser` instances"""
+    rows = []
+    for p in ps:
+        d = p.d
+        row = p.cell_as_dict()
+        row.update(d["total"])
+        row["ISa"] = d["ISa"]
+        row["Boverall"] = d["Boverall"]
+        row["dmin"] = d["res_range"][1]
+        row["fn"] = str(p.filename)
+        rows.append({key: row[key] for key in TABLE_COLUMNS})
+    return rows
+
+
+def write_table(rows, out="xds_summary.csv"):
+    """Write the rows from `summary_table` to a csv file"""
+    import csv
+
+    with open(out, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_table(rows):
+    print("  #  spgr       a       b       c      al      be      ga    volume    ISa  dmin  compl  CC(1/2)  fn")
+    for i, row in enumerate(rows):
+        print("{i: 3d} {spgr: 5d}{a: 8.2f}{b: 8.2f}{c: 8.2f}{al: 8.2f}{be: 8.2f}{ga: 8.2f}{volume: 10.1f}{ISa: 7.2f}{dmin: 6.2f}{completeness: 7.1f}{cchalf: 9.1f}  {fn}".format(i=i, **row))
+
+
 def parse_fns(fns):
     """Parse list of filenames"""
     new_fns = []
@@ -249,26 +505,71 @@ def parse_fns(fns):
     return new_fns
 
 
+def benchmark(fn, n: int=100) -> None:
+    """Compare `parse` with the line by line `parse_loop` and with reading from the `ParseIndex`"""
+    import tempfile
+
+    p = xds_parser(fn)
+
+    t0 = time.perf_counter()
+    for i in range(n):
+        d_loop = p.parse_loop()
+    t1 = time.perf_counter()
+    for i in range(n):
+        d = p.parse()
+    t2 = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as drc:
+        index = ParseIndex(Path(drc) / INDEX_FILE)
+        xds_parser(fn, index=index)
+        index.save()
+        index = ParseIndex(Path(drc) / INDEX_FILE)
+        t3 = time.perf_counter()
+        for i in range(n):
+            xds_parser(fn, index=index)
+        t4 = time.perf_counter()
+
+    print(f"{fn} ({os.path.getsize(fn) / 1024:.0f} kB), identical results: {d == d_loop}")
+    print(f"parse_loop: {(t1 - t0) * 1000 / n:.3f} ms/file")
+    print(f"parse:      {(t2 - t1) * 1000 / n:.3f} ms/file")
+    print(f"index:      {(t4 - t3) * 1000 / n:.3f} ms/file")
+
+
 def main():
-    fns = sys.argv[1:]
-    
-    if not fns:
-        fns = [Path(".")]
-    else:
-        fns = [Path(fn) for fn in fns]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize the XDS results (`CORRECT.LP`) in the given files/directories")
+    parser.add_argument("args", nargs="*", metavar="PATH",
+                        help="""Files or directories (searched recursively) with `CORRECT.LP`, default: current directory""")
+    parser.add_argument("-t", "--table", action="store", dest="table",
+                        help="""Only write the summary table to this csv file""")
+    parser.add_argument("-j", "--workers", action="store", type=int, dest="workers",
+                        help="""Number of processes used for parsing (0: no parallel parsing)""")
+    parser.add_argument("--index", action="store", dest="index",
+                        help="""File to cache the parsed results in""")
+    parser.add_argument("--no-index", action="store_false", dest="use_index",
+                        help="""Do not cache the parsed results""")
+
+    parser.set_defaults(table=None,
+                        workers=None,
+                        index=INDEX_FILE,
+                        use_index=True)
+    options = parser.parse_args()
+
+    fns = [Path(fn) for fn in options.args] or [Path(".")]
     
     fns = parse_fns(fns)
     print(f"Found {len(fns)} files matching CORRECT.LP\n")
-    
-    xdsall = []
-    for fn in fns:
-        try:
-            p = xds_parser(fn)
-        except UnboundLocalError:
-            continue
-        else:
-            if p.d:
-                xdsall.append(p)
+
+    index = ParseIndex(options.index) if options.use_index else None
+    xdsall = parse_many(fns, index=index, workers=options.workers)
+
+    if options.table:
+        rows = summary_table(xdsall)
+        print_table(rows)
+        write_table(rows, options.table)
+        print(f"\nSummary of {len(rows)} datasets written to `{options.table}`")
+        return
     
     for i, p in enumerate(xdsall):
         print(p.cell_info(sequence=i))
@@ -5,7 +5,7 @@ import sys, glob
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
-from instamatic.tools import find_beam_center, find_subranges
+from instamatic.tools import find_beam_centers, find_subranges
 import tqdm
 
 
@@ -99,8 +99,7 @@ if __name__ == '__main__':
         print(len(fns))
         
         imgs = (adscimage.read_adsc(fn)[0] for fn in tqdm.tqdm(fns))
-        centers = (find_beam_center(img, 10, m=50, kind=3) for img in imgs)
-        xy = np.array(list(centers))
+        xy = find_beam_centers(imgs, sigma=10)
         
         np.savetxt(Path(fns[0]).parents[0] / "beam_centers.txt", xy, fmt="%10.4f")
 
@@ -1,6 +1,8 @@
 from instamatic.processing.ImgConversionTVIPS import ImgConversionTVIPS as ImgConversion
 from instamatic.formats import read_tiff
 import glob, sys
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
 import numpy as np
@@ -25,12 +27,69 @@ all `cred_log.txt` files in the subdirectories, and iterate over those.
 """
 
 
+# number of threads reading the tiff files, also limits the number of open files
+WORKERS = 8
+
+Frame = namedtuple("Frame", ["number", "fn", "time", "exposure", "header"])
+
+
 def extract_image_number(s):
     p = Path(s)
     return int(p.stem.split("_")[-1])
 
 
-def img_convert(credlog, tiff_path=None, mrc_path="RED", smv_path="SMV"):
+def read_tvips_header(fn) -> dict:
+    """Read only the TVIPS metadata tag of the first page, the pixel data are not read"""
+    with tifffile.TiffFile(fn) as tif:
+        return tif.tvips_metadata
+
+
+def scan_headers(image_fns: list, workers: int=WORKERS) -> list:
+    """Read the TVIPS headers of `image_fns` in parallel and return the frame index,
+    a list of `Frame` (number, fn, time, exposure, header) sorted by frame number"""
+    image_numbers = [extract_image_number(fn) for fn in image_fns]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        headers = list(executor.map(read_tvips_header, image_fns))
+
+    frames = [Frame(number, fn, h["Time"], h["ExposureTime"], h) for number, fn, h in zip(image_numbers, image_fns, headers)]
+    # sort by frame number (avoid confusion with _9.tif -> _10.tif)
+    return sorted(frames, key=itemgetter(0))
+
+
+def read_image(fn) -> np.ndarray:
+    """Read the pixel data of `fn` as uint16, the file is closed afterwards"""
+    with tifffile.TiffFile(fn) as tif:
+        img = tif.asarray()
+
+    if img.dtype.type is np.int16:
+        if img.min() >= 0 and img.max() < 2**16:
+            img = img.astype(np.uint16)
+
+    assert img.dtype.type is np.uint16, f"Image ({fn.stem}) dtype is {img.dtype} (must be np.uint16)"
+
+    return img
+
+
+def stream_images(image_fns: list, workers: int=WORKERS, readahead: int=None):
+    """Yield the images of `image_fns` in order. The files are read by `workers` threads,
+    at most `readahead` (default: 2 * `workers`) files are read ahead of the consumer,
+    so that memory use and the number of open files stay bounded."""
+    if readahead is None:
+        readahead = 2 * workers
+
+    fns = iter(image_fns)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque(executor.submit(read_image, fn) for _, fn in zip(range(readahead), fns))
+        while pending:
+            img = pending.popleft().result()
+            fn = next(fns, None)
+            if fn is not None:
+                pending.append(executor.submit(read_image, fn))
+            yield img
+
+
+def img_convert(credlog, tiff_path=None, mrc_path="RED", smv_path="SMV", workers: int=WORKERS):
     credlog = Path(credlog)
     drc = credlog.parent
     
@@ -38,10 +97,6 @@ def img_convert(credlog, tiff_path=None, mrc_path="RED", smv_path="SMV"):
 
     image_fns = list(drc.glob(pattern))
 
-    # sort by frame number (avoid confusion with _9.tif -> _10.tif)
-    image_numbers = [extract_image_number(fn) for fn in image_fns]
-    image_numbers, image_fns = zip(*sorted(zip(image_numbers, image_fns)))
-
     nframes = len(image_fns)
     if nframes == 0:
         print(f"No files found matching `{pattern}`")
@@ -49,13 +104,14 @@ def img_convert(credlog, tiff_path=None, mrc_path="RED", smv_path="SMV"):
     else:
         print(nframes)
 
-    ims = [tifffile.TiffFile(fn) for fn in image_fns]
-    hs = [im.tvips_metadata for im in ims]
+    # headers only, the pixel data are read once while converting
+    frames = scan_headers(image_fns, workers=workers)
+    image_fns = [frame.fn for frame in frames]
 
-    ts = [h["Time"] for h in hs]  # sort by timestamps
+    ts = [frame.time for frame in frames]
     
-    h0 = hs[0]
-    exposure_time = h0["ExposureTime"]
+    h0 = frames[0].header
+    exposure_time = frames[0].exposure
 
     res = get_acquisition_time(timestamps=ts, exp_time=exposure_time, savefig=True, drc=drc)
     acquisition_time = res.acquisition_time
@@ -148,29 +204,13 @@ def img_convert(credlog, tiff_path=None, mrc_path="RED", smv_path="SMV"):
     assert pixelsize_x_tvips == pixelsize_y_tvips, "Pixelsize is different in X / Y direction"
     assert physical_pixelsize_x_tvips == physical_pixelsize_y_tvips, "Physical pixelsize is different in X / Y direction"
 
-    buffer = []
+    h = {"ImageGetTime": timestamp, "ImageExposureTime": exposure_time}
 
-    print()
-    print("Reading data")
-    for i, fn in enumerate(image_fns):
-        j = i + 1  # j must be 1-indexed
+    # j must be 1-indexed
+    buffer = ((j, img, dict(h)) for j, img in enumerate(stream_images(image_fns, workers=workers), start=1))
 
-        im = ims[i]
-        h = hs[i]
-
-        img = im.asarray()
-
-        if img.dtype.type is np.int16:
-            if img.min() >= 0 and img.max() < 2**16:
-                img = img.astype(np.uint16)
-
-        assert img.dtype.type is np.uint16, f"Image (#{i}:{fn.stem}) dtype is {img.dtype} (must be np.uint16)"
-
-        h = {"ImageGetTime": timestamp, "ImageExposureTime": exposure_time}
-
-        buffer.append((j, img, h))
-
-    print("Setting up image conversion")
+    print()
+    print("Reading data and setting up image conversion")
     img_conv = ImgConversion(buffer=buffer,
          osc_angle=osc_angle,
          start_angle=start_angle,
@@ -202,7 +242,7 @@ def img_convert(credlog, tiff_path=None, mrc_path="RED", smv_path="SMV"):
     img_conv.threadpoolwriter(tiff_path=tiff_path,
                               mrc_path=mrc_path,
                               smv_path=smv_path,
-                              workers=8)
+                              workers=workers)
     
     print("Writing input files")
     if mrc_path:
@@ -11,10 +11,15 @@ def main():
     try:
         fn = sys.argv[1]
     except:
-        print("Usage: instamatic.viewer IMG.tiff")
+        print("Usage: instamatic.viewer IMG.tiff [FRAME]")
         exit()
 
-    img, h = read_image(fn)
+    # stacks (MRC/HDF5) are mapped/opened lazily, only the requested frame is read
+    img, h = read_image(fn, mmap=True)
+    if img.ndim == 3:
+        frame = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+        print(f"Stack with {img.shape[0]} frames, showing frame {frame}")
+        img = np.asarray(img[frame])
 
     print("""Loading data: {}
         size: {} kB